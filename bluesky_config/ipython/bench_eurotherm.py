@@ -0,0 +1,140 @@
+"""
+Set-completion latency and thread count of many Eurotherm-style controllers.
+
+Serves --controllers copies of caproto's thermo_sim IOC (prefixes bench0:,
+bench1:, ...) from a subprocess, then sets every Thermo device at once, with the
+Timer-per-set implementation Eurotherm used to have and with the current one.
+Latency is from set() to the status finishing, threads are the peak count while
+the sets are in progress. The old implementation's callback errors (restarting a
+finished Timer) are not logged.
+
+    python3 bench_eurotherm.py --controllers 50 --rounds 3
+"""
+import argparse
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+os.environ.setdefault("EPICS_CA_ADDR_LIST", "127.0.0.1")
+os.environ.setdefault("EPICS_CA_AUTO_ADDR_LIST", "NO")
+
+from ophyd import DeviceStatus  # noqa: E402
+
+from localdevs import SetInProgress, Thermo  # noqa: E402
+
+IOC = """
+import sys
+from caproto.ioc_examples.thermo_sim import Thermo
+from caproto.server import run
+
+pvdb = {}
+for i in range(int(sys.argv[1])):
+    pvdb.update(Thermo(prefix=f"bench{i}:").pvdb)
+run(pvdb, interfaces=["127.0.0.1"], log_pv_names=False)
+"""
+
+
+class LegacyThermo(Thermo):
+    "Thermo with the Eurotherm.set that started a threading.Timer per set."
+
+    def set(self, value):
+        if not self._set_lock.acquire(blocking=False):
+            raise SetInProgress(f"attempting to set {self.name} while a set is busy")
+        set_value = value
+        status = DeviceStatus(self)
+        initial_timestamp = None
+        equilibrium_time = self.equilibrium_time.get()
+        tolerance = self.tolerance.get()
+
+        def timer_cleanup():
+            self._set_lock.release()
+            self.readback.clear_sub(status_indicator)
+            status._finished(success=False)
+
+        self._cb_timer = threading.Timer(self.timeout.get(), timer_cleanup)
+
+        def status_indicator(value, timestamp, **kwargs):
+            if not self._cb_timer.is_alive():
+                self._cb_timer.start()
+            nonlocal initial_timestamp
+            if abs(value - set_value) < tolerance:
+                if initial_timestamp:
+                    if (timestamp - initial_timestamp) > equilibrium_time:
+                        status._finished()
+                        self._cb_timer.cancel()
+                        self._set_lock.release()
+                        self.readback.clear_sub(status_indicator)
+                else:
+                    initial_timestamp = timestamp
+            else:
+                initial_timestamp = None
+
+        self.setpoint.put(set_value)
+        self.readback.subscribe(status_indicator)
+        return status
+
+
+def set_all(devices, value):
+    "Set every device to value at once; latencies in s and the peak thread count."
+    latencies = []
+    lock = threading.Lock()
+    peak = threading.active_count()
+    t0 = time.monotonic()
+
+    def done(status):
+        with lock:
+            latencies.append(time.monotonic() - t0)
+
+    statuses = [device.set(value) for device in devices]
+    for status in statuses:
+        status.add_callback(done)
+    while not all(status.done for status in statuses):
+        peak = max(peak, threading.active_count())
+        time.sleep(0.01)
+    return latencies, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Eurotherm set benchmark")
+    parser.add_argument("--controllers", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--equilibrium_time", type=float, default=1.0)
+    parser.add_argument("--K", type=float, default=0.5, help="thermo_sim decay (s)")
+    args = parser.parse_args()
+    logging.getLogger("ophyd").setLevel(logging.CRITICAL)
+    logging.getLogger("caproto").setLevel(logging.CRITICAL)
+    threading.excepthook = lambda args: None
+
+    ioc = subprocess.Popen([sys.executable, "-c", IOC, str(args.controllers)])
+    try:
+        print(f"{'implementation':>15} {'median s':>9} {'max s':>7} {'threads':>8}")
+        for cls in (LegacyThermo, Thermo):
+            devices = [
+                cls(f"bench{i}:", name=f"bench{i}") for i in range(args.controllers)
+            ]
+            for device in devices:
+                device.wait_for_connection(timeout=30)
+                device.K.put(args.K)
+                device.equilibrium_time.put(args.equilibrium_time)
+                device.timeout.put(60)
+            latencies, peaks = [], []
+            for i in range(args.rounds):
+                round_latencies, peak = set_all(devices, 100 + 20 * (i % 2 + 1))
+                latencies += round_latencies
+                peaks.append(peak)
+            print(
+                f"{cls.__name__:>15} {statistics.median(latencies):9.2f} "
+                f"{max(latencies):7.2f} {max(peaks):8d}"
+            )
+            for device in devices:
+                device.destroy()
+    finally:
+        ioc.terminate()
+
+
+if __name__ == "__main__":
+    main()
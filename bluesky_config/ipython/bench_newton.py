@@ -0,0 +1,63 @@
+"""
+Frames per second of the NewtonDirectSimulator stand-in detector.
+
+Compares the image computation as it used to be done on every trigger (ogrid,
+hypot and the arcsin/tan field rebuilt for each frame) with the precomputed
+phase, one frame at a time and rendered in batches, in float64 and float32.
+
+    python3 bench_newton.py --sizes 128,2048 --frames 64 --batch 16
+"""
+import argparse
+import time
+
+import numpy as np
+
+from localdevs import NewtonDirectSimulator, _newton_phase
+
+
+def newton_rings(gap, shape, R=10, k=1):
+    "NewtonDirectSimulator._newton before the phase was precomputed."
+    X, Y = np.ogrid[-10 : 10 : shape[0] * 1j, -10 : 10 : shape[1] * 1j]
+    d = np.hypot(X, Y)
+    phi = ((gap + d * np.tan(np.pi / 2 - np.arcsin(d / R))) * 2) * k
+    return 1 + np.cos(phi)
+
+
+def fps(render, gaps, batch):
+    "Frames per second rendering gaps, batch frames per call."
+    render(gaps[:batch])
+    t0 = time.perf_counter()
+    for i in range(0, len(gaps), batch):
+        render(gaps[i : i + batch])
+    return len(gaps) / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NewtonDirectSimulator benchmark")
+    parser.add_argument("--sizes", type=str, default="128,2048")
+    parser.add_argument("--frames", type=int, default=64)
+    parser.add_argument("--batch", type=int, default=16)
+    args = parser.parse_args()
+
+    gaps = np.linspace(0, 5, args.frames)
+    print(f"{'shape':>10} {'method':>24} {'frames/s':>10} {'speedup':>8}")
+    with np.errstate(invalid="ignore"):
+        for size in map(int, args.sizes.split(",")):
+            shape = (size, size)
+            label = f"{size}x{size}"
+            before = fps(lambda g: newton_rings(g[0], shape), gaps, 1)
+            print(f"{label:>10} {'before':>24} {before:10.1f} {1:8.1f}")
+            for dtype in (np.float64, np.float32):
+                _newton_phase.cache_clear()
+                det = NewtonDirectSimulator(10, 1, shape=shape, dtype=dtype, name="det")
+                name = np.dtype(dtype).name
+                for method, batch in (
+                    (f"render(1), {name}", 1),
+                    (f"render({args.batch}), {name}", args.batch),
+                ):
+                    rate = fps(det.render, gaps, batch)
+                    print(f"{label:>10} {method:>24} {rate:10.1f} {rate / before:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
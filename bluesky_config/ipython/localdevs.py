@@ -1,26 +1,53 @@
 """Special use handler for training."""
 
+import functools
+import heapq
+import itertools
+import logging
 import threading
+import time
 import numpy as np
 
 from ophyd import Device, Component as Cpt, Signal, DeviceStatus
 from ophyd.device import Staged
 from ophyd.signal import EpicsSignal, EpicsSignalRO
 
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=8)
+def _newton_phase(R, k, shape, dtype):
+    """
+    The gap-independent part of the Newton's rings phase,
+    ``2 k d tan(pi/2 - arcsin(d/R))``.
+
+    Computed once per geometry and kept read-only, as every frame of a
+    simulator shares it.
+    """
+    X, Y = np.ogrid[-10 : 10 : shape[0] * 1j, -10 : 10 : shape[1] * 1j]
+    d = np.hypot(X, Y)
+    with np.errstate(invalid="ignore"):
+        # beyond the sphere (d > R) the phase is nan, as it always was
+        phase = (d * np.tan(np.pi / 2 - np.arcsin(d / R)) * 2 * k).astype(dtype)
+    phase.flags.writeable = False
+    return phase
+
 
 class NewtonDirectSimulator(Device):
     gap = Cpt(Signal, value=0, kind="hinted")
     image = Cpt(Signal, kind="normal")
 
     @staticmethod
-    def _newton(gap, R, k):
+    def _newton(gap, R, k, shape=(128, 128), dtype=np.float64):
         """
         Simulate Newton's Rings.
 
         Parameters
         ----------
-        gap : float
-            The closest distance between the sphere and the surface
+        gap : float or array
+            The closest distance between the sphere and the surface. For an
+            array of gaps the result has one frame per gap, along the first
+            axis.
 
         R : float
             Radius of the sphere
@@ -28,21 +55,42 @@ class NewtonDirectSimulator(Device):
         k : float
             Wave number of the incoming light
 
-        """
-        X, Y = np.ogrid[-10:10:128j, -10:10:128j]
-        d = np.hypot(X, Y)
-        phi = ((gap + d * np.tan(np.pi / 2 - np.arcsin(d / R))) * 2) * k
+        shape : tuple, optional
+            Pixels of the image, over the same [-10, 10] square.
+
+        dtype : np.dtype, optional
+            Type of the image.
 
-        return 1 + np.cos(phi)
+        """
+        phase = _newton_phase(R, k, tuple(shape), np.dtype(dtype))
+        gap = np.asarray(gap, dtype=phase.dtype)
+        out = np.add.outer(gap * (2 * k), phase)
+        np.cos(out, out=out)
+        out += 1
+        return out
 
     def _compute(self):
-        self.image.put(self._newton(self.gap.get(), self._R, self._k))
+        self.image.put(
+            self._newton(self.gap.get(), self._R, self._k, self._shape, self._dtype)
+        )
 
-    def __init__(self, R, k, **kwargs):
+    def __init__(self, R, k, *, shape=(128, 128), dtype=np.float64, **kwargs):
         super().__init__(**kwargs)
         self._R = R
         self._k = k
-        self.image.put(self._compute())
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+        self._compute()
+
+    def render(self, gaps):
+        """
+        Frames for a whole vector of gaps in one vectorized call.
+
+        Does not touch the signals; useful to feed pipeline throughput tests.
+        Returns an array of shape ``(len(gaps), *shape)``.
+        """
+        gaps = np.asarray(gaps)
+        return self._newton(gaps, self._R, self._k, self._shape, self._dtype)
 
     def trigger(self):
         if self._staged != Staged.yes:
@@ -75,6 +123,93 @@ class Spot(Device):
 class SetInProgress(RuntimeError): ...
 
 
+class _Scheduler:
+    """
+    One daemon thread that runs the delayed callbacks of every Eurotherm.
+
+    A ``threading.Timer`` per set costs a thread per controller with a set in
+    progress; this keeps a heap of deadlines served by a single thread,
+    started on first use.
+    """
+
+    class Handle:
+        __slots__ = ("callback", "cancelled")
+
+        def __init__(self, callback):
+            self.callback = callback
+            self.cancelled = False
+
+        def cancel(self):
+            self.cancelled = True
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def call_later(self, delay, callback):
+        """Run ``callback()`` on the scheduler thread after ``delay`` seconds."""
+        handle = self.Handle(callback)
+        with self._condition:
+            heapq.heappush(
+                self._heap, (time.monotonic() + delay, next(self._counter), handle)
+            )
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="eurotherm-scheduler", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+        return handle
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    wait = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._condition.wait(wait)
+                _, _, handle = heapq.heappop(self._heap)
+            if handle.cancelled:
+                continue
+            try:
+                handle.callback()
+            except Exception:
+                logger.exception("Scheduled callback %r failed", handle.callback)
+
+
+_scheduler = _Scheduler()
+
+
+class EquilibriumDetector:
+    """
+    Whether a readback has stayed within ``tolerance`` of ``target`` for
+    ``equilibrium_time``, updated in O(1) per readback.
+
+    Every sample of the trailing window is in the band exactly when the last
+    sample outside of it is older than the window, so only the time the
+    readback last entered the band is kept.
+    """
+
+    def __init__(self, target, tolerance, equilibrium_time):
+        self.target = target
+        self.tolerance = tolerance
+        self.equilibrium_time = equilibrium_time
+        # timestamp of the first of the samples in the band, None when out of it
+        self.entered = None
+
+    def update(self, value, timestamp):
+        """Add a readback sample; returns True once equilibrium is reached."""
+        if abs(value - self.target) >= self.tolerance:
+            self.entered = None
+        elif self.entered is None:
+            self.entered = timestamp
+        return self.settled(timestamp)
+
+    def settled(self, now):
+        return self.entered is not None and now - self.entered >= self.equilibrium_time
+
+
 class Eurotherm(Device):
     """
     Copied from nslsii package to remove dependency on nslsii.
@@ -90,6 +225,10 @@ class Eurotherm(Device):
     attribute, `self.timeout`, is used to determeine the maximum time to wait
     for equilibrium. If it takes longer than this it raises a TimeoutError.
 
+    The timeouts and equilibrium checks of all Eurotherm devices share one
+    scheduler thread, and a set completes ``equilibrium_time`` after the
+    readback settled within tolerance, without waiting for a further update.
+
     Parameters
     ----------
     pv_prefix : str.
@@ -99,10 +238,10 @@ class Eurotherm(Device):
     def __init__(self, pv_prefix, **kwargs):
         super().__init__(pv_prefix, **kwargs)
         self._set_lock = threading.Lock()
-
-        # defining these here so that they can be used by `set` and `start`
-        self._cb_timer = None
-        self._cid = None
+        # guards _set_in_progress, the (status, timeout handle, callback) of the
+        # set in progress, which is finished exactly once
+        self._state_lock = threading.Lock()
+        self._set_in_progress = None
 
     # Setup some new signals required for the moving indicator logic
     equilibrium_time = Cpt(Signal, value=5, kind="config")
@@ -121,64 +260,79 @@ class Eurotherm(Device):
                 "attempting to set {} ".format(self.name) + "while a set is in progress"
             )
 
-        # define some required values
-        set_value = value
         status = DeviceStatus(self)
-
-        initial_timestamp = None
-
-        # grab these values here to avoidmutliple calls.
-        equilibrium_time = self.equilibrium_time.get()
-        tolerance = self.tolerance.get()
-
-        # setup a cleanup function for the timer, this matches including
-        # timeout in `status` but also ensures that the callback is removed.
-        def timer_cleanup():
-            print(
-                "Set of {} timed out after {} s".format(self.name, self.timeout.get())
+        detector = EquilibriumDetector(
+            value, self.tolerance.get(), self.equilibrium_time.get()
+        )
+        timeout = self.timeout.get()
+
+        def on_timeout():
+            self._finish(
+                status,
+                TimeoutError(f"Set of {self.name} timed out after {timeout} s"),
             )
-            self._set_lock.release()
-            self.readback.clear_sub(status_indicator)
-            status._finished(success=False)
 
-        self._cb_timer = threading.Timer(self.timeout.get(), timer_cleanup)
+        def on_settled():
+            if detector.settled(time.time()):
+                self._finish(status)
 
-        # set up the done moving indicator logic
         def status_indicator(value, timestamp, **kwargs):
-            # add a Timer to ensure that timeout occurs.
-            if not self._cb_timer.is_alive():
-                self._cb_timer.start()
-
-            nonlocal initial_timestamp
-            if abs(value - set_value) < tolerance:
-                if initial_timestamp:
-                    if (timestamp - initial_timestamp) > equilibrium_time:
-                        status._finished()
-                        self._cb_timer.cancel()
-                        self._set_lock.release()
-                        self.readback.clear_sub(status_indicator)
-                else:
-                    initial_timestamp = timestamp
-            else:
-                initial_timestamp = None
+            was_in_band = detector.entered is not None
+            if detector.update(value, timestamp):
+                self._finish(status)
+            elif not was_in_band and detector.entered is not None:
+                # done at the end of the window if the readback stays in band,
+                # even if it does not update again
+                delay = detector.entered + detector.equilibrium_time - time.time()
+                _scheduler.call_later(max(delay, 0), on_settled)
+
+        timeout_handle = _scheduler.call_later(timeout, on_timeout)
+        with self._state_lock:
+            self._set_in_progress = (status, timeout_handle, status_indicator)
 
         # Start the move.
-        self.setpoint.put(set_value)
+        self.setpoint.put(value)
 
         # subscribe to the read value to indicate the set is done.
-        self._cid = self.readback.subscribe(status_indicator)
+        self.readback.subscribe(status_indicator)
+        # the timeout or stop() may have finished the set before there was a
+        # subscription for _finish to clear
+        with self._state_lock:
+            finished = (
+                self._set_in_progress is None or self._set_in_progress[0] is not status
+            )
+        if finished:
+            self.readback.clear_sub(status_indicator)
 
         # hand the status object back to the RE
         return status
 
-    def stop(self, success=False):
-        # overide the lock, cancel the timer and remove the subscription on any
-        # in progress sets
+    def _finish(self, status, exc=None):
+        """Finish the set of status, unless it was already finished."""
+        with self._state_lock:
+            if self._set_in_progress is None or self._set_in_progress[0] is not status:
+                return
+            _, timeout_handle, status_indicator = self._set_in_progress
+            self._set_in_progress = None
+        timeout_handle.cancel()
+        self.readback.clear_sub(status_indicator)
         self._set_lock.release()
-        self._cb_timer.cancel()
-        self.readback.unsubscribe(self._cid)
+        if exc is None:
+            status.set_finished()
+        else:
+            status.set_exception(exc)
+
+    def stop(self, success=False):
+        # fail any in progress set, cancelling its timeout and removing its
+        # subscription
+        with self._state_lock:
+            in_progress = self._set_in_progress
+        if in_progress is not None:
+            self._finish(
+                in_progress[0], RuntimeError(f"Set of {self.name} was stopped")
+            )
         # set the controller to the current value (best option we came up with)
-        self.set(self.readback.get())
+        self.setpoint.put(self.readback.get())
 
 
 class Thermo(Eurotherm):
@@ -1,47 +1,99 @@
-import json
-import logging
-from functools import partial
-from queue import Empty
-
-import bluesky.plans as bp
-import databroker
-import happi
-import happi.loader
-import IPython
-import matplotlib.pyplot as plt
-import msgpack
-import msgpack_numpy as mpn
-import redis
-from bluesky import RunEngine
-from bluesky.callbacks.best_effort import BestEffortCallback
-from bluesky.callbacks.zmq import Publisher as zmqPublisher
-from bluesky.plans import *
-from bluesky_kafka import Publisher as kafkaPublisher
-from bluesky_queueserver import is_re_worker_active
+# the headless queue server worker skips the GUI and plotting setup, and the
+# catalog and producer clients are built on first use; the time each stage of
+# opening the environment takes is printed at the end
+from startup import Deferred, StartupProfiler
+
+profiler = StartupProfiler()
+
+with profiler.stage("import stdlib"):
+    import atexit
+    import logging
+    import os
+    import sys
+
+with profiler.stage("import bluesky"):
+    import bluesky.plans as bp
+    from bluesky import RunEngine
+    from bluesky.plans import *
+    from bluesky_queueserver import is_re_worker_active
+
+with profiler.stage("import happi"):
+    import happi
+    import happi.loader
+
+with profiler.stage("import pod modules"):
+    from lazy_devices import LazyDevices
+    from offload import ArrayOffloader
+    from partitioning import RunKeyedPublisher
+    from publishing import AsyncPublisher, FanOutPublisher, ZmqSink
+    from redis_queue import RedisQueue
+    from serializers import get_serializer
 
 # from bluesky_adaptive.per_start import adaptive_plan # This is incompatible with the queue-server (default args)
 
-ip = IPython.get_ipython()
-
-hclient = happi.Client(path="/usr/local/share/happi/test_db.json")
-db = databroker.catalog["MAD"]
-
-RE = RunEngine()
-bec = BestEffortCallback()
-
-zmq_publisher = zmqPublisher("zmq-proxy:4567")
-kafka_publisher = kafkaPublisher(
-    topic="mad.bluesky.documents",
-    bootstrap_servers="kafka:29092",
-    key="kafka-unit-test-key",
-    # work with a single broker
-    producer_config={
-        "acks": 1,
-        "enable.idempotence": False,
-        "request.timeout.ms": 5000,
-    },
-    serializer=partial(msgpack.dumps, default=mpn.encode),
+# an IPython session has imported IPython already, the worker need not
+ip = sys.modules["IPython"].get_ipython() if "IPython" in sys.modules else None
+headless = is_re_worker_active()
+
+with profiler.stage("happi client"):
+    hclient = happi.Client(path="/usr/local/share/happi/test_db.json")
+
+
+def open_catalog():
+    import databroker
+
+    return databroker.catalog["MAD"]
+
+
+db = Deferred(open_catalog, name="catalog", profiler=profiler)
+
+with profiler.stage("RunEngine"):
+    RE = RunEngine()
+
+if not headless:
+    with profiler.stage("import matplotlib"):
+        import matplotlib.pyplot as plt
+        from bluesky.callbacks.best_effort import BestEffortCallback
+
+    bec = BestEffortCallback()
+
+serializer = get_serializer()
+
+
+# the documents are msgpack-encoded on the 0MQ proxy too, not pickled, so
+# RemoteDispatchers need deserializer=get_serializer().loads
+zmq_publisher = Deferred(
+    lambda: ZmqSink("zmq-proxy:4567"), name="zmq publisher", profiler=profiler
 )
+# key by run uid so concurrent runs spread over the topic's partitions
+kafka_publisher = Deferred(
+    lambda: RunKeyedPublisher(
+        topic="mad.bluesky.documents",
+        bootstrap_servers="kafka:29092",
+        # work with a single broker
+        producer_config={
+            "acks": 1,
+            "enable.idempotence": False,
+            "request.timeout.ms": 5000,
+            "compression.type": "lz4",
+            "linger.ms": 5,
+        },
+        serializer=serializer.dumps,
+    ),
+    name="kafka publisher",
+    profiler=profiler,
+)
+# encode each document once for both transports, and do it on a background
+# thread so the RunEngine never waits on the broker (except to flush at the
+# end of each run). Large arrays are written to the shared data volume and
+# only referenced from the events, keeping messages under the broker limit.
+document_publisher = AsyncPublisher(
+    ArrayOffloader(
+        FanOutPublisher({"kafka": kafka_publisher, "zmq": zmq_publisher}),
+        root="/nsls2/data/mad",
+    )
+)
+atexit.register(document_publisher.close)
 
 logger = logging.getLogger("databroker")
 logger.setLevel("DEBUG")
@@ -49,59 +101,58 @@ handler = logging.StreamHandler()
 handler.setLevel("DEBUG")
 logger.addHandler(handler)
 
-RE.subscribe(zmq_publisher)
-RE.subscribe(kafka_publisher)
-RE.subscribe(bec)
-
-to_recommender = kafkaPublisher(
-    topic="adaptive",
-    bootstrap_servers="kafka:9092",
-    key="kafka-unit-test-key",
-    # work with a single broker
-    producer_config={
-        "acks": 1,
-        "enable.idempotence": False,
-        "request.timeout.ms": 5000,
-    },
-    serializer=partial(msgpack.dumps, default=mpn.encode),
+RE.subscribe(document_publisher)
+if not headless:
+    RE.subscribe(bec)
+
+to_recommender = Deferred(
+    lambda: RunKeyedPublisher(
+        topic="adaptive",
+        bootstrap_servers="kafka:9092",
+        # work with a single broker
+        producer_config={
+            "acks": 1,
+            "enable.idempotence": False,
+            "request.timeout.ms": 5000,
+        },
+        serializer=serializer.dumps,
+    ),
+    name="recommender publisher",
+    profiler=profiler,
 )
 
-
-class RedisQueue:
-    def __init__(self, client):
-        self.client = client
-
-    def put(self, value):
-        self.client.lpush("adaptive", json.dumps(value))
-
-    def get(self, timeout=0, block=True):
-        if block:
-            ret = self.client.blpop("adaptive", timeout=timeout)
-            if ret is None:
-                raise TimeoutError
-            return json.loads(ret[1])
-        else:
-            ret = self.client.lpop("adaptive")
-            if ret is not None:
-                return json.loads(ret)
-            else:
-                raise Empty
-
-
-from_recommender = RedisQueue(redis.StrictRedis(host="localhost", port=6379, db=0))
+from_recommender = RedisQueue(host="localhost", port=6379, db=0)
 # you may have to run this twice to "prime the topics" the first time you run it
 # RE(adaptive_plan([det], {motor: 0}, to_recommender=to_recommender, from_recommender=from_recommender))
 
 
-devs = {v.name: v for v in [happi.loader.from_container(_) for _ in hclient.all_items]}
-
-if ip is not None:
-    ip.user_ns.update(devs)
-elif is_re_worker_active():
-    globals().update(devs)
+# devices are instantiated and connected on first use, and those a plan is called
+# with are connected in parallel before it starts; BLUESKY_POD_DEVICES=eager loads
+# them all here instead
+with profiler.stage("devices"):
+    if os.environ.get("BLUESKY_POD_DEVICES", "lazy") == "eager":
+        devs = {v.name: v for v in [happi.loader.from_container(_) for _ in hclient.all_items]}
+    else:
+        devs = LazyDevices(hclient.all_items)
+        RE.preprocessors.append(devs.prefetch)
+
+    if ip is not None:
+        namespace = ip.user_ns
+    elif headless:
+        namespace = globals()
+    else:
+        namespace = None
+    if namespace is not None:
+        if isinstance(devs, LazyDevices):
+            devs.install(namespace)
+        else:
+            namespace.update(devs)
 
 # do from another
 # http POST 0.0.0.0:8081/add_to_queue plan:='{"plan":"scan", "args":[["det"], "motor", -1, 1, 10]}'
 # http POST 0.0.0.0:8081/add_to_queue plan:='{"plan":"count", "args":[["det"]]}'
 
-plt.ion()
+if not headless:
+    plt.ion()
+
+profiler.finish()
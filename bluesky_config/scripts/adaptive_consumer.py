@@ -1,16 +1,12 @@
-import json
-
-import redis
-
 from bluesky_adaptive import recommendations
 from bluesky_adaptive import per_start
 
 
-import msgpack
-import msgpack_numpy as mpn
-from functools import partial
 from bluesky_kafka import RemoteDispatcher
 
+from redis_queue import RedisQueue
+from serializers import get_serializer
+
 
 d = RemoteDispatcher(
     topics=["adaptive"],
@@ -20,22 +16,17 @@ d = RemoteDispatcher(
     # has been failing on Linux, passing on OSX
     consumer_config={"auto.offset.reset": "latest"},
     polling_duration=1.0,
-    deserializer=partial(msgpack.loads, object_hook=mpn.decode),
+    deserializer=get_serializer().loads,
 )
 
 
-class RedisQueue:
-    "fake just enough of the queue.Queue API on top of redis"
-
-    def __init__(self, client):
-        self.client = client
-
+class VerboseQueue(RedisQueue):
     def put(self, value):
         print(f"pushing {value}")
-        self.client.lpush("adaptive", json.dumps(value))
+        super().put(value)
 
 
-rq = RedisQueue(redis.StrictRedis(host="localhost", port=6379, db=0))
+rq = VerboseQueue(host="localhost", port=6379, db=0)
 
 adaptive_obj = recommendations.StepRecommender(1.5)
 independent_keys = ["motor"]
@@ -0,0 +1,223 @@
+import logging
+import time
+from collections import defaultdict
+
+import event_model
+from confluent_kafka import KafkaError, KafkaException
+
+from bluesky_kafka import MongoConsumer
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingMongoConsumer(MongoConsumer):
+    """
+    MongoConsumer that buffers events and datums and writes them in bulk.
+
+    Events are buffered per descriptor and datums per resource. When the
+    total number of buffered documents reaches ``batch_size``, when the oldest
+    buffered document is older than ``batch_timeout`` seconds, or when a stop
+    document arrives, every buffer is packed into an event_page/datum_page and
+    handed to the suitcase serializer, which writes each page with a single
+    ``insert_many``.
+
+    Start, descriptor and resource documents are written as they arrive so
+    that a run's events are never visible before the documents they refer to,
+    and the stop document is only written after all of the run's events.
+
+    Kafka offsets are committed only once every buffer is empty, so a crash
+    replays (at least) the documents that were not yet written. Duplicates
+    from a replay are tolerated by the serializer.
+
+    A failed write would otherwise be logged by the polling loop, which would
+    then carry on and commit past the document at the next flush. Instead,
+    once a write has failed nothing more is committed, not even by
+    ``close``, and ``on_exception`` ends the polling loop, so the process is
+    restarted and resumes from the last commit:
+
+        consumer.start_polling(on_exception=consumer.on_exception)
+
+    Parameters
+    ----------
+    batch_size : int
+        Number of buffered events and datums that triggers a flush.
+    batch_timeout : float
+        Maximum time in seconds a document may wait in a buffer.
+    *args, **kwargs
+        Passed through to MongoConsumer.
+    """
+
+    def __init__(self, *args, batch_size=1000, batch_timeout=1.0, **kwargs):
+        consumer_config = dict(kwargs.pop("consumer_config", None) or {})
+        # offsets are committed by hand after each flush
+        consumer_config["enable.auto.commit"] = False
+        super().__init__(*args, consumer_config=consumer_config, **kwargs)
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+
+        # (topic, descriptor uid) -> [event, ...]
+        self._events = defaultdict(list)
+        # (topic, resource uid) -> [datum, ...]
+        self._datums = defaultdict(list)
+        self._n_buffered = 0
+        self._oldest = None
+        # the first write error, after which nothing is committed
+        self.write_error = None
+
+        # bookkeeping for the docs/s report of each run
+        self._descriptor_run = {}
+        self._runs = {}
+        self._n_written = 0
+        self._t_started = time.monotonic()
+
+        self.subscribe(self._topics)
+
+    def process_document(self, topic, name, doc):
+        if name == "event":
+            self._buffer(self._events, (topic, doc["descriptor"]), doc)
+            self._count(self._descriptor_run.get(doc["descriptor"]))
+        elif name == "datum":
+            self._buffer(self._datums, (topic, doc["resource"]), doc)
+        elif name == "stop":
+            self.flush()
+            self._write(topic, name, doc)
+            self._commit()
+            self._report_run(doc)
+        else:
+            if name in ("event_page", "datum_page"):
+                # keep pages behind anything already buffered
+                self.flush()
+                if name == "event_page":
+                    self._count(
+                        self._descriptor_run.get(doc["descriptor"]), len(doc["uid"])
+                    )
+            if name == "start":
+                self._runs[doc["uid"]] = [time.monotonic(), 0]
+            elif name == "descriptor":
+                self._descriptor_run[doc["uid"]] = doc["run_start"]
+            self._write(topic, name, doc)
+        self.flush_if_due()
+        return True
+
+    def flush_if_due(self):
+        """
+        Flush and commit if the size or time threshold has been reached.
+
+        This is cheap enough to call between every poll.
+        """
+        if not self._n_buffered:
+            return
+        if (
+            self._n_buffered >= self.batch_size
+            or time.monotonic() - self._oldest >= self.batch_timeout
+        ):
+            self.flush()
+            self._commit()
+
+    def flush(self):
+        """Write every buffered event and datum as one page per descriptor/resource."""
+        # datums first, events may refer to them; the buffers are kept until
+        # every page is written
+        for (topic, resource), datums in self._datums.items():
+            self._write(topic, "datum_page", event_model.pack_datum_page(*datums))
+        for (topic, descriptor), events in self._events.items():
+            self._write(topic, "event_page", event_model.pack_event_page(*events))
+        self._datums.clear()
+        self._events.clear()
+        self._n_buffered = 0
+        self._oldest = None
+
+    def subscribe(self, topics, on_assign=None):
+        """(Re)subscribe to topics, flushing before any partition is revoked."""
+        if on_assign is None:
+            self._consumer.subscribe(topics=topics, on_revoke=self._on_revoke)
+        else:
+            self._consumer.subscribe(
+                topics=topics, on_assign=on_assign, on_revoke=self._on_revoke
+            )
+
+    def close(self):
+        if self.write_error is None:
+            self.flush()
+            self._commit()
+        super().close()
+
+    def on_exception(self, exception):
+        """
+        on_exception callback for start_polling: end the loop after a failed write.
+
+        Other exceptions, such as a message that cannot be deserialized, are
+        only logged, as bluesky_kafka does by default.
+        """
+        if self.write_error is not None:
+            raise RuntimeError(
+                "stopped consuming after a failed write, uncommitted documents "
+                "will be consumed again on restart"
+            ) from self.write_error
+
+    @property
+    def documents_per_second(self):
+        "Average insert rate since this consumer was created."
+        return self._n_written / (time.monotonic() - self._t_started)
+
+    def _on_revoke(self, consumer, partitions):
+        if self.write_error is not None:
+            return
+        logger.info("flushing before %d partitions are revoked", len(partitions))
+        self.flush()
+        self._commit()
+
+    def _buffer(self, buffers, key, doc):
+        if not self._n_buffered:
+            self._oldest = time.monotonic()
+        buffers[key].append(doc)
+        self._n_buffered += 1
+
+    def _write(self, topic, name, doc):
+        try:
+            self._serializers[topic](name, doc)
+        except Exception as err:
+            if self.write_error is None:
+                self.write_error = err
+            raise
+        if name == "event_page":
+            self._n_written += len(doc["uid"])
+        elif name == "datum_page":
+            self._n_written += len(doc["datum_id"])
+        else:
+            self._n_written += 1
+
+    def _count(self, run_uid, n=1):
+        if run_uid in self._runs:
+            self._runs[run_uid][1] += n
+
+    def _commit(self):
+        if self.write_error is not None:
+            raise RuntimeError(
+                "not committing past a failed write"
+            ) from self.write_error
+        try:
+            self._consumer.commit(asynchronous=False)
+        except KafkaException as err:
+            # nothing consumed since the last commit
+            if err.args[0].code() != KafkaError._NO_OFFSET:
+                raise
+
+    def _report_run(self, stop_doc):
+        run_uid = stop_doc["run_start"]
+        t0, n_events = self._runs.pop(run_uid, (None, 0))
+        self._descriptor_run = {
+            k: v for k, v in self._descriptor_run.items() if v != run_uid
+        }
+        if t0 is None:
+            return
+        elapsed = time.monotonic() - t0
+        logger.info(
+            "run %s: inserted %d events in %.2f s (%.0f events/s), "
+            "%.0f docs/s sustained overall",
+            run_uid,
+            n_events,
+            elapsed,
+            n_events / elapsed if elapsed else float("nan"),
+            self.documents_per_second,
+        )
@@ -0,0 +1,107 @@
+"""
+Environment-open time with the happi devices loaded eagerly and lazily.
+
+Builds a temporary happi database of --devices simulated axes, each taking
+--connect seconds to connect, and times opening it as 00-base.py does with
+BLUESKY_POD_DEVICES=eager and with the default lazy devices. Then times the
+first scan over --scanned of the lazy devices, with the devices connected one
+at a time on first use and with the RunEngine prefetching them in parallel.
+
+    python3 bench_devices.py --devices 200 --connect 0.05 --scanned 10
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import happi
+import happi.loader
+from ophyd.sim import SynAxis
+
+from lazy_devices import LazyDevices
+
+
+class SlowAxis(SynAxis):
+    "SynAxis that takes CONNECT seconds to connect, like a device over Channel Access."
+
+    CONNECT = 0.0
+
+    def wait_for_connection(self, *args, **kwargs):
+        time.sleep(self.CONNECT)
+
+
+def make_db(path, n):
+    items = {
+        f"axis{i}": dict(
+            _id=f"axis{i}",
+            active=True,
+            args=[],
+            device_class="bench_devices.SlowAxis",
+            documentation=None,
+            kwargs={"name": "{{name}}"},
+            name=f"axis{i}",
+            type="OphydItem",
+        )
+        for i in range(n)
+    }
+    with open(path, "w") as f:
+        json.dump(items, f)
+
+
+def eager(hclient):
+    "00-base.py's eager loading, connecting each device as ophyd would on first use."
+    devs = {v.name: v for v in [happi.loader.from_container(_) for _ in hclient.all_items]}
+    for dev in devs.values():
+        dev.wait_for_connection()
+    return devs
+
+
+def first_scan(devs, names, prefetch):
+    from bluesky import RunEngine
+    from bluesky.plans import scan
+
+    RE = RunEngine()
+    if prefetch:
+        RE.preprocessors.append(devs.prefetch)
+    motors = [devs[name] for name in names]
+    args = [arg for motor in motors for arg in (motor, -1, 1)]
+    t0 = time.monotonic()
+    RE(scan([], *args, 2))
+    return time.monotonic() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="lazy happi device benchmark")
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--connect", type=float, default=0.05, help="seconds")
+    parser.add_argument("--scanned", type=int, default=10)
+    args = parser.parse_args()
+    # the happi items name this module, so the class must come from it
+    import bench_devices
+
+    bench_devices.SlowAxis.CONNECT = args.connect
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "db.json")
+        make_db(path, args.devices)
+        hclient = happi.Client(path=path)
+        names = [f"axis{i}" for i in range(args.scanned)]
+
+        print(f"{'mode':>30} {'seconds':>8}")
+        t0 = time.monotonic()
+        eager(hclient)
+        print(f"{'open, eager':>30} {time.monotonic() - t0:8.2f}")
+        for prefetch in (False, True):
+            happi.loader.cache.clear()
+            t0 = time.monotonic()
+            devs = LazyDevices(hclient.all_items)
+            if not prefetch:
+                print(f"{'open, lazy':>30} {time.monotonic() - t0:8.2f}")
+            seconds = first_scan(devs, names, prefetch)
+            mode = "prefetched" if prefetch else "serial"
+            print(f"{f'first scan of {args.scanned}, {mode}':>30} {seconds:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Per-document publishing overhead as sinks are added.
+
+Compares subscribing N independent publishers, each of which encodes every
+document itself, with one FanOutPublisher that encodes once and hands the
+bytes to N sinks. The sinks are in-memory stand-ins for 0MQ/Kafka/file so
+only encoding and framing are measured.
+
+    python3 bench_fanout.py --sinks 4 --repeat 200
+"""
+import argparse
+import time
+
+import msgpack
+import numpy as np
+from event_model import compose_run
+
+from publishing import FanOutPublisher
+from serializers import get_serializer
+
+serializer = get_serializer().dumps
+
+
+class EncodingPublisher:
+    "What every publisher does today: encode (name, doc) and send it."
+
+    def __init__(self):
+        self.sent = 0
+
+    def __call__(self, name, doc):
+        self.sent += len(serializer((name, doc)))
+
+
+class NullSink:
+    "Frame pre-encoded bytes the way the Kafka and file sinks do."
+
+    def __init__(self):
+        self.sent = 0
+
+    def publish_encoded(self, name, doc, payload):
+        self.sent += len(b"\x92" + msgpack.packb(name) + payload)
+
+
+def make_events(shape, n):
+    run = compose_run()
+    descriptor = run.compose_descriptor(
+        name="primary",
+        data_keys={
+            "image": {"dtype": "array", "shape": list(shape), "source": "sim"},
+            "gap": {"dtype": "number", "shape": [], "source": "sim"},
+        },
+    )
+    return [
+        descriptor.compose_event(
+            data={"image": np.random.random(shape), "gap": float(i)},
+            timestamps={"image": 0.0, "gap": 0.0},
+        )
+        for i in range(n)
+    ]
+
+
+def time_per_doc(callback, events):
+    t0 = time.perf_counter()
+    for event in events:
+        callback("event", event)
+    return (time.perf_counter() - t0) / len(events) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fan-out publishing benchmark")
+    parser.add_argument("--sinks", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    for label, shape in [("scalar", ()), ("128x128", (128, 128))]:
+        events = make_events(shape, args.repeat)
+        print(f"{label} events, µs per document")
+        print(f"{'sinks':>6} {'separate':>10} {'fan-out':>10}")
+        for n in range(1, args.sinks + 1):
+            publishers = [EncodingPublisher() for _ in range(n)]
+
+            def separate(name, doc):
+                for publisher in publishers:
+                    publisher(name, doc)
+
+            fan_out = FanOutPublisher(
+                {str(i): NullSink() for i in range(n)}, serializer=serializer
+            )
+            print(
+                f"{n:>6} {time_per_doc(separate, events):10.1f} "
+                f"{time_per_doc(fan_out, events):10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Compare consumer-group throughput with a fixed Kafka key and with run keys.
+
+Publishes the same interleaved set of synthetic runs to two fresh topics,
+once with a constant key (as the profile used to) and once keyed by run uid,
+then drains each topic with a group of consumer processes that spend
+``--work_ms`` per document to stand in for a Mongo insert.
+
+    python3 bench_partitioning.py --kafka_server=kafka:29092 --consumers=4
+"""
+import argparse
+import multiprocessing
+import time
+import uuid
+from collections import Counter
+
+from confluent_kafka import Consumer
+from event_model import compose_run
+
+from bluesky_kafka import Publisher
+
+from partitioning import RunKeyedPublisher, ensure_topic
+from serializers import get_serializer
+
+serializer = get_serializer()
+
+
+def make_runs(n_runs, n_events):
+    "Documents of n_runs runs, interleaved as if the runs were concurrent."
+    runs = []
+    for _ in range(n_runs):
+        run = compose_run()
+        descriptor = run.compose_descriptor(
+            name="primary",
+            data_keys={"x": {"dtype": "number", "shape": [], "source": "sim"}},
+        )
+        docs = [("start", run.start_doc), ("descriptor", descriptor.descriptor_doc)]
+        docs.extend(
+            ("event", descriptor.compose_event(data={"x": i}, timestamps={"x": 0.0}))
+            for i in range(n_events)
+        )
+        docs.append(("stop", run.compose_stop()))
+        runs.append(docs)
+    for step in range(max(map(len, runs))):
+        for docs in runs:
+            if step < len(docs):
+                yield docs[step]
+
+
+def publish(publisher_class, topic, docs, **kwargs):
+    partitions = Counter()
+
+    def on_delivery(err, msg):
+        if err is None:
+            partitions[msg.partition()] += 1
+
+    publisher = publisher_class(
+        topic=topic,
+        bootstrap_servers=args.kafka_server,
+        producer_config={"acks": 1, "enable.idempotence": False},
+        on_delivery=on_delivery,
+        serializer=serializer.dumps,
+        **kwargs,
+    )
+    for name, doc in docs:
+        publisher(name, doc)
+    publisher.flush()
+    return partitions
+
+
+def drain(topic, group_id, expected, work_s, consumed, results):
+    consumer = Consumer(
+        {
+            "bootstrap.servers": args.kafka_server,
+            "group.id": group_id,
+            "auto.offset.reset": "earliest",
+        }
+    )
+    consumer.subscribe([topic])
+    first = last = None
+    count = 0
+    last_seq = {}
+    in_order = True
+    while consumed.value < expected:
+        msg = consumer.poll(0.2)
+        if msg is None or msg.error():
+            continue
+        name, doc = serializer.loads(msg.value())
+        if name == "event":
+            in_order &= doc["seq_num"] > last_seq.get(doc["descriptor"], 0)
+            last_seq[doc["descriptor"]] = doc["seq_num"]
+        time.sleep(work_s)
+        first = first or time.monotonic()
+        last = time.monotonic()
+        count += 1
+        with consumed.get_lock():
+            consumed.value += 1
+    consumer.close()
+    results.put((first, last, count, in_order))
+
+
+def measure(label, publisher_class, docs, **kwargs):
+    topic = f"bench.partitioning.{label}.{uuid.uuid4().hex[:8]}"
+    ensure_topic(args.kafka_server, topic, args.partitions)
+    partitions = publish(publisher_class, topic, docs, **kwargs)
+
+    ctx = multiprocessing.get_context("fork")
+    consumed = ctx.Value("Q", 0)
+    results = ctx.Queue()
+    workers = [
+        ctx.Process(
+            target=drain,
+            args=(topic, topic, len(docs), args.work_ms / 1000, consumed, results),
+        )
+        for _ in range(args.consumers)
+    ]
+    for worker in workers:
+        worker.start()
+    stats = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    active = [s for s in stats if s[2]]
+    elapsed = max(s[1] for s in active) - min(s[0] for s in active)
+    print(
+        f"{label:>6}: {len(partitions)}/{args.partitions} partitions used, "
+        f"{len(active)}/{args.consumers} consumers busy, "
+        f"{len(docs) / elapsed:8.0f} docs/s, "
+        f"in order: {all(s[3] for s in stats)}"
+    )
+
+
+parser = argparse.ArgumentParser(description="fixed key vs run key throughput")
+parser.add_argument("--kafka_server", type=str, default="127.0.0.1:9092")
+parser.add_argument("--partitions", type=int, default=8)
+parser.add_argument("--consumers", type=int, default=4)
+parser.add_argument("--runs", type=int, default=16)
+parser.add_argument("--events", type=int, default=200)
+parser.add_argument(
+    "--work_ms", type=float, default=1.0, help="simulated per-document insert cost"
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    docs = list(make_runs(args.runs, args.events))
+    print(
+        f"{len(docs)} documents from {args.runs} concurrent runs, "
+        f"{args.partitions} partitions, {args.consumers} consumers"
+    )
+    measure("fixed", Publisher, docs, key="kafka-unit-test-key")
+    measure("run", RunKeyedPublisher, docs)
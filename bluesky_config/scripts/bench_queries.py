@@ -0,0 +1,123 @@
+"""
+Catalog and per-run query latency as a database of runs grows.
+
+Fills a scratch database with synthetic runs and, at each size, times the
+lookups the Tiled MongoAdapter and the intake catalog make, once without
+and once with the indexes from indexes.py.
+
+    python3 bench_queries.py --mongo_uri=mongodb://mongo:27017 --sizes 100,1000,5000
+
+The scratch database is dropped at the end.
+"""
+import argparse
+import random
+import statistics
+import time
+import uuid
+
+import pymongo
+
+from indexes import INDEXES, ensure_indexes
+
+
+def insert_runs(database, n_runs, n_events, t0):
+    starts, descriptors, events, stops = [], [], [], []
+    for i in range(n_runs):
+        run_uid = str(uuid.uuid4())
+        descriptor_uid = str(uuid.uuid4())
+        t = t0 + i
+        starts.append({"uid": run_uid, "time": t, "scan_id": i, "plan_name": "scan"})
+        descriptors.append(
+            {
+                "uid": descriptor_uid,
+                "run_start": run_uid,
+                "time": t,
+                "name": "primary",
+                "data_keys": {"x": {"dtype": "number", "shape": [], "source": "sim"}},
+            }
+        )
+        events.extend(
+            {
+                "uid": str(uuid.uuid4()),
+                "descriptor": descriptor_uid,
+                "seq_num": seq_num,
+                "time": t + seq_num / n_events,
+                "data": {"x": seq_num},
+                "timestamps": {"x": t},
+                "filled": {},
+            }
+            for seq_num in range(1, n_events + 1)
+        )
+        stops.append({"uid": str(uuid.uuid4()), "run_start": run_uid, "time": t + 1})
+    database.run_start.insert_many(starts)
+    database.event_descriptor.insert_many(descriptors)
+    database.event.insert_many(events)
+    database.run_stop.insert_many(stops)
+
+
+def queries(database, run_uid):
+    descriptor = database.event_descriptor.find_one({"run_start": run_uid})
+    return {
+        "latest run": lambda: list(
+            database.run_start.find().sort("time", pymongo.DESCENDING).limit(1)
+        ),
+        "catalog page": lambda: list(
+            database.run_start.find().sort("time", pymongo.DESCENDING).limit(50)
+        ),
+        "run by uid": lambda: database.run_start.find_one({"uid": run_uid}),
+        "run stop": lambda: database.run_stop.find_one({"run_start": run_uid}),
+        "descriptors": lambda: list(
+            database.event_descriptor.find({"run_start": run_uid})
+        ),
+        "primary events": lambda: list(
+            database.event.find({"descriptor": descriptor["uid"]}).sort("seq_num")
+        ),
+    }
+
+
+def time_ms(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mongo query latency benchmark")
+    parser.add_argument("--mongo_uri", type=str, default="mongodb://localhost:27017")
+    parser.add_argument("--sizes", type=str, default="100,1000,5000")
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.mongo_uri)
+    database = client[f"bench-queries-{uuid.uuid4().hex[:8]}"]
+    n_runs = 0
+    try:
+        print(f"{'runs':>7} {'query':>15} {'no index ms':>12} {'indexed ms':>11}")
+        for size in map(int, args.sizes.split(",")):
+            insert_runs(database, size - n_runs, args.events, t0=n_runs)
+            n_runs = size
+            run_uid = random.choice(
+                list(database.run_start.find({}, {"uid": True}).limit(size))
+            )["uid"]
+            for collection in INDEXES:
+                database[collection].drop_indexes()
+            plain = {
+                label: time_ms(query, args.repeat)
+                for label, query in queries(database, run_uid).items()
+            }
+            ensure_indexes(database)
+            for label, query in queries(database, run_uid).items():
+                print(
+                    f"{size:>7} {label:>15} {plain[label]:12.2f} "
+                    f"{time_ms(query, args.repeat):11.2f}"
+                )
+    finally:
+        client.drop_database(database.name)
+
+
+if __name__ == "__main__":
+    main()
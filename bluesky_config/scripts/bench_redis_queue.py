@@ -0,0 +1,107 @@
+"""
+Recommendations per second through the Redis queue, one at a time and in batches.
+
+Compares the JSON queue 00-base.py and adaptive_consumer.py used to define,
+which moves one recommendation per round trip, with redis_queue.RedisQueue's
+put/get and put_many/get_many. Recommendations are dicts of --keys motor
+positions, numpy float64 as they come out of an adaptive object, plus a
+--size point array when --size is given (the JSON queue is only measured
+without it, as it can not encode arrays).
+
+    python3 bench_redis_queue.py --host localhost --n 20000 --batch 100
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import redis
+
+from redis_queue import RedisQueue
+
+KEY = "bench_adaptive"
+
+
+class JsonQueue:
+    "The RedisQueue 00-base.py had before redis_queue: JSON, one round trip per value."
+
+    def __init__(self, client):
+        self.client = client
+
+    def put(self, value):
+        self.client.lpush(KEY, json.dumps(value))
+
+    def get(self, timeout=0):
+        ret = self.client.blpop(KEY, timeout=timeout)
+        if ret is None:
+            raise TimeoutError
+        return json.loads(ret[1])
+
+
+def recommendations(n, keys, size, as_float=False):
+    rng = np.random.default_rng(0)
+    for _ in range(n):
+        value = {f"motor{j}": rng.random() for j in range(keys)}
+        if as_float:
+            value = {k: float(v) for k, v in value.items()}
+        if size:
+            value["spectrum"] = rng.random(size)
+        yield value
+
+
+def rate(queue, values, batch):
+    "Recommendations per second put in and got out again, batch at a time."
+    t0 = time.perf_counter()
+    if batch == 1:
+        for value in values:
+            queue.put(value)
+        for _ in values:
+            queue.get(timeout=1)
+    else:
+        for i in range(0, len(values), batch):
+            queue.put_many(values[i : i + batch])
+        got = 0
+        while got < len(values):
+            got += len(queue.get_many(batch, timeout=1))
+    return len(values) / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Redis recommendation queue benchmark")
+    parser.add_argument("--host", type=str, default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--keys", type=int, default=2, help="motors per recommendation")
+    parser.add_argument("--size", type=int, default=0, help="points of an array value")
+    args = parser.parse_args()
+
+    client = redis.Redis(host=args.host, port=args.port)
+    client.delete(KEY)
+    values = list(recommendations(args.n, args.keys, args.size))
+    cases = [
+        ("msgpack, put/get", RedisQueue(key=KEY, host=args.host, port=args.port), 1),
+        (
+            f"msgpack, put_many/get_many({args.batch})",
+            RedisQueue(key=KEY, host=args.host, port=args.port),
+            args.batch,
+        ),
+    ]
+    if not args.size:
+        cases.insert(0, ("json, put/get", JsonQueue(client), 1))
+    print(f"{'queue':>36} {'recs/s':>10} {'speedup':>8}")
+    base = None
+    for label, queue, batch in cases:
+        if isinstance(queue, JsonQueue):
+            # json can not encode numpy scalars
+            recs = list(recommendations(args.n, args.keys, 0, as_float=True))
+        else:
+            recs = values
+        recs_per_s = rate(queue, recs, batch)
+        base = base or recs_per_s
+        print(f"{label:>36} {recs_per_s:10.0f} {recs_per_s / base:8.1f}")
+    client.delete(KEY)
+
+
+if __name__ == "__main__":
+    main()
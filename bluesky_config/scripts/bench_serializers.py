@@ -0,0 +1,84 @@
+"""
+Encode/decode cost of the pod's serializers for typical documents.
+
+For each serializer in serializers.py and each document type, reports the
+median encode and decode time, the message size and the peak memory
+allocated (tracemalloc) while encoding and while decoding one message.
+
+    python3 bench_serializers.py --repeat 20
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+
+import numpy as np
+from event_model import compose_run
+
+from serializers import available_serializers, get_serializer
+
+
+def newton_rings(gap, shape, R=10, k=1):
+    "The NewtonDirectSimulator image, at any resolution."
+    X, Y = np.ogrid[-10 : 10 : shape[0] * 1j, -10 : 10 : shape[1] * 1j]
+    d = np.hypot(X, Y)
+    phi = ((gap + d * np.tan(np.pi / 2 - np.arcsin(d / R))) * 2) * k
+    return 1 + np.cos(phi)
+
+
+def make_event(data):
+    run = compose_run()
+    descriptor = run.compose_descriptor(
+        name="primary",
+        data_keys={
+            key: {"dtype": "array", "shape": list(np.shape(value)), "source": "sim"}
+            for key, value in data.items()
+        },
+    )
+    return descriptor.compose_event(data=data, timestamps={key: 0.0 for key in data})
+
+
+def documents():
+    yield "scalar event", make_event({"motor": 1.0, "det": 0.5, "I0": 3})
+    with np.errstate(invalid="ignore"):
+        yield "128x128 image", make_event({"image": newton_rings(1.0, (128, 128))})
+        yield "2048x2048 frame", make_event({"image": newton_rings(1.0, (2048, 2048))})
+
+
+def measure(func, arg, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(arg)
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    result = func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, statistics.median(times) * 1e6, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serializer benchmark")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(
+        f"{'document':>16} {'serializer':>14} {'encode µs':>11} {'decode µs':>11} "
+        f"{'bytes':>10} {'enc alloc':>10} {'dec alloc':>10}"
+    )
+    for label, doc in documents():
+        for name in available_serializers():
+            serializer = get_serializer(name)
+            message, t_encode, a_encode = measure(
+                serializer.dumps, ("event", doc), args.repeat
+            )
+            _, t_decode, a_decode = measure(serializer.loads, message, args.repeat)
+            print(
+                f"{label:>16} {name:>14} {t_encode:11.1f} {t_decode:11.1f} "
+                f"{len(message):10d} {a_encode:10d} {a_decode:10d}"
+            )
+
+
+if __name__ == "__main__":
+    main()
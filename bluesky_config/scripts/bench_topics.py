@@ -0,0 +1,200 @@
+"""
+Rebalances, consume rate and lag of a regex-subscribed consumer with many topics.
+
+Produces --rate messages per second for --duration seconds, spread over
+--topics topics matching ``^bench<run>.*bluesky.documents``, and consumes them
+in a fresh consumer group with each of the topic checks mongo_consumer.py has
+had between polls:
+
+- "resubscribe": the one before topic_discovery, which compared the regex
+  with the topic names, never found it among them, and resubscribed;
+- "discovery": topic_discovery.TopicDiscovery, which resubscribes only when
+  the matching topics change;
+
+checking every --interval seconds, as mongo_consumer.py does every 10. Halfway
+through, --new topics are created; the seconds until their first message is
+consumed are reported, with the rebalances, the messages consumed per second
+and the lag from produce to consume (p50, p99, max).
+
+With --mock the broker is librdkafka's in-process mock cluster, which needs
+no server; a rebalance there waits for about the session timeout, so pass a
+short --session_timeout_ms.
+
+    python3 bench_topics.py --kafka_server localhost:9092 --topics 200 --duration 120
+    python3 bench_topics.py --mock --session_timeout_ms 6000
+"""
+import argparse
+import threading
+import time
+import uuid
+
+from confluent_kafka import TIMESTAMP_NOT_AVAILABLE, Consumer, Producer
+from confluent_kafka.admin import AdminClient, NewTopic
+
+from pod_metrics import LogHistogram
+from topic_discovery import TopicDiscovery
+
+
+def mock_cluster():
+    "Start a mock cluster; returns the client that holds it and its bootstrap servers."
+    holder = Producer({"test.mock.num.brokers": 1})
+    broker = next(iter(holder.list_topics(timeout=5).brokers.values()))
+    return holder, f"{broker.host}:{broker.port}"
+
+
+def create_topics(admin, names):
+    # the mock cluster creates topics when they are first produced to
+    if admin is None:
+        return
+    futures = admin.create_topics([NewTopic(name, 1, 1) for name in names])
+    for future in futures.values():
+        future.result()
+
+
+def produce(args, names, new_names, admin, created_at, stop):
+    "Produce --rate messages a second over names, and over new_names from halfway."
+    producer = Producer({"bootstrap.servers": args.kafka_server, "linger.ms": 5})
+    payload = b"x" * args.size
+    t0 = time.monotonic()
+    i = 0
+    while not stop.is_set() and (elapsed := time.monotonic() - t0) < args.duration:
+        if not created_at and elapsed > args.duration / 2:
+            create_topics(admin, new_names)
+            names = names + new_names
+            created_at.append(time.perf_counter())
+        # catch up with the schedule, then sleep until the next message is due
+        while i < elapsed * args.rate:
+            try:
+                producer.produce(names[i % len(names)], payload)
+            except BufferError:
+                producer.poll(0.1)
+                continue
+            i += 1
+        producer.poll(0)
+        time.sleep(0.001)
+    producer.flush()
+    return i
+
+
+def consume(args, mode, pattern, names, new_names, admin):
+    "Consume while producing; returns the measurements."
+    rebalances = 0
+    resubscriptions = 0
+
+    def on_assign(consumer, partitions):
+        nonlocal rebalances
+        rebalances += 1
+
+    consumer = Consumer(
+        {
+            "bootstrap.servers": args.kafka_server,
+            "group.id": f"bench-topics-{uuid.uuid4()}",
+            "auto.offset.reset": "earliest",
+            "session.timeout.ms": args.session_timeout_ms,
+        }
+    )
+    discovery = TopicDiscovery([pattern], {}, interval=args.interval)
+    if mode == "discovery":
+        on_assign = discovery.on_assign
+
+    def subscribe():
+        consumer.subscribe([pattern], on_assign=on_assign)
+
+    created_at = []
+    stop = threading.Event()
+    produced = []
+    producer = threading.Thread(
+        target=lambda: produced.append(
+            produce(args, names, new_names, admin, created_at, stop)
+        )
+    )
+    subscribe()
+    producer.start()
+    new_names = set(new_names)
+    lag = LogHistogram()
+    consumed = 0
+    picked_up = None
+    last_check = time.monotonic()
+    t0 = time.perf_counter()
+    while producer.is_alive() or consumed < produced[0]:
+        msg = consumer.poll(0.1)
+        if msg is not None and msg.error() is None:
+            consumed += 1
+            timestamp_type, timestamp = msg.timestamp()
+            if timestamp_type != TIMESTAMP_NOT_AVAILABLE:
+                lag.record(time.time() - timestamp / 1000)
+            if picked_up is None and msg.topic() in new_names:
+                picked_up = time.perf_counter() - created_at[0]
+        if mode == "discovery":
+            discovery.poll(consumer, subscribe)
+        elif (now := time.monotonic()) > last_check + args.interval:
+            attached_topics = set(consumer.list_topics().topics)
+            if {pattern} - attached_topics:
+                subscribe()
+                resubscriptions += 1
+            last_check = now
+        if time.perf_counter() - t0 > args.duration + args.drain:
+            break
+    stop.set()
+    producer.join()
+    consumer.close()
+    if mode == "discovery":
+        resubscriptions = discovery.resubscriptions
+        rebalances = discovery.rebalances
+    return dict(
+        rate=consumed / args.duration,
+        consumed=consumed,
+        produced=produced[0],
+        rebalances=rebalances,
+        resubscriptions=resubscriptions,
+        picked_up=picked_up,
+        lag=lag.quantiles((0.5, 0.99, 1.0)),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="topic discovery benchmark")
+    parser.add_argument("--kafka_server", type=str, default="localhost:9092")
+    parser.add_argument("--mock", action="store_true", help="use a mock cluster")
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=2000, help="messages/s")
+    parser.add_argument("--duration", type=float, default=120, help="seconds")
+    parser.add_argument("--drain", type=float, default=60, help="seconds to catch up")
+    parser.add_argument("--size", type=int, default=1000, help="bytes per message")
+    parser.add_argument("--interval", type=float, default=10.0)
+    parser.add_argument("--new", type=int, default=2, help="topics created midway")
+    parser.add_argument("--session_timeout_ms", type=int, default=45000)
+    args = parser.parse_args()
+
+    if args.mock:
+        holder, args.kafka_server = mock_cluster()  # noqa: F841
+        admin = None
+    else:
+        admin = AdminClient({"bootstrap.servers": args.kafka_server})
+    print(
+        f"{'checks':>12} {'msgs/s':>8} {'consumed':>15} {'rebalances':>11} "
+        f"{'resubscribes':>13} {'new topic s':>12} {'lag p50/p99/max s':>20}"
+    )
+    for mode in ("resubscribe", "discovery"):
+        run = uuid.uuid4().hex[:8]
+        names = [f"bench{run}{i}.bluesky.documents" for i in range(args.topics)]
+        new_names = [f"bench{run}new{i}.bluesky.documents" for i in range(args.new)]
+        create_topics(admin, names)
+        try:
+            r = consume(
+                args, mode, f"^bench{run}.*bluesky.documents", names, new_names, admin
+            )
+        finally:
+            if admin is not None:
+                admin.delete_topics(names + new_names)
+        picked_up = "-" if r["picked_up"] is None else f"{r['picked_up']:.1f}"
+        lag = "/".join("-" if q is None else f"{q:.2f}" for q in r["lag"])
+        print(
+            f"{mode:>12} {r['rate']:8.0f} {r['consumed']:>7d}/{r['produced']:<7d} "
+            f"{r['rebalances']:11d} {r['resubscriptions']:13d} {picked_up:>12} "
+            f"{lag:>20}"
+        )
+
+
+if __name__ == "__main__":
+    main()
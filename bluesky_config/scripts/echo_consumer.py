@@ -1,9 +1,11 @@
 from bluesky.callbacks.zmq import RemoteDispatcher
 
+from serializers import get_serializer
+
 def echo(name, doc):
     print(f'got a {name} document')
 
-d = RemoteDispatcher('127.0.0.1:5678')
+d = RemoteDispatcher('127.0.0.1:5678', deserializer=get_serializer().loads)
 d.subscribe(echo)
 print("REMOTE IS READY TO START")
 d.start()
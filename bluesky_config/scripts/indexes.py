@@ -0,0 +1,122 @@
+import logging
+import threading
+
+import pymongo
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# The lookups the Tiled MongoAdapter and the intake catalog make: latest and
+# time-sorted runs, runs by uid or scan_id, descriptors of a run, events of a
+# descriptor in seq_num order, and the datums of a resource. Where suitcase-mongo's
+# Serializer creates an index on the same keys, the options must match its own,
+# or the create fails with an IndexOptionsConflict.
+# collection -> [(keys, options), ...]
+INDEXES = {
+    "run_start": [
+        ([("uid", pymongo.ASCENDING)], {"unique": True}),
+        ([("time", pymongo.DESCENDING)], {}),
+        ([("scan_id", pymongo.DESCENDING)], {}),
+    ],
+    "run_stop": [
+        ([("uid", pymongo.ASCENDING)], {"unique": True}),
+        ([("run_start", pymongo.ASCENDING)], {"unique": True}),
+    ],
+    "event_descriptor": [
+        ([("uid", pymongo.ASCENDING)], {"unique": True}),
+        ([("run_start", pymongo.ASCENDING), ("time", pymongo.ASCENDING)], {}),
+    ],
+    "event": [
+        ([("uid", pymongo.ASCENDING)], {"unique": True}),
+        ([("descriptor", pymongo.ASCENDING), ("seq_num", pymongo.ASCENDING)], {}),
+        ([("descriptor", pymongo.ASCENDING), ("time", pymongo.ASCENDING)], {}),
+    ],
+    "resource": [
+        ([("uid", pymongo.ASCENDING)], {}),
+        ([("run_start", pymongo.ASCENDING)], {}),
+    ],
+    "datum": [
+        ([("datum_id", pymongo.ASCENDING)], {"unique": True}),
+        ([("resource", pymongo.ASCENDING)], {}),
+    ],
+}
+
+
+def ensure_indexes(database):
+    """
+    Create the INDEXES on a database of bluesky documents.
+
+    Creating an index that already exists is a no-op, so this is safe to run
+    on every start. An index that conflicts with an existing one (same keys,
+    different options) or cannot be built (e.g. duplicates under a unique
+    index) is logged and skipped.
+
+    Parameters
+    ----------
+    database : pymongo.database.Database
+
+    Returns
+    -------
+    created : list of str
+        Names of the indexes that exist now.
+    """
+    created = []
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                created.append(
+                    database[collection].create_index(keys, background=True, **options)
+                )
+            except OperationFailure as err:
+                logger.warning(
+                    "could not create index %s on %s.%s: %s",
+                    keys,
+                    database.name,
+                    collection,
+                    err,
+                )
+    return created
+
+
+class IndexBootstrapper:
+    """
+    Ensure the indexes of each database once, on a background thread.
+
+    Parameters
+    ----------
+    mongo_uri : str
+        Server URI without a database name.
+    """
+
+    def __init__(self, mongo_uri):
+        self._mongo_uri = mongo_uri
+        self._client = None
+        self._done = set()
+        self._lock = threading.Lock()
+
+    def ensure(self, database_name):
+        """Start building the indexes of a database, unless already done."""
+        with self._lock:
+            if database_name in self._done:
+                return None
+            self._done.add(database_name)
+        thread = threading.Thread(
+            target=self._ensure,
+            args=(database_name,),
+            name=f"index-bootstrap-{database_name}",
+            daemon=True,
+        )
+        thread.start()
+        return thread
+
+    def _ensure(self, database_name):
+        try:
+            with self._lock:
+                if self._client is None:
+                    self._client = pymongo.MongoClient(self._mongo_uri)
+            created = ensure_indexes(self._client[database_name])
+            logger.info("%d indexes ensured on %s", len(created), database_name)
+        except Exception:
+            logger.exception("index bootstrap of %s failed", database_name)
+            with self._lock:
+                self._done.discard(database_name)
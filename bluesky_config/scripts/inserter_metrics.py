@@ -0,0 +1,184 @@
+"""
+Metrics of a Mongo inserter: how far behind it is, how fast and how slow it writes.
+
+``InserterMetrics.instrument`` wraps a MongoConsumer (or BatchingMongoConsumer)
+instance so that it records, in a ``pod_metrics.MetricsRegistry``:
+
+- documents and message bytes consumed, by topic and document type, and their
+  per-second rates;
+- the latency of each Mongo write, by topic and document type;
+- the lag, in messages, of every assigned partition;
+- the seconds since offsets were last committed.
+
+The registry is then written to a file or served over HTTP by the caller:
+
+    metrics = InserterMetrics()
+    consumer = MongoConsumer(..., consumer_config={"on_commit": metrics.on_commit})
+    metrics.instrument(consumer)
+    MetricsServer(metrics.registry, port=9108).start()
+"""
+import logging
+import time
+
+from kafka_messages import track_messages
+from pod_metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class _TimedSerializers:
+    "Stands in for MongoConsumer._serializers, timing every call of the serializers."
+
+    def __init__(self, serializers, histogram):
+        self._serializers = serializers
+        self._histogram = histogram
+        self._timed = {}
+
+    def __getitem__(self, topic):
+        try:
+            return self._timed[topic]
+        except KeyError:
+            serializer = self._serializers[topic]
+
+            def timed(name, doc):
+                t0 = time.perf_counter()
+                try:
+                    return serializer(name, doc)
+                finally:
+                    self._histogram(topic=topic, doc=name).record(
+                        time.perf_counter() - t0
+                    )
+
+            self._timed[topic] = timed
+            return timed
+
+
+class InserterMetrics:
+    """
+    Ingest-side metrics of a Mongo inserter.
+
+    Parameters
+    ----------
+    registry : pod_metrics.MetricsRegistry, optional
+        Defaults to a new one.
+    update_interval : float, optional
+        Seconds between updates of the partition lags and the rates.
+    """
+
+    def __init__(self, registry=None, *, update_interval=10.0):
+        self.registry = registry or MetricsRegistry()
+        self.update_interval = update_interval
+        self.documents = self.registry.counter(
+            "bluesky_inserter_documents_total", "documents consumed"
+        )
+        self.bytes = self.registry.counter(
+            "bluesky_inserter_bytes_total", "message bytes consumed"
+        )
+        self.documents_rate = self.registry.gauge(
+            "bluesky_inserter_documents_per_second", "documents consumed per second"
+        )
+        self.bytes_rate = self.registry.gauge(
+            "bluesky_inserter_bytes_per_second", "message bytes consumed per second"
+        )
+        self.insert_latency = self.registry.histogram(
+            "bluesky_inserter_insert_seconds", "time to write a document to Mongo"
+        )
+        self.lag = self.registry.gauge(
+            "bluesky_inserter_partition_lag", "messages behind the end of the partition"
+        )
+        self.since_commit = self.registry.gauge(
+            "bluesky_inserter_seconds_since_commit", "seconds since the last commit"
+        )
+        self.commit_errors = self.registry.counter(
+            "bluesky_inserter_commit_errors_total", "failed offset commits"
+        )
+        self._last_commit = None
+        self._last_update = None
+        self._last_counts = {}
+
+    def instrument(self, consumer):
+        """Wrap consumer's document processing, Mongo writes and commits. Returns it."""
+        track_messages(consumer)
+        process_document = consumer.process_document
+
+        def instrumented_process_document(topic, name, doc):
+            self.documents(topic=topic, doc=name).inc()
+            message = consumer.current_message
+            if message is not None:
+                self.bytes(topic=topic, doc=name).inc(len(message.value()))
+            result = process_document(topic, name, doc)
+            if name == "stop" and not hasattr(consumer, "_commit"):
+                # MongoConsumer commits synchronously after each stop document
+                self.committed()
+            self.update(consumer)
+            return result
+
+        consumer.process_document = instrumented_process_document
+        consumer._serializers = _TimedSerializers(
+            consumer._serializers, self.insert_latency
+        )
+        if hasattr(consumer, "_commit"):
+            commit = consumer._commit
+
+            def instrumented_commit():
+                commit()
+                self.committed()
+
+            consumer._commit = instrumented_commit
+        return consumer
+
+    def on_commit(self, err, partitions):
+        "on_commit callback of the Kafka consumer, for its automatic commits."
+        if err is None:
+            self.committed()
+        else:
+            self.commit_errors().inc()
+
+    def committed(self):
+        self._last_commit = time.monotonic()
+
+    def update(self, consumer, force=False):
+        """
+        Update the partition lags, the rates and the time since the last commit.
+
+        Cheap unless ``update_interval`` has passed since the last update, so it
+        can be called for every document and between polls.
+        """
+        now = time.monotonic()
+        if self._last_commit is not None:
+            self.since_commit().set(now - self._last_commit)
+        if self._last_update is None:
+            self._last_update = now
+            return
+        elapsed = now - self._last_update
+        if elapsed < self.update_interval and not force:
+            return
+        self._last_update = now
+        for counter, gauge in (
+            (self.documents, self.documents_rate),
+            (self.bytes, self.bytes_rate),
+        ):
+            for labels, series in counter.series():
+                key = (counter.name,) + tuple(sorted(labels.items()))
+                previous = self._last_counts.get(key, 0)
+                self._last_counts[key] = series.value
+                gauge(**labels).set((series.value - previous) / elapsed)
+        try:
+            self._update_lag(consumer._consumer)
+        except Exception:
+            logger.exception("could not update the partition lags")
+
+    def _update_lag(self, kafka_consumer):
+        # both are local: the positions and the end offsets the consumer keeps
+        # from its fetch responses, so the poll loop never waits on the broker
+        assigned = set()
+        for tp in kafka_consumer.position(kafka_consumer.assignment()):
+            _, high = kafka_consumer.get_watermark_offsets(tp, cached=True)
+            # unknown (< 0) before the first fetch of a partition
+            lag = high - tp.offset if tp.offset >= 0 and high >= 0 else None
+            self.lag(topic=tp.topic, partition=tp.partition).set(lag)
+            assigned.add((tp.topic, str(tp.partition)))
+        # partitions handed to another consumer by a rebalance
+        for labels, gauge in self.lag.series():
+            if (labels["topic"], labels["partition"]) not in assigned:
+                gauge.set(None)
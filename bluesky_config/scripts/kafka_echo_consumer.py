@@ -1,45 +1,159 @@
+"""
+Echo the documents on the bluesky topics, and measure how late they arrive.
+
+For every document this records, per document type, topic and partition:
+
+- the Kafka lag, from the message's broker timestamp (the producer's send time,
+  or the broker's append time, depending on the topic) to its consumption;
+- the document lag, from the document's own ``time`` (for pages, of the latest
+  event in the page) to its consumption, the full RunEngine-to-consumer path;
+
+and per run, the document lag of the first event and of the stop document.
+The lags are kept in constant-memory histograms (see ``pod_metrics``) and
+written to --snapshot every --interval seconds, as JSON or as Prometheus text
+for a ``.prom`` path. Lags are measured against this host's clock, so the
+producer's and the broker's should be synchronized.
+
+    python3 kafka_echo_consumer.py --kafka_server kafka:29092 --snapshot lag.prom --quiet
+"""
 import argparse
 import datetime
-from functools import partial
+import time
+from collections import OrderedDict
 
-import msgpack
-import msgpack_numpy as mpn
+from bluesky_kafka import BlueskyConsumer
+from confluent_kafka import TIMESTAMP_NOT_AVAILABLE
 
-from bluesky_kafka import RemoteDispatcher
+from kafka_messages import track_messages
+from pod_metrics import MetricsRegistry, SnapshotWriter
+from serializers import get_serializer
 
 parser = argparse.ArgumentParser(
-    description="monogo consumer process",
+    description="kafka echo consumer and latency profiler",
 )
 parser.add_argument(
     "--kafka_server", type=str, help="bootstrap server to connect to.",
     default="127.0.0.1:9092"
 )
+parser.add_argument(
+    "--topics", type=str, nargs="+", help="topics, or ^regexes, to consume.",
+    default=["mad.bluesky.documents"]
+)
+parser.add_argument(
+    "--kafka_group", type=str, help="consumer group to join.",
+    default="kafka-unit-test-group-id"
+)
+parser.add_argument(
+    "--snapshot", type=str, help="file to write the metrics to (.prom for Prometheus).",
+    default="kafka_latency.json"
+)
+parser.add_argument(
+    "--interval", type=float, help="seconds between snapshots.", default=10.0
+)
+parser.add_argument(
+    "--quiet", action="store_true", help="do not print every document."
+)
 
 args = parser.parse_args()
 
 bootstrap_servers = args.kafka_server
 
+metrics = MetricsRegistry()
+kafka_lag = metrics.histogram(
+    "bluesky_kafka_lag_seconds", "consume time - Kafka message timestamp"
+)
+document_lag = metrics.histogram(
+    "bluesky_document_lag_seconds", "consume time - document time"
+)
+first_event_lag = metrics.histogram(
+    "bluesky_run_first_event_lag_seconds", "document lag of the first event of a run"
+)
+stop_lag = metrics.histogram(
+    "bluesky_run_stop_lag_seconds", "document lag of the stop document of a run"
+)
+documents = metrics.counter("bluesky_documents_total", "documents consumed")
+message_bytes = metrics.counter("bluesky_message_bytes_total", "bytes consumed")
+
+
+class LatencyConsumer(BlueskyConsumer):
+    """BlueskyConsumer that records the lag of every document in ``metrics``."""
+
+    #: runs whose first event is awaited, beyond which the oldest are forgotten
+    max_runs = 1000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the message, with its partition and timestamp, of the current document
+        track_messages(self)
+        # descriptor uid -> run start uid, for runs awaiting their first event
+        self._descriptors = OrderedDict()
+        self._awaiting_first_event = OrderedDict()
 
-kafka_dispatcher = RemoteDispatcher(
-    topics=["mad.bluesky.documents"],
+    def process_document(self, topic, name, doc):
+        now = time.time()
+        msg = self.current_message
+        partition = msg.partition()
+        documents(doc=name, topic=topic).inc()
+        message_bytes(topic=topic, partition=partition).inc(len(msg.value()))
+        timestamp_type, timestamp = msg.timestamp()
+        if timestamp_type != TIMESTAMP_NOT_AVAILABLE:
+            kafka_lag(doc=name, topic=topic, partition=partition).record(
+                now - timestamp / 1000
+            )
+        doc_time = doc.get("time")
+        if isinstance(doc_time, list):
+            doc_time = max(doc_time, default=None)
+        if doc_time is not None:
+            lag = now - doc_time
+            document_lag(doc=name, topic=topic, partition=partition).record(lag)
+            self._track_run(topic, name, doc, lag)
+
+        if not args.quiet:
+            print(
+                f"{datetime.datetime.now().isoformat()}: "
+                f"({datetime.datetime.fromtimestamp(doc_time or 0)})"
+                f" {name} {topic}[{partition}]"
+            )
+        return True
+
+    def _track_run(self, topic, name, doc, lag):
+        if name == "start":
+            self._awaiting_first_event[doc["uid"]] = True
+            if len(self._awaiting_first_event) > self.max_runs:
+                self._awaiting_first_event.popitem(last=False)
+        elif name == "descriptor":
+            if doc["run_start"] in self._awaiting_first_event:
+                self._descriptors[doc["uid"]] = doc["run_start"]
+                if len(self._descriptors) > self.max_runs:
+                    self._descriptors.popitem(last=False)
+        elif name in ("event", "event_page"):
+            run_uid = self._descriptors.get(doc["descriptor"])
+            if self._awaiting_first_event.pop(run_uid, False):
+                if name == "event_page":
+                    # the first event of the page, not its latest
+                    lag += max(doc["time"]) - min(doc["time"])
+                first_event_lag(topic=topic).record(lag)
+        elif name == "stop":
+            run_uid = doc["run_start"]
+            self._awaiting_first_event.pop(run_uid, None)
+            for descriptor in [k for k, v in self._descriptors.items() if v == run_uid]:
+                del self._descriptors[descriptor]
+            stop_lag(topic=topic).record(lag)
+
+
+kafka_consumer = LatencyConsumer(
+    topics=args.topics,
     bootstrap_servers=bootstrap_servers,
-    group_id="kafka-unit-test-group-id",
+    group_id=args.kafka_group,
     # "latest" should always work but
     # has been failing on Linux, passing on OSX
     consumer_config={"auto.offset.reset": "latest"},
     polling_duration=1.0,
-    deserializer=partial(msgpack.loads, object_hook=mpn.decode),
+    deserializer=get_serializer().loads,
 )
 
-
-def echo(name, doc):
-    ts = doc.get("time", 0)
-    print(
-        f"{datetime.datetime.now().isoformat()}: "
-        f"({datetime.datetime.fromtimestamp(ts)})"
-        f" {name} "
-    )
-
-
-kafka_dispatcher.subscribe(echo)
-kafka_dispatcher.start()
+snapshots = SnapshotWriter(metrics, args.snapshot, interval=args.interval).start()
+try:
+    kafka_consumer.start()
+finally:
+    snapshots.stop()
@@ -0,0 +1,49 @@
+"""
+The Kafka message behind the document a bluesky_kafka consumer is processing.
+
+BlueskyConsumer hands ``process_document`` only the topic and the document;
+the partition, the broker timestamp and the size of the message are only
+seen by its private ``_deserialize_and_process``, which is not meant to be
+redefined. The pod's profilers need them, so ``track_messages`` wraps that
+method on a consumer instance, in this one place:
+
+    consumer = track_messages(MongoConsumer(...))
+    ...
+    consumer.current_message.partition()  # in process_document
+
+This relies on ``_deserialize_and_process(msg)`` being what BlueskyConsumer's
+polling loop calls for every message, as in the bluesky-kafka release pinned
+in requirements.txt and the images; check it when upgrading.
+"""
+from bluesky_kafka import BlueskyConsumer
+
+if not callable(getattr(BlueskyConsumer, "_deserialize_and_process", None)):
+    raise ImportError(
+        "this bluesky-kafka has no BlueskyConsumer._deserialize_and_process, "
+        "install the version pinned in requirements.txt"
+    )
+
+
+def track_messages(consumer):
+    """
+    Keep the message being processed in ``consumer.current_message``.
+
+    Parameters
+    ----------
+    consumer : bluesky_kafka.BlueskyConsumer
+
+    Returns
+    -------
+    consumer
+    """
+    if hasattr(consumer, "current_message"):
+        return consumer
+    deserialize_and_process = consumer._deserialize_and_process
+
+    def tracked_deserialize_and_process(msg):
+        consumer.current_message = msg
+        return deserialize_and_process(msg)
+
+    consumer.current_message = None
+    consumer._deserialize_and_process = tracked_deserialize_and_process
+    return consumer
@@ -0,0 +1,309 @@
+"""
+Happi devices that are only instantiated, and connected, when first used.
+
+Loading every item of the happi database at startup instantiates and connects
+every device, which at a beamline with hundreds of them makes opening the
+IPython session or the queue server environment take minutes. ``LazyDevices``
+puts a lightweight proxy in the namespace for each item instead:
+
+    devs = LazyDevices(hclient.all_items)
+    devs.install(globals())
+    RE.preprocessors.append(devs.prefetch)
+
+A proxy loads its device on the first access to anything but its name, and the
+device then replaces the proxy in the installed namespaces. The ``prefetch``
+preprocessor loads, in parallel, the devices a plan was called with before the
+RunEngine starts it.
+
+A proxy already looks like its device to the queue server, without loading
+it: its type has the device class's name and module, and it has the device's
+protocol methods (read, set, kickoff, ...), so it is recognized as readable,
+movable or flyable. Its components are proxies too.
+"""
+import functools
+import importlib
+import logging
+import threading
+import time
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+
+import happi.loader
+
+logger = logging.getLogger(__name__)
+
+#: methods of the bluesky protocols, delegated by a proxy when its device class has them
+PROTOCOL_METHODS = (
+    "check_value",
+    "clear_sub",
+    "collect",
+    "collect_asset_docs",
+    "collect_pages",
+    "complete",
+    "describe",
+    "describe_collect",
+    "describe_configuration",
+    "get_index",
+    "kickoff",
+    "locate",
+    "pause",
+    "prepare",
+    "read",
+    "read_configuration",
+    "resume",
+    "set",
+    "stage",
+    "stop",
+    "subscribe",
+    "trigger",
+    "unstage",
+)
+
+#: attributes looked up on anything in the namespace, by the queue server
+#: telling plans and devices apart
+PROBED = frozenset(PROTOCOL_METHODS + ("_is_plan_", "children"))
+
+
+class LazyDevice:
+    """
+    Proxy for a device that is loaded on first use.
+
+    Parameters
+    ----------
+    name : str
+    loader : callable()
+        Returns the device.
+    cls : type, optional
+        The device class, if known, so its components can be proxied too.
+    parent : LazyDevice, optional
+        The proxy of the device this is a component of.
+    on_load : callable(device), optional
+        Called once, with the device, when it is loaded.
+    """
+
+    __slots__ = ("_name", "_loader", "_cls", "_parent", "_on_load", "_device", "_lock")
+
+    def __init__(self, name, loader, *, cls=None, parent=None, on_load=None):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_loader", loader)
+        object.__setattr__(self, "_cls", cls)
+        object.__setattr__(self, "_parent", parent)
+        object.__setattr__(self, "_on_load", on_load)
+        object.__setattr__(self, "_device", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    @property
+    def name(self):
+        if self._device is not None:
+            return self._device.name
+        if self._parent is not None:
+            # ophyd's default name for a component
+            return f"{self._parent.name}_{self._name}"
+        return self._name
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @property
+    def __class__(self):
+        # isinstance(proxy, DeviceClass) holds, as for the device
+        return self._cls or type(self)
+
+    @property
+    def loaded(self):
+        return self._device is not None
+
+    def load(self):
+        """The device, instantiated and connected on the first call."""
+        if self._device is None:
+            with self._lock:
+                if self._device is None:
+                    device = self._loader()
+                    object.__setattr__(self, "_device", device)
+                    if self._on_load is not None:
+                        self._on_load(device)
+        return self._device
+
+    def __getattr__(self, attr):
+        # only reached for what the proxy itself does not have
+        if self._device is None and self._cls is not None:
+            if attr in getattr(self._cls, "component_names", ()):
+                cls = getattr(self._cls, attr).cls
+                return proxy_type(cls)(
+                    attr, lambda: getattr(self.load(), attr), cls=cls, parent=self
+                )
+            if attr in PROBED and not hasattr(self._cls, attr):
+                # a protocol, plan or device check, answered without loading
+                raise AttributeError(attr)
+        return getattr(self.load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.load(), attr, value)
+
+    def __repr__(self):
+        if self._device is not None:
+            return repr(self._device)
+        cls = self._cls.__name__ if self._cls is not None else "device"
+        return f"<lazy {cls} {self.name!r}>"
+
+
+def _delegate(method):
+    def delegated(self, *args, **kwargs):
+        return getattr(self.load(), method)(*args, **kwargs)
+
+    delegated.__name__ = method
+    return delegated
+
+
+@functools.lru_cache(maxsize=None)
+def proxy_type(cls):
+    """A LazyDevice subclass with the name, protocol methods and components of cls."""
+    if not isinstance(cls, type):
+        # a factory function: nothing is known before calling it
+        return LazyDevice
+    namespace = {
+        method: _delegate(method)
+        for method in PROTOCOL_METHODS
+        if callable(getattr(cls, method, None))
+    }
+    namespace.update(
+        __slots__=(),
+        __module__=cls.__module__,
+        __qualname__=cls.__qualname__,
+        component_names=getattr(cls, "component_names", ()),
+    )
+    return type(cls.__name__, (LazyDevice,), namespace)
+
+
+def _import(device_class):
+    module, _, name = device_class.rpartition(".")
+    return getattr(importlib.import_module(module), name)
+
+
+class LazyDevices(Mapping):
+    """
+    Proxies for the devices of some happi items, by name.
+
+    Looking a name up returns the device once it is loaded, the proxy before.
+
+    Parameters
+    ----------
+    items : iterable of happi.HappiItem
+    connection_timeout : float, optional
+        Seconds to wait for a device to connect when it is loaded; a device
+        that does not connect in time raises on first use.
+    max_workers : int, optional
+        Devices loaded at once by ``load`` and ``prefetch``.
+    """
+
+    def __init__(self, items, *, connection_timeout=10.0, max_workers=16):
+        self.connection_timeout = connection_timeout
+        self.max_workers = max_workers
+        self._namespaces = []
+        self._proxies = {}
+        self.load_time = 0.0
+        for item in items:
+            try:
+                cls = _import(item.device_class)
+            except Exception:
+                logger.exception("could not import the class of %s", item.name)
+                cls = None
+            self._proxies[item.name] = proxy_type(cls)(
+                item.name,
+                functools.partial(self._load_item, item),
+                cls=cls,
+                on_load=functools.partial(self._swap, item.name),
+            )
+
+    def _load_item(self, item):
+        t0 = time.monotonic()
+        device = happi.loader.from_container(item)
+        if hasattr(device, "wait_for_connection"):
+            device.wait_for_connection(timeout=self.connection_timeout)
+        self.load_time += time.monotonic() - t0
+        logger.info("loaded %s in %.2f s", item.name, time.monotonic() - t0)
+        return device
+
+    def _swap(self, name, device):
+        proxy = self._proxies[name]
+        for namespace in self._namespaces:
+            if namespace.get(name) is proxy:
+                namespace[name] = device
+
+    def __getitem__(self, name):
+        proxy = self._proxies[name]
+        return proxy._device if proxy.loaded else proxy
+
+    def __iter__(self):
+        return iter(self._proxies)
+
+    def __len__(self):
+        return len(self._proxies)
+
+    def install(self, namespace):
+        """Add the devices to namespace, and swap each in for its proxy once loaded."""
+        namespace.update(self)
+        self._namespaces.append(namespace)
+
+    def load(self, names=None):
+        """Load the named devices, or all, in parallel. Returns the failures by name."""
+        names = list(self._proxies if names is None else names)
+        pending = [self._proxies[name] for name in names]
+        pending = [proxy for proxy in pending if not proxy.loaded]
+        failures = {}
+        if not pending:
+            return failures
+
+        def load(proxy):
+            try:
+                proxy.load()
+            except Exception as ex:
+                logger.exception("could not load %s", proxy.name)
+                failures[proxy.name] = ex
+
+        with ThreadPoolExecutor(min(self.max_workers, len(pending))) as executor:
+            list(executor.map(load, pending))
+        return failures
+
+    def prefetch(self, plan):
+        """
+        RunEngine preprocessor: load the devices plan was called with, in parallel.
+
+        Devices are found among the arguments of a plan generator that has
+        not started, including inside lists, tuples and dicts. A device that
+        fails to load is left to fail the plan on first use.
+        """
+        frame = getattr(plan, "gi_frame", None)
+        if frame is None:
+            return plan
+        roots = set()
+        values = list(frame.f_locals.values())
+        for value in values:
+            if isinstance(value, (list, tuple)):
+                values.extend(value)
+            elif isinstance(value, dict):
+                values.extend(value.keys())
+                values.extend(value.values())
+            elif _is_proxy(value):
+                while value.parent is not None:
+                    value = value.parent
+                roots.add(value._name)
+        if roots:
+            t0 = time.monotonic()
+            self.load(roots)
+            logger.info("prefetched %s in %.2f s", sorted(roots), time.monotonic() - t0)
+        return plan
+
+    @property
+    def stats(self):
+        "Devices loaded so far, and the seconds spent loading them (over all threads)."
+        return dict(
+            loaded=sum(proxy.loaded for proxy in self._proxies.values()),
+            total=len(self._proxies),
+            load_time=self.load_time,
+        )
+
+
+def _is_proxy(obj):
+    return LazyDevice in type(obj).__mro__
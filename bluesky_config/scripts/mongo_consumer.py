@@ -1,17 +1,18 @@
 import argparse
-from functools import partial
 import logging
+import os
 from pprint import pprint
-import time
-
-import msgpack
-import msgpack_numpy as mpn
 
 from bluesky_kafka import MongoConsumer
 
+from batching import BatchingMongoConsumer
+from indexes import IndexBootstrapper
+from inserter_metrics import InserterMetrics
+from pod_metrics import MetricsServer, SnapshotWriter
+from serializers import get_serializer
+from topic_discovery import TopicDiscovery
+from workers import WorkerSupervisor
 
-logging.basicConfig(level=logging.DEBUG)
-logging.getLogger("bluesky.kafka").setLevel("DEBUG")
 
 parser = argparse.ArgumentParser(
     description="monogo consumer process",
@@ -34,19 +35,61 @@ parser.add_argument(
     help="bootstrap server to connect to.",
     default="mongodb://localhost:27017",
 )
+parser.add_argument(
+    "--batch_size",
+    type=int,
+    help="number of events and datums to buffer before a bulk insert, "
+    "0 inserts every document as it arrives.",
+    default=0,
+)
+parser.add_argument(
+    "--batch_timeout",
+    type=float,
+    help="maximum time in seconds a document is buffered before a bulk insert.",
+    default=1.0,
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    help="number of consumer processes to run in the consumer group.",
+    default=1,
+)
+parser.add_argument(
+    "--metrics_port",
+    type=int,
+    help="port to serve the ingest metrics on (the next ones with several "
+    "workers), 0 to not serve them; if it is taken, ingest goes on without.",
+    default=9108,
+)
+parser.add_argument(
+    "--metrics_file",
+    type=str,
+    help="file to write the ingest metrics to every 10 s (.prom for Prometheus "
+    "text, JSON otherwise), suffixed with the process id with several workers.",
+    default=None,
+)
+parser.add_argument(
+    "--log_level",
+    type=str,
+    help="logging level; DEBUG logs every document and slows ingest down.",
+    default="INFO",
+)
 
 args = parser.parse_args()
 
+logging.basicConfig(level=args.log_level)
+
 mongo_uri = args.mongo_uri
 bootstrap_servers = args.kafka_server
 
-kafka_deserializer = partial(msgpack.loads, object_hook=mpn.decode)
+kafka_deserializer = get_serializer().loads
 auto_offset_reset = "earliest"
 topics = ["^.*bluesky.documents"]
+# new beamline topics are added by TopicDiscovery, as <beamline>-bluesky-documents
 topic_database_map = {"mad.bluesky.documents": "mad-bluesky-documents"}
 # Create a MongoConsumer that will automatically listen to new beamline topics.
-# The parameter metadata.max.age.ms determines how often the consumer will check for
-# new topics. The default value is 5000ms.
+# TopicDiscovery checks for new topics every 10 s, and resubscribes only when one
+# appears instead of waiting for librdkafka's metadata refresh.
 settings = dict(
     topics=topics,
     topic_database_map=topic_database_map,
@@ -59,17 +102,104 @@ settings = dict(
 )
 pprint(settings)
 
-mongo_consumer = MongoConsumer(**settings)
-last_call = 0
 
+def consume(processed=None):
+    """
+    Create a consumer and run its polling loop.
+
+    Parameters
+    ----------
+    processed : multiprocessing.Value, optional
+        Counter incremented once per document, used by WorkerSupervisor.
+    """
+    # build the indexes the catalog and Tiled queries need without delaying
+    # ingest; one bootstrapper per process, as its threads and MongoClient do
+    # not survive WorkerSupervisor's fork
+    index_bootstrapper = IndexBootstrapper(mongo_uri)
+    for database_name in topic_database_map.values():
+        index_bootstrapper.ensure(database_name)
+
+    metrics = InserterMetrics()
+    # the consumer's automatic commits are only reported through this callback
+    consumer_settings = dict(
+        settings,
+        consumer_config=dict(settings["consumer_config"], on_commit=metrics.on_commit),
+    )
+    if args.batch_size > 0:
+        mongo_consumer = BatchingMongoConsumer(
+            batch_size=args.batch_size,
+            batch_timeout=args.batch_timeout,
+            **consumer_settings,
+        )
+    else:
+        mongo_consumer = MongoConsumer(**consumer_settings)
+
+    if processed is not None:
+        process_document = mongo_consumer.process_document
+
+        def counted_process_document(topic, name, doc):
+            processed.value += 1
+            return process_document(topic, name, doc)
+
+        mongo_consumer.process_document = counted_process_document
+
+    metrics.instrument(mongo_consumer)
+    discovery = TopicDiscovery(
+        topics,
+        topic_database_map,
+        on_new_topic=lambda topic, database: index_bootstrapper.ensure(database),
+        registry=metrics.registry,
+    )
+
+    def subscribe():
+        if args.batch_size > 0:
+            mongo_consumer.subscribe(topics, on_assign=discovery.on_assign)
+        else:
+            mongo_consumer._consumer.subscribe(
+                topics=topics, on_assign=discovery.on_assign
+            )
+
+    # again, with the callback counting rebalances, before the group is joined
+    subscribe()
+    if args.metrics_port:
+        try:
+            MetricsServer(
+                metrics.registry, args.metrics_port, port_range=args.workers
+            ).start()
+        except OSError:
+            # e.g. the port is taken; the metrics are not worth stopping ingest
+            logging.exception(
+                "could not serve the ingest metrics on port %d, consuming without",
+                args.metrics_port,
+            )
+    if args.metrics_file:
+        path = args.metrics_file
+        if processed is not None:
+            stem, ext = os.path.splitext(path)
+            path = f"{stem}-{os.getpid()}{ext}"
+        SnapshotWriter(metrics.registry, path).start()
+
+    def work_while_waiting():
+        if args.batch_size > 0:
+            mongo_consumer.flush_if_due()
+        metrics.update(mongo_consumer)
+        try:
+            discovery.poll(mongo_consumer._consumer, subscribe)
+        except Exception:
+            logging.exception("could not look for new topics")
 
-def work_while_waiting():
-    global last_call
-    if (now := time.monotonic()) > last_call + 10:
-        attached_topics = set(mongo_consumer._consumer.list_topics().topics)
-        if set(topics) - attached_topics:
-            mongo_consumer._consumer.subscribe(topics=topics)
-        last_call = now
+    if args.batch_size > 0:
+        # end the loop on a failed write, the worker or container is restarted
+        # and consumes again from the last commit
+        mongo_consumer.start_polling(
+            work_during_wait=work_while_waiting,
+            on_exception=mongo_consumer.on_exception,
+        )
+    else:
+        mongo_consumer.start(None, work_while_waiting)
 
 
-mongo_consumer.start(None, work_while_waiting)
+if args.workers > 1:
+    WorkerSupervisor(consume, args.workers).run()
+else:
+    consume()
@@ -0,0 +1,144 @@
+import os
+
+import event_model
+import numpy as np
+
+
+class ArrayOffloader:
+    """
+    Move large arrays out of events and onto shared storage ("claim check").
+
+    Array data keys whose size, estimated from the descriptor, is at least
+    ``threshold`` bytes are marked ``external`` in the descriptor. For each such
+    key the first event of a descriptor emits a Resource, every event writes
+    its array to ``{root}/{resource_path}_{index}.npy`` and emits a Datum, and
+    the event itself only carries the datum id. Downstream consumers (the
+    Mongo inserter, Tiled's MongoAdapter) store and resolve the references
+    with the ``NPY_SEQ`` handler, reading the arrays lazily from disk, so the
+    broker only sees the metadata.
+
+    Parameters
+    ----------
+    publisher : callable(name, doc)
+        Receives the rewritten documents.
+    root : str
+        Directory shared with the readers, for example the pod's data volume.
+    threshold : int, optional
+        Offload array keys whose estimated size is at least this many bytes.
+    directory : str, optional
+        Subdirectory of ``root`` for the files, one subdirectory per run.
+    """
+
+    spec = "NPY_SEQ"
+
+    def __init__(
+        self, publisher, root, *, threshold=256 * 1024, directory="offload"
+    ):
+        self._publisher = publisher
+        self.root = root
+        self.threshold = threshold
+        self.directory = directory
+        # run start uid -> start document
+        self._starts = {}
+        # descriptor uid -> (run start uid, [offloaded key, ...])
+        self._descriptors = {}
+        # (descriptor uid, key) -> [resource document, compose_datum, next index]
+        self._resources = {}
+        self.bytes_offloaded = 0
+
+    def __call__(self, name, doc):
+        if name == "start":
+            self._starts[doc["uid"]] = doc
+        elif name == "descriptor":
+            doc = self._descriptor(doc)
+        elif name == "event":
+            if doc["descriptor"] in self._descriptors:
+                doc = self._event(doc)
+        elif name == "event_page":
+            if doc["descriptor"] in self._descriptors:
+                events = [self._event(e) for e in event_model.unpack_event_page(doc)]
+                doc = event_model.pack_event_page(*events)
+        elif name == "stop":
+            self._forget(doc["run_start"])
+        self._publisher(name, doc)
+
+    def flush(self):
+        flush = getattr(self._publisher, "flush", None)
+        if flush is not None:
+            flush()
+
+    def _descriptor(self, doc):
+        keys = [
+            key
+            for key, data_key in doc["data_keys"].items()
+            if data_key["dtype"] == "array"
+            and "external" not in data_key
+            and self._estimate_nbytes(data_key) >= self.threshold
+        ]
+        if not keys:
+            return doc
+        self._descriptors[doc["uid"]] = (doc["run_start"], keys)
+        data_keys = dict(doc["data_keys"])
+        for key in keys:
+            data_keys[key] = {**data_keys[key], "external": "FILESTORE:"}
+        return {**doc, "data_keys": data_keys}
+
+    @staticmethod
+    def _estimate_nbytes(data_key):
+        shape = data_key.get("shape") or []
+        if not shape or any(n is None or n < 0 for n in shape):
+            # size unknown until the first event, do not risk an oversized message
+            return float("inf")
+        itemsize = np.dtype(data_key.get("dtype_numpy") or "f8").itemsize
+        return int(np.prod(shape)) * itemsize
+
+    def _event(self, doc):
+        run_uid, keys = self._descriptors[doc["descriptor"]]
+        data = dict(doc["data"])
+        filled = dict(doc.get("filled", {}))
+        for key in keys:
+            data[key] = self._write(run_uid, doc["descriptor"], key, data[key])
+            filled[key] = False
+        return {**doc, "data": data, "filled": filled}
+
+    def _write(self, run_uid, descriptor_uid, key, value):
+        entry = self._resources.get((descriptor_uid, key))
+        if entry is None:
+            resource_path = os.path.join(
+                self.directory, run_uid, f"{descriptor_uid[:8]}_{key}"
+            )
+            os.makedirs(
+                os.path.join(self.root, os.path.dirname(resource_path)), exist_ok=True
+            )
+            bundle = event_model.compose_resource(
+                spec=self.spec,
+                root=self.root,
+                resource_path=resource_path,
+                resource_kwargs={},
+                start=self._starts.get(run_uid),
+            )
+            self._publisher("resource", bundle.resource_doc)
+            entry = self._resources[(descriptor_uid, key)] = [
+                bundle.resource_doc,
+                bundle.compose_datum,
+                0,
+            ]
+        resource, compose_datum, index = entry
+        entry[2] += 1
+        array = np.asarray(value)
+        np.save(
+            os.path.join(resource["root"], f"{resource['resource_path']}_{index}.npy"),
+            array,
+        )
+        self.bytes_offloaded += array.nbytes
+        datum = compose_datum(datum_kwargs={"index": index})
+        self._publisher("datum", datum)
+        return datum["datum_id"]
+
+    def _forget(self, run_uid):
+        self._starts.pop(run_uid, None)
+        for descriptor_uid, (run, keys) in list(self._descriptors.items()):
+            if run == run_uid:
+                del self._descriptors[descriptor_uid]
+                for key in keys:
+                    self._resources.pop((descriptor_uid, key), None)
@@ -0,0 +1,159 @@
+import logging
+
+import msgpack
+
+from bluesky_kafka import Publisher
+
+logger = logging.getLogger(__name__)
+
+
+class RunKeyCache:
+    """
+    Resolve the run start uid of any bluesky document.
+
+    Start and stop documents carry the run uid directly; descriptors and
+    resources carry it in ``run_start``. Events and datums only refer to their
+    descriptor or resource, so those uids are remembered until the run's stop
+    document arrives.
+    """
+
+    def __init__(self):
+        # descriptor or resource uid -> run start uid
+        self._parents = {}
+        # run start uid -> [descriptor or resource uid, ...]
+        self._children = {}
+
+    def __len__(self):
+        return len(self._parents)
+
+    def run_uid(self, name, doc):
+        """
+        Return the run start uid for a document, or None if it is unknown.
+
+        Stop documents forget the run's descriptors and resources, so they
+        must be passed through this method after every other document of the
+        run.
+        """
+        if name == "start":
+            return doc["uid"]
+        elif name in ("descriptor", "resource"):
+            run_uid = doc.get("run_start")
+            if run_uid is not None:
+                self._parents[doc["uid"]] = run_uid
+                self._children.setdefault(run_uid, []).append(doc["uid"])
+            return run_uid
+        elif name in ("event", "event_page"):
+            return self._parents.get(doc["descriptor"])
+        elif name in ("datum", "datum_page"):
+            return self._parents.get(doc["resource"])
+        elif name == "stop":
+            run_uid = doc["run_start"]
+            for uid in self._children.pop(run_uid, ()):
+                self._parents.pop(uid, None)
+            return run_uid
+        return None
+
+
+class RunKeyedPublisher(Publisher):
+    """
+    Publisher that uses the run start uid as the Kafka message key.
+
+    Kafka only orders messages within a partition and picks the partition by
+    hashing the key. With a single fixed key every document of every run lands
+    on the same partition; keying by run keeps each run in order on one
+    partition while concurrent runs spread over all of them, so consumers in a
+    group can work on different runs in parallel.
+
+    Documents whose run cannot be resolved (for example a resource without
+    ``run_start``) are published with ``fallback_key``.
+
+    Parameters
+    ----------
+    fallback_key : str, optional
+        Key for documents that cannot be associated with a run.
+    *args, **kwargs
+        Passed through to bluesky_kafka.Publisher, except ``key``.
+    """
+
+    def __init__(self, *args, fallback_key=None, **kwargs):
+        kwargs.pop("key", None)
+        super().__init__(*args, key=fallback_key, **kwargs)
+        self._run_keys = RunKeyCache()
+
+    def __call__(self, name, doc):
+        self._produce(name, doc, self._serializer((name, doc)))
+
+    def publish_encoded(self, name, doc, payload):
+        """
+        Publish a document that has already been msgpack-encoded.
+
+        Only the ``(name, doc)`` framing is added to ``payload``, so the
+        message is identical to ``msgpack.dumps((name, doc))`` without encoding
+        the document again. ``doc`` is only used to look up the message key.
+        """
+        self._produce(name, doc, b"\x92" + msgpack.packb(name) + payload)
+
+    def _produce(self, name, doc, value):
+        key = self._run_keys.run_uid(name, doc) or self._key
+        self._producer.produce(
+            topic=self.topic,
+            key=key,
+            value=value,
+            on_delivery=self.on_delivery,
+        )
+        # poll for delivery reports
+        self._producer.poll(0)
+        if self._flush_on_stop_doc and name == "stop":
+            self.flush()
+
+
+def ensure_topic(
+    bootstrap_servers, topic, num_partitions, replication_factor=1, timeout=10.0
+):
+    """
+    Create a topic with at least ``num_partitions`` partitions.
+
+    An existing topic with fewer partitions is grown; Kafka cannot shrink a
+    topic so one with more partitions is left alone. Note that growing a topic
+    changes which partition existing keys hash to, so do it between runs.
+
+    Parameters
+    ----------
+    bootstrap_servers : str
+        Comma-delimited list of Kafka server addresses.
+    topic : str
+    num_partitions : int
+    replication_factor : int, optional
+        Only used when the topic is created.
+    timeout : float, optional
+        Seconds to wait for the broker.
+
+    Returns
+    -------
+    num_partitions : int
+        The partition count of the topic afterwards.
+    """
+    from confluent_kafka.admin import AdminClient, NewPartitions, NewTopic
+
+    admin = AdminClient({"bootstrap.servers": bootstrap_servers})
+    # list every topic, asking for just this one can auto-create it
+    metadata = admin.list_topics(timeout=timeout).topics.get(topic)
+    if metadata is None or metadata.error is not None:
+        futures = admin.create_topics(
+            [NewTopic(topic, num_partitions, replication_factor)],
+            request_timeout=timeout,
+        )
+        futures[topic].result()
+        logger.info("created topic %s with %d partitions", topic, num_partitions)
+        return num_partitions
+    current = len(metadata.partitions)
+    if current < num_partitions:
+        futures = admin.create_partitions(
+            [NewPartitions(topic, num_partitions)], request_timeout=timeout
+        )
+        futures[topic].result()
+        logger.info(
+            "grew topic %s from %d to %d partitions", topic, current, num_partitions
+        )
+        return num_partitions
+    return current
@@ -0,0 +1,370 @@
+"""
+In-process metrics for the pod's consumers, snapshotted as JSON or Prometheus text.
+
+The consumers are long-running loops on a Kafka topic; to see how they keep
+up without attaching to them, they record into a ``MetricsRegistry``, and a
+``SnapshotWriter`` thread periodically writes the registry to a file that can
+be read by hand, or scraped by node_exporter's textfile collector, and/or a
+``MetricsServer`` serves it over HTTP:
+
+    metrics = MetricsRegistry()
+    lag = metrics.histogram("bluesky_lag_seconds", "consume time - publish time")
+    lag(doc="event", topic=topic).record(seconds)
+    SnapshotWriter(metrics, "/tmp/metrics.prom", interval=10).start()
+    MetricsServer(metrics, port=9108).start()
+
+Latencies go into ``LogHistogram``, a streaming histogram in the manner of
+HdrHistogram: log-linear buckets with a fixed relative error, so its memory
+depends on the range of the values and not on how many were recorded.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LogHistogram:
+    """
+    Streaming histogram of non-negative values with a bounded relative error.
+
+    Values are counted in units of ``unit``, exactly below ``2**significant_bits``
+    units and with a relative error below ``2**(1 - significant_bits)`` above,
+    in buckets held in a dict, so a histogram of latencies from a microsecond
+    to an hour holds at most a couple thousand counts.
+
+    Parameters
+    ----------
+    unit : float, optional
+        Resolution of the values, by default a microsecond if they are seconds.
+    significant_bits : int, optional
+        Bits of each value kept; 7 is a relative error under 1.6%.
+    """
+
+    def __init__(self, unit=1e-6, significant_bits=7):
+        self.unit = unit
+        self.significant_bits = significant_bits
+        self._half = 1 << (significant_bits - 1)
+        self._counts = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        # values below zero, as with clock skew between hosts, are counted as 0
+        self.negative = 0
+
+    def record(self, value):
+        if value < 0:
+            self.negative += 1
+            value = 0.0
+        units = int(value / self.unit)
+        shift = max(units.bit_length() - self.significant_bits, 0)
+        index = shift * self._half + (units >> shift)
+        self._counts[index] = self._counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def _upper(self, index):
+        "The largest value counted in bucket index."
+        if index < 2 * self._half:
+            return (index + 1) * self.unit
+        shift = index // self._half - 1
+        top = index - shift * self._half
+        return ((top + 1) << shift) * self.unit
+
+    def quantiles(self, qs=QUANTILES):
+        "The value below which each fraction q of the values fall, max included."
+        if not self.count:
+            return [None] * len(qs)
+        # list() of a dict is atomic, record() may run on another thread
+        buckets = sorted(list(self._counts.items()))
+        out = []
+        for q in qs:
+            rank = q * self.count
+            seen = 0
+            for index, n in buckets:
+                seen += n
+                if seen >= rank:
+                    break
+            out.append(min(self._upper(index), self.max))
+        return out
+
+    def snapshot(self):
+        names = (f"p{round(q * 100)}" for q in QUANTILES)
+        quantiles = dict(zip(names, self.quantiles()))
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            min=self.min,
+            max=self.max,
+            negative=self.negative,
+            **quantiles,
+        )
+
+
+class Counter:
+    "A count that only goes up."
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def snapshot(self):
+        return dict(value=self.value)
+
+
+class Gauge:
+    "A value that is set."
+
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return dict(value=self.value)
+
+
+class Metric:
+    """
+    A named metric, with one series per combination of label values.
+
+    Calling it with the labels returns the series, created on first use.
+    """
+
+    def __init__(self, name, help, kind, factory):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self._factory = factory
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        try:
+            return self._series[key]
+        except KeyError:
+            with self._lock:
+                return self._series.setdefault(key, self._factory())
+
+    def series(self):
+        "(labels, series) pairs."
+        return [(dict(key), series) for key, series in list(self._series.items())]
+
+
+class MetricsRegistry:
+    """Metrics by name, and their JSON and Prometheus text renderings."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def _metric(self, name, help, kind, factory):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Metric(name, help, kind, factory)
+            return self._metrics[name]
+
+    def histogram(self, name, help="", **kwargs):
+        "A LogHistogram per label set; kwargs are passed to LogHistogram."
+        return self._metric(name, help, "histogram", lambda: LogHistogram(**kwargs))
+
+    def counter(self, name, help=""):
+        return self._metric(name, help, "counter", Counter)
+
+    def gauge(self, name, help=""):
+        return self._metric(name, help, "gauge", Gauge)
+
+    def snapshot(self):
+        "Every series of every metric, as a JSON-serializable dict."
+        return dict(
+            time=time.time(),
+            uptime=time.time() - self.started,
+            metrics={
+                name: dict(
+                    type=metric.kind,
+                    help=metric.help,
+                    series=[
+                        dict(labels=labels, **series.snapshot())
+                        for labels, series in metric.series()
+                    ],
+                )
+                for name, metric in list(self._metrics.items())
+            },
+        )
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """
+        The Prometheus text exposition format.
+
+        Histograms are rendered as summaries, with quantile="1" for the max.
+        """
+        lines = []
+        for name, metric in list(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            if metric.kind == "histogram":
+                lines.append(f"# TYPE {name} summary")
+                for labels, hist in metric.series():
+                    qs = QUANTILES + (1.0,)
+                    for q, value in zip(qs, hist.quantiles(qs)):
+                        q_labels = _labels(dict(labels, quantile=f"{q:g}"))
+                        lines.append(f"{name}{q_labels} {_number(value)}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(hist.sum)}")
+                    lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+            else:
+                lines.append(f"# TYPE {name} {metric.kind}")
+                for labels, series in metric.series():
+                    lines.append(f"{name}{_labels(labels)} {_number(series.value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _number(value):
+    return "NaN" if value is None else repr(float(value))
+
+
+class SnapshotWriter:
+    """
+    Write a registry to a file every ``interval`` seconds, from a daemon thread.
+
+    The file is replaced atomically, so a reader never sees half of it.
+
+    Parameters
+    ----------
+    registry : MetricsRegistry
+    path : str
+    interval : float, optional
+    format : {"json", "prometheus"}, optional
+        Defaults to prometheus for a ``.prom`` path and json otherwise.
+    """
+
+    def __init__(self, registry, path, *, interval=10.0, format=None):
+        if format is None:
+            format = "prometheus" if path.endswith(".prom") else "json"
+        if format not in ("json", "prometheus"):
+            raise ValueError(f"format must be 'json' or 'prometheus', not {format!r}")
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.format = format
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="metrics-snapshot", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        "Stop the thread, and write a last snapshot."
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.write()
+
+    def write(self):
+        if self.format == "json":
+            text = self.registry.to_json()
+        else:
+            text = self.registry.to_prometheus()
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception:
+                logger.exception("could not write metrics to %s", self.path)
+
+
+class MetricsServer:
+    """
+    Serve a registry over HTTP from a daemon thread.
+
+    ``/metrics`` is the Prometheus text format and ``/metrics.json`` the JSON
+    snapshot. If ``port`` is taken, the next ``port_range - 1`` ports are
+    tried, so that several workers of one consumer can each serve theirs.
+
+    Parameters
+    ----------
+    registry : MetricsRegistry
+    port : int
+    host : str, optional
+    port_range : int, optional
+    """
+
+    def __init__(self, registry, port, *, host="0.0.0.0", port_range=1):
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = registry_.to_prometheus().encode()
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = registry_.to_json().encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # scrapes are not worth a log line each
+                pass
+
+        for offset in range(port_range):
+            try:
+                self._server = ThreadingHTTPServer((host, port + offset), Handler)
+                break
+            except OSError:
+                if offset == port_range - 1:
+                    raise
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="metrics-server", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        logger.info("serving metrics on port %d", self.port)
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,353 @@
+import logging
+import queue
+import threading
+import time
+import event_model
+import msgpack
+
+from serializers import get_serializer
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPublisher:
+    """
+    Hand documents to a publisher on a background thread.
+
+    The RunEngine only pays for putting ``(name, doc)`` on a bounded queue;
+    serialization and producing happen on a worker thread. Whenever the worker
+    falls behind, consecutive events of one descriptor are packed into a single
+    event_page and consecutive datums of one resource into a datum_page, so a
+    backlog is published in fewer, larger messages. When the queue is full the
+    caller blocks until there is room, which is recorded in the metrics, or
+    with ``overflow="drop"`` events and datums are dropped and counted instead.
+
+    A stop document is only acknowledged once it, and everything queued before
+    it, has been handed to the publisher and the publisher has been flushed, so
+    the end of a run is as durable as with a synchronous publisher. If that
+    takes longer than ``stop_timeout``, as when the broker is unreachable, the
+    run finishes anyway; the documents stay queued, and this is logged and
+    counted in ``n_stop_timeouts``.
+
+    Parameters
+    ----------
+    publisher : callable(name, doc)
+        For example a bluesky_kafka.Publisher. If it has a ``flush`` method it
+        is called for every stop document.
+    maxsize : int, optional
+        Capacity of the queue in documents.
+    coalesce : bool, optional
+        Pack queued events and datums into pages.
+    max_page_size : int, optional
+        Maximum number of events or datums per page.
+    flush_on_stop : bool, optional
+        Block the caller of a stop document until it has been flushed.
+    stop_timeout : float or None, optional
+        Seconds the caller of a stop document waits for it to be flushed, None
+        to wait as long as it takes.
+    overflow : {"block", "drop"}, optional
+        What to do with a document that does not fit in the queue. Documents
+        other than events and datums always block, so runs stay complete.
+    """
+
+    def __init__(
+        self,
+        publisher,
+        *,
+        maxsize=10_000,
+        coalesce=True,
+        max_page_size=1000,
+        flush_on_stop=True,
+        stop_timeout=10.0,
+        overflow="block",
+    ):
+        if overflow not in ("block", "drop"):
+            raise ValueError(f"overflow must be 'block' or 'drop', not {overflow!r}")
+        self._publisher = publisher
+        self._flush = getattr(publisher, "flush", None)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.coalesce = coalesce
+        self.max_page_size = max_page_size
+        self.flush_on_stop = flush_on_stop
+        self.stop_timeout = stop_timeout
+        self.overflow = overflow
+
+        self.documents_in = 0
+        self.messages_out = 0
+        self.max_queue_depth = 0
+        self.time_blocked = 0.0
+        self.n_blocked = 0
+        self.n_dropped = 0
+        self.n_stop_timeouts = 0
+        self.errors = 0
+        # seconds spent in the publisher: total, worst and latest call
+        self.time_publishing = 0.0
+        self.max_publish_latency = 0.0
+        self.last_publish_latency = 0.0
+
+        # [name, key, docs] of the page being collected by the worker
+        self._pending = None
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="async-publisher", daemon=True
+        )
+        self._thread.start()
+
+    def __call__(self, name, doc):
+        if self._closed:
+            raise RuntimeError("This AsyncPublisher has been closed.")
+        done = threading.Event() if name == "stop" and self.flush_on_stop else None
+        item = (name, doc, done)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if self.overflow == "drop" and name in ("event", "datum"):
+                self.n_dropped += 1
+                return
+            t0 = time.monotonic()
+            self._queue.put(item)
+            self.time_blocked += time.monotonic() - t0
+            self.n_blocked += 1
+        self.documents_in += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        if done is not None and not done.wait(self.stop_timeout):
+            self.n_stop_timeouts += 1
+            logger.warning(
+                "stop document of run %s not flushed within %s s (%d more "
+                "documents queued); what is unflushed is lost if the process exits",
+                doc.get("run_start"),
+                self.stop_timeout,
+                self.queue_depth,
+            )
+
+    @property
+    def queue_depth(self):
+        "Number of documents waiting to be published."
+        return self._queue.qsize()
+
+    @property
+    def metrics(self):
+        "Backpressure counters, for logging or a status endpoint."
+        return dict(
+            queue_depth=self.queue_depth,
+            max_queue_depth=self.max_queue_depth,
+            time_blocked=self.time_blocked,
+            n_blocked=self.n_blocked,
+            n_dropped=self.n_dropped,
+            n_stop_timeouts=self.n_stop_timeouts,
+            documents_in=self.documents_in,
+            messages_out=self.messages_out,
+            errors=self.errors,
+            time_publishing=self.time_publishing,
+            max_publish_latency=self.max_publish_latency,
+            last_publish_latency=self.last_publish_latency,
+        )
+
+    def flush(self, timeout=None):
+        """
+        Wait until everything queued so far has been published, then flush.
+
+        Returns False if that took longer than ``timeout`` seconds.
+        """
+        done = threading.Event()
+        self._queue.put((None, None, done))
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        """Publish everything still queued, flush, and stop the worker."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            while item is not None:
+                self._handle(*item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            # the queue has drained, do not hold a partial page back
+            self._emit_pending()
+            if item is None:
+                self._call_flush()
+                return
+
+    def _handle(self, name, doc, done):
+        if name is None:
+            # a flush() marker
+            self._emit_pending()
+            self._call_flush()
+            done.set()
+            return
+        if self.coalesce and name in ("event", "datum"):
+            key = doc["descriptor"] if name == "event" else doc["resource"]
+            pending = self._pending
+            if (
+                pending is not None
+                and pending[0] == name
+                and pending[1] == key
+                and len(pending[2]) < self.max_page_size
+            ):
+                pending[2].append(doc)
+            else:
+                self._emit_pending()
+                self._pending = [name, key, [doc]]
+            return
+        self._emit_pending()
+        self._publish(name, doc)
+        if name == "stop":
+            self._call_flush()
+            if done is not None:
+                done.set()
+
+    def _emit_pending(self):
+        if self._pending is None:
+            return
+        name, _, docs = self._pending
+        self._pending = None
+        if len(docs) == 1:
+            self._publish(name, docs[0])
+        elif name == "event":
+            self._publish("event_page", event_model.pack_event_page(*docs))
+        else:
+            self._publish("datum_page", event_model.pack_datum_page(*docs))
+
+    def _publish(self, name, doc):
+        t0 = time.monotonic()
+        try:
+            self._publisher(name, doc)
+            self.messages_out += 1
+        except Exception:
+            self.errors += 1
+            logger.exception("failed to publish %s document", name)
+        latency = time.monotonic() - t0
+        self.time_publishing += latency
+        self.max_publish_latency = max(self.max_publish_latency, latency)
+        self.last_publish_latency = latency
+
+    def _call_flush(self):
+        # with nothing published there is nothing to flush, and a publisher
+        # that is built on first use is not built just to flush it at exit
+        if self._flush is None or not self.messages_out:
+            return
+        try:
+            self._flush()
+        except Exception:
+            self.errors += 1
+            logger.exception("failed to flush publisher")
+
+
+class FanOutPublisher:
+    """
+    Encode each document once and hand the bytes to several sinks.
+
+    Subscribing a 0MQ and a Kafka publisher to the RunEngine separately makes
+    each of them serialize every document; for image-bearing events that is
+    the dominant cost. This publisher msgpack-encodes ``doc`` once into an
+    immutable ``bytes`` object and calls ``sink.publish_encoded(name, doc,
+    payload)`` for every sink, which only adds its own framing.
+
+    A sink that raises does not stop the document from reaching the others;
+    the failure is logged and counted in ``errors``.
+
+    Parameters
+    ----------
+    sinks : dict
+        Maps a label to an object with a ``publish_encoded(name, doc, payload)``
+        method, for example RunKeyedPublisher, ZmqSink or FileSink. Sinks with a
+        ``flush`` method are flushed by ``flush()``.
+    serializer : callable(doc), optional
+        Must produce msgpack, the sinks rely on it for their framing. Defaults
+        to ``serializers.get_serializer().dumps``.
+    """
+
+    def __init__(self, sinks, *, serializer=None):
+        self.sinks = dict(sinks)
+        self._serializer = serializer or get_serializer().dumps
+        self.errors = {label: 0 for label in self.sinks}
+
+    def __call__(self, name, doc):
+        payload = self._serializer(doc)
+        for label, sink in self.sinks.items():
+            try:
+                sink.publish_encoded(name, doc, payload)
+            except Exception:
+                self.errors[label] += 1
+                logger.exception("sink %r failed to publish %s document", label, name)
+
+    def flush(self):
+        for label, sink in self.sinks.items():
+            flush = getattr(sink, "flush", None)
+            if flush is None:
+                continue
+            try:
+                flush()
+            except Exception:
+                self.errors[label] += 1
+                logger.exception("sink %r failed to flush", label)
+
+
+class ZmqSink:
+    """
+    Send pre-encoded documents to a 0MQ proxy, like bluesky.callbacks.zmq.Publisher.
+
+    The sink has its own PUB socket and sends the ``prefix name payload``
+    messages the Publisher sends, but with the msgpack payload instead of a
+    pickle, so the receiving RemoteDispatcher must be given the matching
+    deserializer, ``serializers.get_serializer().loads``.
+
+    Parameters
+    ----------
+    address : str or tuple
+        Address of a running 0MQ proxy, as ``"host:port"`` or
+        ``(host, port)``.
+    prefix : bytes, optional
+        Distinguishes this publisher's messages; may not contain b" ".
+    """
+
+    def __init__(self, address, *, prefix=b""):
+        import zmq
+
+        if not isinstance(prefix, bytes):
+            raise ValueError(f"prefix must be bytes, not {type(prefix).__name__}")
+        if b" " in prefix:
+            raise ValueError(f"prefix {prefix!r} may not contain b' '")
+        if isinstance(address, str):
+            address = tuple(address.rsplit(":", 1))
+        self.address = "tcp://{}:{}".format(*address)
+        self.prefix = prefix
+        self._context = zmq.Context()
+        self._socket = self._context.socket(zmq.PUB)
+        self._socket.connect(self.address)
+
+    def publish_encoded(self, name, doc, payload):
+        self._socket.send(b" ".join([self.prefix, name.encode(), payload]))
+
+    def close(self):
+        self._socket.close()
+        self._context.destroy()
+
+
+class FileSink:
+    """
+    Append pre-encoded documents to a file as a stream of msgpack ``[name, doc]``.
+
+    The file can be replayed with ``msgpack.Unpacker``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "ab")
+
+    def publish_encoded(self, name, doc, payload):
+        self._file.write(b"\x92" + msgpack.packb(name) + payload)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,159 @@
+"""
+A queue.Queue stand-in on a Redis list, for passing recommendations between processes.
+
+The recommender puts suggestions in, the plan gets them out:
+
+    from redis_queue import RedisQueue
+
+    queue = RedisQueue(host="redis")
+    per_start.recommender_factory(..., queue=queue)
+    adaptive_plan(..., from_recommender=RedisQueue(host="redis"))
+
+Values are encoded with the pod's msgpack serializer (see ``serializers``), so
+numpy arrays and scalars go through without a round trip via JSON lists.
+``put_many`` pushes many values in one round trip, and ``get_many`` pops many
+with LMPOP/BLMPOP on Redis >= 7 and with a LRANGE+LTRIM transaction before.
+Queues on the same server share one connection pool per process.
+"""
+import threading
+from queue import Empty
+
+import redis
+
+from serializers import get_serializer
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def connection_pool(host="localhost", port=6379, db=0, **kwargs):
+    """The process's connection pool for a Redis server, created on first use."""
+    key = (host, port, db, tuple(sorted(kwargs.items())))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = redis.ConnectionPool(host=host, port=port, db=db, **kwargs)
+        return _pools[key]
+
+
+class RedisQueue:
+    """
+    Fake just enough of the queue.Queue API on top of a redis list.
+
+    Like queue.LifoQueue, the newest value comes out first, so a plan always
+    gets the latest recommendation.
+
+    Parameters
+    ----------
+    client : redis.Redis, optional
+        Defaults to a client of the shared pool for host, port and db.
+    key : str, optional
+        The list holding the queue.
+    serializer : serializers.Serializer, optional
+        Defaults to ``get_serializer()``; both ends must use the same.
+    host, port, db : optional
+        The server, if no client is given.
+    chunk_size : int, optional
+        Values per LPUSH command of ``put_many``.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        *,
+        key="adaptive",
+        serializer=None,
+        host="localhost",
+        port=6379,
+        db=0,
+        chunk_size=1000,
+    ):
+        if client is None:
+            client = redis.Redis(connection_pool=connection_pool(host, port, db))
+        self.client = client
+        self.key = key
+        serializer = serializer or get_serializer()
+        self._dumps = serializer.dumps
+        self._loads = serializer.loads
+        self.chunk_size = chunk_size
+        # LMPOP needs Redis 7; cleared the first time the server says it is older
+        self._lmpop = True
+
+    def put(self, value):
+        self.client.lpush(self.key, self._dumps(value))
+
+    def put_many(self, values):
+        """Put every value of values, in one round trip; the last comes out first."""
+        encoded = [self._dumps(value) for value in values]
+        if not encoded:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for i in range(0, len(encoded), self.chunk_size):
+            pipe.lpush(self.key, *encoded[i : i + self.chunk_size])
+        pipe.execute()
+
+    def get(self, timeout=0, block=True):
+        """
+        Remove and return the newest value.
+
+        Blocking waits up to timeout seconds (0 is forever) and raises
+        TimeoutError after that; not blocking raises queue.Empty.
+        """
+        if block:
+            ret = self.client.blpop(self.key, timeout=timeout)
+            if ret is None:
+                raise TimeoutError
+            return self._loads(ret[1])
+        else:
+            ret = self.client.lpop(self.key)
+            if ret is not None:
+                return self._loads(ret)
+            else:
+                raise Empty
+
+    def get_many(self, n, timeout=0, block=True):
+        """
+        Remove and return up to n of the newest values, newest first, in one
+        round trip.
+
+        Blocking waits for the first value as ``get`` does. Raises like
+        ``get`` when there is none.
+        """
+        raw = self._pop_many(n)
+        if not raw and block:
+            raw = self._bpop_many(n, timeout)
+            if not raw:
+                raise TimeoutError
+        if not raw:
+            raise Empty
+        return [self._loads(value) for value in raw]
+
+    def _pop_many(self, n):
+        if self._lmpop:
+            try:
+                ret = self.client.lmpop(1, self.key, direction="LEFT", count=n)
+            except redis.ResponseError as err:
+                # only an older server is a reason to stop trying, not e.g. WRONGTYPE
+                if not str(err).lower().startswith("unknown command"):
+                    raise
+                self._lmpop = False
+            else:
+                return ret[1] if ret else []
+        pipe = self.client.pipeline(transaction=True)
+        pipe.lrange(self.key, 0, n - 1)
+        pipe.ltrim(self.key, n, -1)
+        return pipe.execute()[0]
+
+    def _bpop_many(self, n, timeout):
+        if self._lmpop:
+            ret = self.client.blmpop(timeout, 1, self.key, direction="LEFT", count=n)
+            return ret[1] if ret else []
+        ret = self.client.blpop(self.key, timeout=timeout)
+        if ret is None:
+            return []
+        return [ret[1]] + (self._pop_many(n - 1) if n > 1 else [])
+
+    def qsize(self):
+        return self.client.llen(self.key)
+
+    def empty(self):
+        return self.qsize() == 0
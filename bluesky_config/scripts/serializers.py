@@ -0,0 +1,67 @@
+"""
+Serializers shared by the pod's publishers and consumers.
+
+Every producer and consumer of bluesky documents in the pod has to agree on
+the wire format, so they all get their ``dumps``/``loads`` pair from here:
+
+    from serializers import get_serializer
+
+    serializer = get_serializer()
+    Publisher(..., serializer=serializer.dumps)
+    RemoteDispatcher(..., deserializer=serializer.loads)
+
+The pod uses ``msgpack-numpy``, the msgpack_numpy format it has always used.
+Other formats can be added with ``register_serializer`` and selected with the
+``BLUESKY_POD_SERIALIZER`` environment variable, which must then be the same
+for every producer and consumer.
+"""
+import os
+from collections import namedtuple
+from functools import partial
+
+import msgpack
+import msgpack_numpy as mpn
+
+Serializer = namedtuple("Serializer", ["name", "dumps", "loads"])
+
+_SERIALIZERS = {
+    "msgpack-numpy": Serializer(
+        "msgpack-numpy",
+        partial(msgpack.dumps, default=mpn.encode),
+        partial(msgpack.loads, object_hook=mpn.decode),
+    ),
+}
+
+
+def get_serializer(name=None):
+    """
+    Look up a serializer by name.
+
+    Parameters
+    ----------
+    name : str, optional
+        One of ``available_serializers()``. Defaults to the
+        ``BLUESKY_POD_SERIALIZER`` environment variable, then ``msgpack-numpy``.
+
+    Returns
+    -------
+    serializer : Serializer
+        namedtuple of ``(name, dumps, loads)``
+    """
+    if name is None:
+        name = os.environ.get("BLUESKY_POD_SERIALIZER", "msgpack-numpy")
+    try:
+        return _SERIALIZERS[name]
+    except KeyError:
+        raise ValueError(
+            f"unknown serializer {name!r}, choose from {available_serializers()}"
+        ) from None
+
+
+def available_serializers():
+    return sorted(_SERIALIZERS)
+
+
+def register_serializer(name, dumps, loads):
+    """Make another wire format available to ``get_serializer``."""
+    _SERIALIZERS[name] = Serializer(name, dumps, loads)
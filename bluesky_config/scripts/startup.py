@@ -0,0 +1,190 @@
+"""
+Helpers to open the bluesky environment quickly, and to measure how quickly.
+
+``StartupProfiler`` times the stages of a startup script, and ``Deferred``
+stands in for a client (catalog, producer, ...) that is only built the first
+time it is used, so that its cost is paid by the first plan that needs it
+rather than by every environment open.
+
+    profiler = StartupProfiler()
+    with profiler.stage("import bluesky"):
+        from bluesky import RunEngine
+    db = Deferred(open_catalog, name="catalog", profiler=profiler)
+    profiler.finish()
+
+The report of ``finish`` is printed, and with BLUESKY_POD_STARTUP_PROFILE set
+also written there as JSON, so ``environment_open`` can be tracked over time.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+#: attributes the queue server and bluesky probe namespace items for, to tell
+#: plans and devices apart; a Deferred answers them without being built
+PROBED = frozenset(
+    [
+        "_is_plan_",
+        "children",
+        # the bluesky.protocols
+        "add_callback",
+        "check_value",
+        "clear_sub",
+        "collect",
+        "collect_asset_docs",
+        "collect_pages",
+        "complete",
+        "describe",
+        "describe_collect",
+        "describe_configuration",
+        "done",
+        "exception",
+        "get_index",
+        "hints",
+        "kickoff",
+        "locate",
+        "name",
+        "parent",
+        "pause",
+        "prepare",
+        "read",
+        "read_configuration",
+        "resume",
+        "set",
+        "stage",
+        "stop",
+        "subscribe",
+        "success",
+        "trigger",
+        "unstage",
+    ]
+)
+
+
+class StartupProfiler:
+    """
+    Wall time of each stage of a startup script, and of the whole.
+
+    Parameters
+    ----------
+    name : str, optional
+        What the total measures.
+    """
+
+    def __init__(self, name="environment_open"):
+        self.name = name
+        self.stages = {}
+        self.deferred = {}
+        self.total = None
+        self._t0 = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        "Time the body of the with block as stage name."
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - t0
+
+    def finish(self):
+        "Stop the clock, then print and save the report. Returns the total seconds."
+        self.total = time.perf_counter() - self._t0
+        print(self.report())
+        path = os.environ.get("BLUESKY_POD_STARTUP_PROFILE")
+        if path:
+            with open(path, "w") as f:
+                json.dump(self.snapshot(), f, indent=2)
+        return self.total
+
+    def snapshot(self):
+        "The timings, in seconds, as a JSON-serializable dict."
+        return {
+            self.name: self.total,
+            "stages": dict(self.stages),
+            "deferred": dict(self.deferred),
+        }
+
+    def report(self):
+        total = self.total if self.total is not None else time.perf_counter() - self._t0
+        timed = sum(self.stages.values())
+        lines = [f"{self.name}: {total:.3f} s"]
+        for name, seconds in self.stages.items():
+            lines.append(f"  {name:<28} {seconds:7.3f} s {seconds / total:6.1%}")
+        lines.append(f"  {'(other)':<28} {total - timed:7.3f} s")
+        for name, seconds in self.deferred.items():
+            lines.append(f"  {name + ' (deferred)':<28} {seconds:7.3f} s")
+        return "\n".join(lines)
+
+
+class Deferred:
+    """
+    Stand-in for an object that is built by calling factory on first use.
+
+    Attribute access, calls, indexing and iteration are passed to the object,
+    building it if need be. The attributes in ``PROBED`` are not: until the
+    object is built, they are missing, so the queue server does not build it
+    while it looks for plans and devices in the namespace.
+
+    Parameters
+    ----------
+    factory : callable()
+    name : str, optional
+        For the repr, and the profiler.
+    profiler : StartupProfiler, optional
+        Records how long building the object took.
+    """
+
+    _OWN = frozenset(["_factory", "_name", "_profiler", "_obj", "_lock"])
+
+    def __init__(self, factory, *, name=None, profiler=None):
+        self._factory = factory
+        self._name = name or getattr(factory, "__name__", "object")
+        self._profiler = profiler
+        self._obj = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self):
+        return self._obj is not None
+
+    def resolve(self):
+        "The object, built on the first call."
+        if self._obj is None:
+            with self._lock:
+                if self._obj is None:
+                    t0 = time.perf_counter()
+                    self._obj = self._factory()
+                    if self._profiler is not None:
+                        self._profiler.deferred[self._name] = time.perf_counter() - t0
+        return self._obj
+
+    def __getattr__(self, attr):
+        # dunders are looked up by copy, inspect and the like, not by users; the
+        # own attributes are only missing before __init__, as when unpickling
+        if attr.startswith("__") or attr in self._OWN:
+            raise AttributeError(attr)
+        if self._obj is None and attr in PROBED:
+            raise AttributeError(attr)
+        return getattr(self.resolve(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return self.resolve()[key]
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __len__(self):
+        return len(self.resolve())
+
+    def __contains__(self, key):
+        return key in self.resolve()
+
+    def __repr__(self):
+        if self._obj is not None:
+            return repr(self._obj)
+        return f"<deferred {self._name}>"
@@ -0,0 +1,147 @@
+"""
+Discover the topics a regex-subscribed consumer reads, without needless rebalances.
+
+A consumer subscribed to ``^.*bluesky.documents`` gets new beamline topics from
+the broker on its own, but only at librdkafka's metadata refresh interval,
+and the inserter also needs a database for each of them. ``TopicDiscovery``
+matches the patterns against the topic names of the broker's metadata every
+``interval`` seconds, resubscribes only when the set of matching topics has
+changed, and maps every new topic to a database named after it:
+
+    discovery = TopicDiscovery(topics, topic_database_map)
+    consumer.subscribe(topics, on_assign=discovery.on_assign)
+    ...
+    discovery.poll(consumer, resubscribe)  # between polls
+
+Rebalances, resubscriptions and metadata requests are counted, in
+``pod_metrics`` counters when a registry is given.
+"""
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def database_name(topic):
+    "The database of a topic: mad.bluesky.documents -> mad-bluesky-documents."
+    return topic.replace(".", "-")
+
+
+class TopicDiscovery:
+    """
+    Topics matching a consumer's subscription, and their databases.
+
+    Parameters
+    ----------
+    patterns : list of str
+        The subscription; as for Kafka, those starting with ``^`` are regexes.
+    topic_database_map : dict
+        Updated in place with a database for every matching topic it lacks, so
+        it can be shared with the MongoConsumer's serializers.
+    interval : float, optional
+        Seconds between metadata requests.
+    on_new_topic : callable(topic, database_name), optional
+        Called once for every topic added to topic_database_map.
+    registry : pod_metrics.MetricsRegistry, optional
+        Where to count rebalances, resubscriptions and metadata requests.
+    """
+
+    def __init__(
+        self,
+        patterns,
+        topic_database_map,
+        *,
+        interval=10.0,
+        on_new_topic=None,
+        registry=None,
+    ):
+        self.patterns = list(patterns)
+        self._regexes = [re.compile(p) for p in self.patterns if p.startswith("^")]
+        self._literals = {p for p in self.patterns if not p.startswith("^")}
+        self.topic_database_map = topic_database_map
+        self.interval = interval
+        self.on_new_topic = on_new_topic
+        self.topics = None
+        self.rebalances = 0
+        self.resubscriptions = 0
+        self.metadata_requests = 0
+        self._last_poll = None
+        self._events = self._matched = None
+        if registry is not None:
+            self._events = registry.counter(
+                "bluesky_inserter_topic_events_total",
+                "rebalances, resubscriptions and metadata requests",
+            )
+            self._matched = registry.gauge(
+                "bluesky_inserter_topics", "topics matching the subscription"
+            )
+
+    def _count(self, event):
+        if self._events is not None:
+            self._events(event=event).inc()
+
+    def matches(self, topic):
+        return topic in self._literals or any(r.match(topic) for r in self._regexes)
+
+    def add_topic(self, topic):
+        "Map topic to a database, unless it already is."
+        if topic in self.topic_database_map:
+            return
+        database = database_name(topic)
+        self.topic_database_map[topic] = database
+        logger.info("new topic %s, written to database %s", topic, database)
+        if self.on_new_topic is not None:
+            self.on_new_topic(topic, database)
+
+    def on_assign(self, consumer, partitions):
+        "on_assign callback for Consumer.subscribe; counts the rebalances."
+        self.rebalances += 1
+        self._count("rebalance")
+        for topic in {tp.topic for tp in partitions}:
+            self.add_topic(topic)
+
+    def poll(self, kafka_consumer, resubscribe, force=False):
+        """
+        Look for new and deleted topics, if ``interval`` has passed.
+
+        Parameters
+        ----------
+        kafka_consumer : confluent_kafka.Consumer
+            Asked for the cluster's metadata.
+        resubscribe : callable()
+            Subscribes the consumer again, called if the matching topics changed
+            since the last poll.
+        force : bool, optional
+            Poll even if ``interval`` has not passed.
+
+        Returns
+        -------
+        changed : bool
+        """
+        now = time.monotonic()
+        if not force and self._last_poll is not None:
+            if now - self._last_poll < self.interval:
+                return False
+        self._last_poll = now
+        metadata = kafka_consumer.list_topics(timeout=5.0)
+        self.metadata_requests += 1
+        self._count("metadata_request")
+        topics = {topic for topic in metadata.topics if self.matches(topic)}
+        if self._matched is not None:
+            self._matched().set(len(topics))
+        previous, self.topics = self.topics, topics
+        for topic in topics:
+            self.add_topic(topic)
+        # the first poll only learns what the subscription already covers
+        if previous is None or topics == previous:
+            return False
+        logger.info(
+            "topics added: %s, removed: %s; resubscribing",
+            sorted(topics - previous),
+            sorted(previous - topics),
+        )
+        resubscribe()
+        self.resubscriptions += 1
+        self._count("resubscription")
+        return True
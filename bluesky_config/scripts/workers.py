@@ -0,0 +1,119 @@
+import logging
+import multiprocessing
+import signal
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _worker_main(target, processed):
+    # Turn SIGTERM into the KeyboardInterrupt the bluesky_kafka polling loop
+    # already handles, so the consumer is closed and leaves the group at once
+    # instead of waiting for the broker's session timeout.
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    try:
+        target(processed)
+    except KeyboardInterrupt:
+        pass
+
+
+class WorkerSupervisor:
+    """
+    Run several copies of a Kafka consumer loop in one consumer group.
+
+    Each worker is a separate process running ``target(processed)``, where
+    ``processed`` is a shared counter the worker increments once per document.
+    Because the workers share a group id, Kafka assigns each of them a subset
+    of the topic partitions, and as long as the publisher keys messages by run
+    every document of a run is handled by a single worker, in order.
+
+    Workers that die are restarted; their partitions are handed to the
+    surviving workers by a group rebalance in the meantime. The aggregate and
+    per-worker document rates are logged every ``report_interval`` seconds.
+
+    Parameters
+    ----------
+    target : function(processed)
+        Creates a consumer and runs its polling loop, does not return.
+    n_workers : int
+        Number of worker processes.
+    report_interval : float, optional
+        Seconds between throughput reports.
+    restart_delay : float, optional
+        Seconds to wait before replacing a dead worker.
+    """
+
+    def __init__(self, target, n_workers, *, report_interval=10.0, restart_delay=1.0):
+        # fork, the target is usually defined in a script's __main__
+        self._ctx = multiprocessing.get_context("fork")
+        self._target = target
+        self.n_workers = n_workers
+        self.report_interval = report_interval
+        self.restart_delay = restart_delay
+        # a single writer per counter so no lock is needed
+        self._counters = [self._ctx.Value("Q", 0, lock=False) for _ in range(n_workers)]
+        self._processes = [None] * n_workers
+        self.restarts = 0
+
+    def _spawn(self, index):
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(self._target, self._counters[index]),
+            name=f"mongo-inserter-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info("started worker %d (pid %d)", index, process.pid)
+
+    def run(self):
+        """Start the workers and supervise them until interrupted."""
+        for index in range(self.n_workers):
+            self._spawn(index)
+        last_report = time.monotonic()
+        last_counts = [0] * self.n_workers
+        try:
+            while True:
+                time.sleep(min(1.0, self.report_interval))
+                for index, process in enumerate(self._processes):
+                    if process.exitcode is not None:
+                        logger.warning(
+                            "worker %d (pid %d) exited with code %s, restarting",
+                            index,
+                            process.pid,
+                            process.exitcode,
+                        )
+                        self.restarts += 1
+                        time.sleep(self.restart_delay)
+                        self._spawn(index)
+                if (now := time.monotonic()) - last_report >= self.report_interval:
+                    counts = [counter.value for counter in self._counters]
+                    rates = [
+                        (count - last) / (now - last_report)
+                        for count, last in zip(counts, last_counts)
+                    ]
+                    logger.info(
+                        "%d workers: %.0f docs/s aggregate (%s), %d total, %d restarts",
+                        self.n_workers,
+                        sum(rates),
+                        ", ".join(f"{rate:.0f}" for rate in rates),
+                        sum(counts),
+                        self.restarts,
+                    )
+                    last_report, last_counts = now, counts
+        finally:
+            self.stop()
+
+    def stop(self, timeout=10.0):
+        """Ask every worker to close its consumer, then wait for it."""
+        for process in self._processes:
+            if process is not None and process.exitcode is None:
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout)
+                if process.exitcode is None:
+                    process.kill()
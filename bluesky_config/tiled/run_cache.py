@@ -0,0 +1,406 @@
+"""
+A caching MongoAdapter for the pod's Tiled server.
+
+Completed runs do not change, yet every agent ``unpack_run``, dashboard and
+client re-reads their metadata and event columns from Mongo. The
+CachingMongoAdapter keeps those in one LRU, bounded in bytes, shared by the
+whole tree:
+
+* the BlueskyRun of each run that has a stop document (its start and stop
+  documents, stream names and, once read, its descriptors), and
+* the packed event columns read from those runs, as numpy arrays.
+
+In-progress runs are never put in the LRU; they keep the MongoAdapter's own
+short-lived cache. Given Kafka settings, a consumer thread watches the
+document topics and drops a run's entries when its stop document arrives,
+e.g. when a run is re-ingested. Hit/miss and bytes-served counters are
+reported under ``run_cache`` in the root node's metadata.
+
+Tiled puts the config file's directory on sys.path, so from the config:
+
+    tree: run_cache:CachingMongoAdapter.from_uri
+
+The adapter hooks into private methods of databroker's MongoAdapter and
+DatasetFromDocuments, as in the databroker release pinned in the sub-tiled
+image. ``from_uri`` checks for them and, with a databroker that lacks them,
+logs a warning and serves a plain MongoAdapter instead.
+"""
+import collections
+import functools
+import inspect
+import logging
+import sys
+import threading
+import uuid
+
+import bson
+import msgpack
+import numpy
+from databroker.mongo_normalized import (
+    BlueskyEventStream,
+    DatasetFromDocuments,
+    MongoAdapter,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_BYTES = 512 * 1024**2
+
+# the databroker internals the caching adapter relies on, and the arguments
+# it passes to them
+_HOOKS = [
+    (MongoAdapter, "_get_run", ["run_start_doc"]),
+    (
+        MongoAdapter,
+        "_build_event_stream",
+        ["run_start_uid", "stream_name", "is_complete"],
+    ),
+    (BlueskyEventStream, "__init__", ["cutoff_seq_num", "run"]),
+    (
+        DatasetFromDocuments,
+        "__init__",
+        [
+            "run",
+            "stream_name",
+            "cutoff_seq_num",
+            "event_descriptors",
+            "event_collection",
+            "root_map",
+            "sub_dict",
+            "validate_shape",
+        ],
+    ),
+    (
+        DatasetFromDocuments,
+        "_inner_get_columns",
+        ["keys", "min_seq_num", "max_seq_num"],
+    ),
+    (DatasetFromDocuments, "_get_time_coord", ["slice_params"]),
+]
+
+
+def missing_hooks():
+    "The databroker internals used by CachingMongoAdapter that this databroker lacks."
+    missing = []
+    for cls, name, parameters in _HOOKS:
+        method = getattr(cls, name, None)
+        if method is None or not set(parameters) <= set(
+            inspect.signature(method).parameters
+        ):
+            missing.append(f"{cls.__name__}.{name}")
+    return missing
+
+
+class RunCache:
+    """
+    Thread-safe LRU of values belonging to runs, bounded by their total size.
+
+    Keys are tuples whose first item is the run start uid, so all the entries
+    of a run can be dropped together.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Least recently used entries are evicted to stay under this size.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        # key -> (value, nbytes), least recently used first
+        self._entries = collections.OrderedDict()
+        self._keys_by_run = collections.defaultdict(set)
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        "Return the cached value, or None."
+        with self._lock:
+            try:
+                value, nbytes = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_served += nbytes
+            return value
+
+    def put(self, key, value, nbytes):
+        "Cache a value unless it alone is larger than the cache."
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (value, nbytes)
+            self._keys_by_run[key[0]].add(key)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, run_uid):
+        "Drop every entry of a run."
+        with self._lock:
+            keys = self._keys_by_run.pop(run_uid, ())
+            for key in keys:
+                self._pop(key)
+            if keys:
+                self.invalidations += 1
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.nbytes -= entry[1]
+        run_keys = self._keys_by_run.get(key[0])
+        if run_keys is not None:
+            run_keys.discard(key)
+            if not run_keys:
+                del self._keys_by_run[key[0]]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "bytes_served": self.bytes_served,
+                "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "entries": len(self._entries),
+                "runs": len(self._keys_by_run),
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def _column_nbytes(array):
+    if array.dtype.hasobject:
+        return array.nbytes + sum(sys.getsizeof(item) for item in array.flat)
+    return array.nbytes
+
+
+class _NullCache(dict):
+    "Stands in for the adapter's own cache of complete runs; RunCache holds them."
+
+    def __setitem__(self, key, value):
+        pass
+
+
+class CachedDatasetFromDocuments(DatasetFromDocuments):
+    "The event columns of a completed stream, read through a RunCache."
+
+    def __init__(self, *, cache, **kwargs):
+        # set first: __init__ may read (unicode) columns
+        self._cache = cache
+        super().__init__(**kwargs)
+
+    def _cache_key(self, *key):
+        return (self._run.key, self._stream_name, self._sub_dict, *key)
+
+    def get_columns(self, keys, slices):
+        if slices is None:
+            min_seq_num = 1
+            max_seq_num = self._cutoff_seq_num
+        else:
+            min_seq_num = 1 + slices[0].start
+            max_seq_num = 1 + slices[0].stop
+        columns = {}
+        missing = []
+        for key in keys:
+            column = self._cache.get(self._cache_key(key, min_seq_num, max_seq_num))
+            if column is None:
+                missing.append(key)
+            else:
+                columns[key] = column
+        if missing:
+            to_stack = self._inner_get_columns(tuple(missing), min_seq_num, max_seq_num)
+            for key, value in to_stack.items():
+                column = numpy.stack(value)
+                # shared between requests
+                column.flags.writeable = False
+                self._cache.put(
+                    self._cache_key(key, min_seq_num, max_seq_num),
+                    column,
+                    _column_nbytes(column),
+                )
+                columns[key] = column
+        if slices:
+            return {key: columns[key][(..., *slices[1:])] for key in keys}
+        return {key: columns[key] for key in keys}
+
+    def _get_time_coord(self, slice_params):
+        key = self._cache_key("time", slice_params)
+        column = self._cache.get(key)
+        if column is None:
+            column = super()._get_time_coord(slice_params)
+            column.flags.writeable = False
+            self._cache.put(key, column, column.nbytes)
+        return column
+
+
+class CachingMongoAdapter(MongoAdapter):
+    """
+    MongoAdapter that serves completed runs from a RunCache.
+
+    Use :meth:`from_uri`; it takes the MongoAdapter.from_uri arguments plus
+    the cache size and the Kafka settings for invalidation.
+    """
+
+    @classmethod
+    def from_uri(
+        cls,
+        uri,
+        *,
+        cache_bytes=DEFAULT_CACHE_BYTES,
+        kafka_bootstrap_servers=None,
+        kafka_topics=None,
+        **kwargs,
+    ):
+        """
+        Parameters
+        ----------
+        uri : str
+            MongoDB URI with database name.
+        cache_bytes : int, optional
+            Size bound of the cache.
+        kafka_bootstrap_servers : str, optional
+            If given, invalidate runs on stop documents from ``kafka_topics``.
+        kafka_topics : list of str, optional
+            Document topics; entries starting with "^" are regular expressions.
+        **kwargs
+            Passed to MongoAdapter.from_uri.
+        """
+        missing = missing_hooks()
+        if missing:
+            logger.warning(
+                "databroker %s lacks %s, serving runs without the run cache",
+                getattr(sys.modules["databroker"], "__version__", "?"),
+                ", ".join(missing),
+            )
+            return MongoAdapter.from_uri(uri, **kwargs)
+        adapter = super().from_uri(uri, **kwargs)
+        adapter._run_cache.max_bytes = int(cache_bytes)
+        if kafka_bootstrap_servers is not None:
+            StopDocumentListener(
+                kafka_bootstrap_servers,
+                kafka_topics or ["^.*bluesky.documents$"],
+                on_stop=adapter._run_cache.invalidate,
+            ).start()
+        return adapter
+
+    def __init__(self, *args, run_cache=None, **kwargs):
+        kwargs["cache_of_complete_bluesky_runs"] = _NullCache()
+        super().__init__(*args, **kwargs)
+        self._run_cache = run_cache if run_cache is not None else RunCache()
+
+    def new_variation(self, *args, **kwargs):
+        return super().new_variation(*args, run_cache=self._run_cache, **kwargs)
+
+    def metadata(self):
+        return {**super().metadata(), "run_cache": self._run_cache.stats()}
+
+    def _get_run(self, run_start_doc):
+        uid = run_start_doc["uid"]
+        run = self._run_cache.get((uid, "run"))
+        if run is None:
+            run = super()._get_run(run_start_doc)
+            stop_doc = run.metadata()["stop"]
+            if stop_doc is not None:
+                self._run_cache.put(
+                    (uid, "run"), run, self._run_nbytes(run_start_doc, stop_doc)
+                )
+        return run
+
+    def _run_nbytes(self, run_start_doc, stop_doc):
+        # the run holds the descriptors of every stream once it has been read
+        nbytes = len(bson.encode(run_start_doc)) + len(bson.encode(stop_doc))
+        for descriptor in self._event_descriptor_collection.find(
+            {"run_start": run_start_doc["uid"]}, {"_id": False}
+        ):
+            nbytes += len(bson.encode(descriptor))
+        return nbytes
+
+    def _build_event_stream(self, *, run_start_uid, stream_name, is_complete):
+        stream = super()._build_event_stream(
+            run_start_uid=run_start_uid,
+            stream_name=stream_name,
+            is_complete=is_complete,
+        )
+        if is_complete:
+            for sub_dict in ("data", "timestamps"):
+                stream._mapping.set(
+                    sub_dict,
+                    functools.partial(
+                        CachedDatasetFromDocuments,
+                        cache=self._run_cache,
+                        run=stream._run,
+                        stream_name=stream_name,
+                        cutoff_seq_num=stream._cutoff_seq_num,
+                        event_descriptors=stream._metadata["descriptors"],
+                        event_collection=self._event_collection,
+                        root_map=self.root_map,
+                        sub_dict=sub_dict,
+                        validate_shape=self.validate_shape,
+                    ),
+                )
+        return stream
+
+
+class StopDocumentListener(threading.Thread):
+    """
+    Call ``on_stop(run_start_uid)`` for each stop document on the topics.
+
+    Only the document name is decoded for other documents, so large events
+    cost little. The consumer group is unique to this process so that every
+    Tiled server sees every stop document, starting from the latest offsets.
+    """
+
+    def __init__(self, bootstrap_servers, topics, on_stop):
+        super().__init__(name="run-cache-invalidation", daemon=True)
+        self._bootstrap_servers = bootstrap_servers
+        self._topics = list(topics)
+        self._on_stop = on_stop
+
+    def run(self):
+        from confluent_kafka import Consumer
+
+        consumer = Consumer(
+            {
+                "bootstrap.servers": self._bootstrap_servers,
+                "group.id": f"tiled-run-cache-{uuid.uuid4()}",
+                "auto.offset.reset": "latest",
+                "enable.auto.commit": False,
+            }
+        )
+        consumer.subscribe(self._topics)
+        logger.info("invalidating cached runs on stop documents from %s", self._topics)
+        while True:
+            message = consumer.poll(1.0)
+            if message is None:
+                continue
+            if message.error():
+                logger.debug("kafka error %s", message.error())
+                continue
+            try:
+                run_start_uid = self._run_start_of_stop(message.value())
+            except Exception:
+                logger.exception("could not decode a message from %s", message.topic())
+                continue
+            if run_start_uid is not None:
+                self._on_stop(run_start_uid)
+
+    @staticmethod
+    def _run_start_of_stop(payload):
+        # messages are msgpack [name, doc]
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(payload)
+        if unpacker.read_array_header() != 2 or unpacker.unpack() != "stop":
+            return None
+        return unpacker.unpack()["run_start"]
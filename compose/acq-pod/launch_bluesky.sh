@@ -68,12 +68,14 @@ podman run --pod pod_acq-pod  \
        -v `pwd`:'/app' -w '/app' \
        -v ${BLUESKY_PROFILE_DIR:-$parent_path/../../bluesky_config/ipython/profile_default}:/usr/local/share/ipython/profile_default \
        -v $parent_path/../../bluesky_config/ipython/localdevs.py:/usr/local/share/ipython/localdevs.py \
+       -v $parent_path/../../bluesky_config/scripts:/usr/local/share/bluesky-scripts \
        -v $parent_path/../../bluesky_config/databroker/mad.yml:/usr/local/share/intake/mad.yml \
        -v $parent_path/../../bluesky_config/databroker/mad-tiled.yml:/usr/etc/tiled/profiles/mad-tiled.yml \
        -v $parent_path/../../bluesky_config/happi:/usr/local/share/happi \
+       -v acq-pod_data:/nsls2/data/mad \
        -e XDG_RUNTIME_DIR=/tmp/runtime-$USER \
        -e EPICS_CA_AUTO_ADDR_LIST=YES \
-       -e PYTHONPATH=/usr/local/share/ipython\
+       -e PYTHONPATH=/usr/local/share/ipython:/usr/local/share/bluesky-scripts\
        -e QSERVER_ZMQ_CONTROL_ADDRESS=tcp://queue_manager:60615\
        -e QSERVER_ZMQ_INFO_ADDRESS=tcp://queue_manager:60625\
        $imagename \
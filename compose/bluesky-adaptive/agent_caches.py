@@ -0,0 +1,157 @@
+"""Compact, memory-bounded caches for agents that accumulate what they ingest."""
+
+import sys
+from typing import Hashable, Iterable, Optional
+
+import numpy as np
+
+
+class ArrayCache:
+    """Rows of equal shape in one contiguous NumPy buffer, a drop-in for a list of arrays.
+
+    The buffer grows geometrically, so appends are amortized O(1) and ``np.asarray(cache)`` is a
+    zero-copy (read-only) view of the rows, oldest first. With ``max_len`` only the newest rows are
+    kept: the buffer stops growing at ``max_len`` plus some slack, and once full the newest
+    ``max_len`` rows are copied to the start of a new buffer, so memory stays flat however long the
+    agent runs.
+
+    Rows are only ever written past the end of the live ones, never in place, so a view handed out
+    keeps its rows while the cache is appended to, e.g. by ingest on another thread.
+
+    Parameters
+    ----------
+    max_len : int, optional
+        Keep at most this many rows, evicting the oldest. By default unbounded.
+    dtype : np.dtype, optional
+        Type of the buffer, by default that of the first row.
+    initial_capacity : int, optional
+        Rows allocated on the first append.
+    """
+
+    def __init__(self, max_len: Optional[int] = None, *, dtype=None, initial_capacity: int = 64):
+        self.max_len = max_len
+        self._dtype = dtype
+        self._initial_capacity = initial_capacity
+        self._buffer = None
+        self._start = 0
+        self._stop = 0
+
+    def append(self, row):
+        row = np.asarray(row, dtype=self._dtype)
+        if self._buffer is None:
+            self._dtype = row.dtype
+            self._buffer = np.empty((self._initial_capacity, *row.shape), dtype=row.dtype)
+        elif row.shape != self._buffer.shape[1:]:
+            raise ValueError(f"Expected a row of shape {self._buffer.shape[1:]}, got {row.shape}")
+        if self._stop == len(self._buffer):
+            self._make_room()
+        self._buffer[self._stop] = row
+        self._stop += 1
+        if self.max_len is not None and self._stop - self._start > self.max_len:
+            self._start += 1
+
+    def extend(self, rows: Iterable):
+        for row in rows:
+            self.append(row)
+
+    def _make_room(self):
+        n = self._stop - self._start
+        capacity = 2 * len(self._buffer)
+        if self.max_len is not None:
+            # a quarter of slack means the live rows are copied once every max_len / 4 appends
+            capacity = min(capacity, self.max_len + max(self.max_len // 4, 1))
+        # a new buffer even at the size limit: sliding the rows back in place would overwrite
+        # views of them
+        buffer = np.empty((capacity, *self._buffer.shape[1:]), dtype=self._buffer.dtype)
+        buffer[:n] = self._buffer[self._start : self._stop]
+        self._buffer, self._start, self._stop = buffer, 0, n
+
+    def view(self) -> np.ndarray:
+        """The cached rows, oldest first, without copying."""
+        if self._buffer is None:
+            return np.empty((0,))
+        view = self._buffer[self._start : self._stop]
+        view.flags.writeable = False
+        return view
+
+    def __array__(self, dtype=None, copy=None):
+        view = self.view()
+        if copy:
+            return np.array(view, dtype=dtype, copy=True)
+        if dtype is None or np.dtype(dtype) == view.dtype:
+            return view
+        if copy is False:
+            raise ValueError(f"Cannot convert the {view.dtype} rows to {np.dtype(dtype)} without a copy")
+        return view.astype(dtype)
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, index):
+        return self.view()[index]
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def clear(self):
+        # a new buffer on the next append, the old rows may still be viewed
+        self._buffer = None
+        self._start = self._stop = 0
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes allocated for the buffer, used or not."""
+        return 0 if self._buffer is None else self._buffer.nbytes
+
+
+class UidCache:
+    """Insertion-ordered set of uids, a drop-in for the agent's ``known_uid_cache`` list.
+
+    Membership tests are O(1). With ``max_len`` it acts as a ring buffer: adding a uid to a full
+    cache evicts the oldest one.
+
+    Parameters
+    ----------
+    max_len : int, optional
+        Keep at most this many uids, by default unbounded.
+    uids : iterable of str, optional
+        Initial contents, oldest first.
+    """
+
+    def __init__(self, max_len: Optional[int] = None, uids: Iterable[Hashable] = ()):
+        self.max_len = max_len
+        self._uids = {}
+        for uid in uids:
+            self.append(uid)
+
+    def append(self, uid: Hashable):
+        # re-adding a uid makes it the newest
+        self._uids.pop(uid, None)
+        self._uids[uid] = None
+        if self.max_len is not None and len(self._uids) > self.max_len:
+            del self._uids[next(iter(self._uids))]
+
+    def __contains__(self, uid):
+        return uid in self._uids
+
+    def __len__(self):
+        return len(self._uids)
+
+    def __iter__(self):
+        return iter(self._uids)
+
+    def __getitem__(self, index):
+        if index == -1 and self._uids:
+            return next(reversed(self._uids))
+        return list(self._uids)[index]
+
+    def __copy__(self):
+        return type(self)(self.max_len, self._uids)
+
+    def clear(self):
+        self._uids.clear()
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate bytes held by the uids and the index."""
+        return sys.getsizeof(self._uids) + sum(sys.getsizeof(uid) for uid in self._uids)
@@ -0,0 +1,112 @@
+"""Write an agent's documents to Tiled off the decision path."""
+
+import logging
+from typing import Optional
+
+import numpy as np
+from publishing import AsyncPublisher
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAgentCatalog:
+    """Stand-in for an agent's ``tiled_agent_node`` that inserts its documents from a background thread.
+
+    The agent writes its start, descriptor, event and stop documents with ``agent_catalog.v1.insert``, which for
+    a Tiled node is one HTTP request per document, made while the agent is deciding. Here ``insert`` only queues
+    the document on an ``AsyncPublisher``, which packs the events that pile up into event pages, one request
+    each. Any other attribute is looked up on the wrapped catalog.
+
+    Parameters
+    ----------
+    catalog : tiled.client.container.Container
+        Catalog the documents are written to.
+    maxsize : int, optional
+        Capacity of the queue in documents.
+    overflow : {"block", "drop"}, optional
+        When the queue is full, block the agent until there is room, or drop the event. Start, descriptor and
+        stop documents always block.
+    max_page_size : int, optional
+        Maximum number of events written in one request.
+    downcast : np.dtype, optional
+        Write float64 arrays as this type, e.g. float32 to halve the size of report images.
+    """
+
+    def __init__(
+        self,
+        catalog,
+        *,
+        maxsize: int = 256,
+        overflow: str = "block",
+        max_page_size: int = 64,
+        downcast: Optional[np.dtype] = None,
+    ):
+        self._catalog = catalog
+        self.downcast = None if downcast is None else np.dtype(downcast)
+        self.publisher = AsyncPublisher(
+            self._insert, maxsize=maxsize, max_page_size=max_page_size, overflow=overflow
+        )
+
+    @property
+    def v1(self):
+        return self
+
+    def insert(self, name, doc):
+        self.publisher(name, doc)
+
+    def _insert(self, name, doc):
+        if self.downcast is not None:
+            doc = self._downcast(name, doc)
+        self._catalog.v1.insert(name, doc)
+
+    def _cast(self, value):
+        if isinstance(value, np.ndarray) and value.dtype == np.float64:
+            return value.astype(self.downcast)
+        return value
+
+    def _downcast(self, name, doc):
+        """A copy of doc with its float64 arrays, and their data keys, as the downcast type."""
+        if name == "descriptor":
+            data_keys = {}
+            for key, data_key in doc["data_keys"].items():
+                if data_key.get("dtype") == "array" and data_key.get("dtype_str") == "<f8":
+                    dtype = self.downcast.newbyteorder("<")
+                    data_key = dict(data_key, dtype_str=dtype.str, dtype_descr=dtype.descr)
+                data_keys[key] = data_key
+            return dict(doc, data_keys=data_keys)
+        if name == "event":
+            return dict(doc, data={key: self._cast(value) for key, value in doc["data"].items()})
+        if name == "event_page":
+            data = {key: [self._cast(value) for value in values] for key, values in doc["data"].items()}
+            return dict(doc, data=data)
+        return doc
+
+    @property
+    def metrics(self) -> dict:
+        """Queue depth, drops and write latency in ms, for a status endpoint."""
+        metrics = self.publisher.metrics
+        written = metrics["messages_out"]
+        return dict(
+            queue_depth=metrics["queue_depth"],
+            max_queue_depth=metrics["max_queue_depth"],
+            documents_in=metrics["documents_in"],
+            requests=written,
+            dropped=metrics["n_dropped"],
+            blocked=metrics["n_blocked"],
+            errors=metrics["errors"],
+            mean_write_ms=metrics["time_publishing"] / written * 1e3 if written else 0.0,
+            max_write_ms=metrics["max_publish_latency"] * 1e3,
+            last_write_ms=metrics["last_publish_latency"] * 1e3,
+        )
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued document has been written."""
+        return self.publisher.flush(timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """Write every queued document and stop the background thread."""
+        self.publisher.close(timeout)
+        logger.info(f"Agent document writer closed: {self.metrics}")
+
+    def __getattr__(self, key):
+        return getattr(self._catalog, key)
@@ -0,0 +1,83 @@
+"""
+Ingest latency of the mock clustering agent as its cache grows.
+
+Drives ClusterAgentMock itself, offline (OfflineAgent's stand-ins for Kafka, Tiled and the queue
+server), through what the agent does per run it is told about: ``ingest`` (appending to its
+ArrayCaches, and in incremental mode the ``partial_fit`` of pending observables and the refit every
+--refit_every ingests) then ``report`` (a KMeans fit over the cache, unless incremental).
+
+- full: ClusterAgentMock(incremental=False)
+- incremental: ClusterAgentMock(incremental=True); the agent's full refit is timed on its own and
+  amortized over --refit_every ingests into the mean
+
+For each cache size the agent is pre-filled with mock spectra by ``ingest_many``, as a reingest
+does, then --repeat runs are timed. The bluesky scripts must be on ``PYTHONPATH``, as in the agent
+containers.
+
+    python3 bench_cluster.py --sizes 10,100,1000,10000,100000 --repeat 5
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+from cluster_agent import ClusterAgentMock
+from load_generator import mock_spectra
+
+
+def runs(n, rng):
+    "n (independent, observable) pairs of ClusterAgentMock.unpack_run (data_dim=1) at once."
+    x = rng.random((n, 1))
+    return x, mock_spectra(x[:, 0])
+
+
+def make_agent(independents, observables, k, incremental, refit_every):
+    agent = ClusterAgentMock(k, incremental=incremental, refit_every=refit_every, max_cache_len=None)
+    agent.ingest_many(independents, observables)
+    for i in range(len(observables)):
+        agent.known_uid_cache.append(f"prefill-{i}")
+    return agent
+
+
+def time_runs(agent, independents, observables):
+    times = []
+    for i, (x, y) in enumerate(zip(independents, observables)):
+        t0 = time.perf_counter()
+        agent.known_uid_cache.append(f"run-{i}")
+        agent.ingest(x, y)
+        agent.report()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="clustering agent ingest benchmark")
+    parser.add_argument("--sizes", type=str, default="10,100,1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--refit_every", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'runs':>7} {'full ms':>10} {'incr ms':>10} {'incr+refit ms':>14} {'speedup':>8}")
+    for size in map(int, args.sizes.split(",")):
+        cache = runs(size, rng)
+        new = runs(args.repeat, rng)
+        agent = make_agent(*cache, args.k, False, args.refit_every)
+        full = statistics.median(time_runs(agent, *new))
+        # no refit falls in the timed runs, it is timed below
+        agent = make_agent(*cache, args.k, True, 0)
+        times = time_runs(agent, *new)
+        t0 = time.perf_counter()
+        agent._full_fit()
+        refit = time.perf_counter() - t0
+        incremental = statistics.median(times)
+        amortized = statistics.mean(times) + (refit / args.refit_every if args.refit_every else 0.0)
+        print(
+            f"{size:>7} {full * 1e3:10.2f} {incremental * 1e3:10.2f} "
+            f"{amortized * 1e3:14.2f} {full / amortized:8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Suggestions per second of the reactive agent's decision path.
+
+Each ReactiveAgent.suggest() and report() builds a 100x100, 4-octave perlin "brain". This times that
+path the way it used to be done (a meshgrid and a perlin() call per octave, reseeding the global RNG)
+against the cached, single-pass PerlinNoise, in float64 and float32.
+
+    python3 bench_perlin.py --repeat 500
+"""
+import argparse
+import time
+
+import numpy as np
+from perlin_noise import PerlinNoise, perlin
+
+
+def make_perlin_noise():
+    "ReactiveAgent._make_perlin_noise before PerlinNoise."
+    perlin_noise = np.zeros((100, 100))
+    for i in range(4):
+        freq = 2**i
+        lin = np.linspace(0, freq, 100, endpoint=False)
+        x, y = np.meshgrid(lin, lin)
+        perlin_noise = perlin(x, y, seed=None) / freq + perlin_noise
+    return perlin_noise
+
+
+def suggest(make_brain, last_value=0.4, target=0.5, step_size=0.1):
+    "The work of ReactiveAgent.suggest(1), less logging."
+    next_value = last_value - step_size if last_value > target else last_value + step_size
+    return [dict(target=target, step_size=step_size, next_value=next_value, brain=make_brain())], [next_value]
+
+
+def suggestions_per_second(make_brain, repeat):
+    suggest(make_brain)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        suggest(make_brain)
+    return repeat / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="perlin brain benchmark")
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    before = suggestions_per_second(make_perlin_noise, args.repeat)
+    print(f"{'brain':>22} {'suggestions/s':>14} {'speedup':>8}")
+    print(f"{'perlin() per octave':>22} {before:14.0f} {1:8.1f}")
+    for dtype in (np.float64, np.float32):
+        rate = suggestions_per_second(PerlinNoise(dtype=dtype), args.repeat)
+        print(f"{'PerlinNoise ' + np.dtype(dtype).name:>22} {rate:14.0f} {rate / before:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""The mock clustering agent, importable without the agent server (see mock_agent.py)."""
+
+import logging
+from typing import Literal, Optional
+
+import numpy as np
+from agent_caches import ArrayCache, UidCache
+from agent_writer import AsyncAgentCatalog
+from bluesky_adaptive.agents.sklearn import ClusterAgentBase
+from bluesky_adaptive.utils.offline import OfflineAgent
+from httpx import ConnectError, HTTPStatusError
+from load_generator import mock_spectra
+from reingest import ParallelReingest
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from tiled.client import from_profile, from_uri
+
+logger = logging.getLogger(__name__)
+
+
+class ClusterAgentMock(ClusterAgentBase, OfflineAgent):
+    """Mock agent for testing purposes. Inherits from ClusterAgentBase and OfflineAgent."""
+
+    def __init__(
+        self,
+        k_clusters: int,
+        *args,
+        use_tiled: bool = False,
+        async_writes: bool = True,
+        data_dim: Literal[1, 2] = 1,
+        incremental: bool = False,
+        refit_every: int = 1000,
+        max_cache_len: Optional[int] = 10_000,
+        reingest_workers: int = 8,
+        **kwargs,
+    ):
+        """Initialize the mock agent with optional metadata.
+        Parameters
+        ----------
+        use_tiled : bool, optional
+            Whether to use Tiled for writing agent data to storage, by default False.
+            Does not read exp data from storage regardless.
+        async_writes : bool, optional
+            With use_tiled, write the agent documents from a background thread, in
+            event pages, instead of one request per document, by default True.
+        data_dim : Literal[1, 2], optional
+            Dimension of the independent variable to be used by the agent, by default 1.
+            This is limited to 1 or 2, to facilitate plotting and testing.
+        incremental : bool, optional
+            Cluster with MiniBatchKMeans, updated by ``partial_fit`` on each ingest,
+            instead of refitting KMeans over the whole cache on each report,
+            by default False.
+        refit_every : int, optional
+            In incremental mode, refit on the whole cache after this many ingests,
+            to undo the drift of the online updates, by default 1000. 0 never refits.
+        max_cache_len : int, optional
+            Keep only the latest this many runs (and uids) in the caches, so memory
+            stays flat over long sessions, by default 10_000. None keeps everything.
+        reingest_workers : int, optional
+            Runs fetched at once by ``close_and_restart(reingest_all=True)``, by default 8.
+        """
+        self.max_cache_len = max_cache_len
+        self.reingest = ParallelReingest(self, max_workers=reingest_workers)
+        self._incremental = incremental
+        self.refit_every = refit_every
+        # observables not yet given to partial_fit, and ingests since the last full fit
+        self._pending = []
+        self._since_refit = 0
+        estimator = self._build_estimator(k_clusters, incremental)
+        self.data_dim = data_dim
+        if use_tiled:
+            logger.info("Using Tiled for agent data storage.")
+            try:
+                tiled_container = from_uri(
+                    "http://tiled_local:8000", api_key="ABCDABCD"
+                )
+            except ConnectError or HTTPStatusError:
+                tiled_container = from_profile("MAD")
+            if async_writes:
+                tiled_container = AsyncAgentCatalog(tiled_container)
+            kwargs["tiled_agent_node"] = tiled_container
+        super().__init__(
+            *args,
+            estimator=estimator,
+            loop_consumer_on_start=True,
+            **kwargs,
+        )
+
+    @property
+    def name(self) -> str:
+        """Short string name"""
+        return "MockClusterAgent"
+
+    # ==========================Useful behavior for clustering, caching, restarting ========================== #
+    # The base classes keep the caches as lists, and assign fresh lists to clear them.
+    # These properties store contiguous, bounded caches instead, whatever is assigned.
+    @property
+    def independent_cache(self) -> ArrayCache:
+        return self._independent_cache
+
+    @independent_cache.setter
+    def independent_cache(self, values):
+        self._independent_cache = ArrayCache(self.max_cache_len)
+        self._independent_cache.extend(values)
+
+    @property
+    def observable_cache(self) -> ArrayCache:
+        return self._observable_cache
+
+    @observable_cache.setter
+    def observable_cache(self, values):
+        self._observable_cache = ArrayCache(self.max_cache_len)
+        self._observable_cache.extend(values)
+
+    @property
+    def known_uid_cache(self) -> UidCache:
+        return self._known_uid_cache
+
+    @known_uid_cache.setter
+    def known_uid_cache(self, uids):
+        self._known_uid_cache = UidCache(self.max_cache_len, uids)
+
+    @property
+    def cache_nbytes(self) -> dict:
+        """Bytes held by each cache."""
+        return dict(
+            independent_cache=self.independent_cache.nbytes,
+            observable_cache=self.observable_cache.nbytes,
+            known_uid_cache=self.known_uid_cache.nbytes,
+        )
+
+    @staticmethod
+    def _build_estimator(k_clusters, incremental):
+        if incremental:
+            return MiniBatchKMeans(k_clusters, n_init="auto", random_state=42)
+        return KMeans(k_clusters, n_init="auto", random_state=42)
+
+    def _full_fit(self):
+        """Fit the model on the whole cache, handed over without a copy."""
+        self.model.fit(np.asarray(self.observable_cache))
+        self._pending = []
+        self._since_refit = 0
+
+    def ingest(self, x, y):
+        doc = super().ingest(x, y)
+        if self._incremental:
+            fitted = hasattr(self.model, "cluster_centers_")
+            self._pending.append(y)
+            self._since_refit += 1
+            if self.refit_every and self._since_refit >= self.refit_every:
+                self._full_fit()
+            # the first partial_fit initializes the centers, so it needs k samples
+            elif fitted or len(self._pending) >= self.model.n_clusters:
+                self.model.partial_fit(np.asarray(self._pending))
+                self._pending = []
+        return doc
+
+    def ingest_many(self, independents, dependents):
+        """Append a batch of runs to the caches and fit the model once."""
+        docs = []
+        for x, y in zip(independents, dependents):
+            docs.append(super().ingest(x, y))
+        if len(self.observable_cache) >= self.model.n_clusters:
+            self._full_fit()
+        return docs
+
+    def report(self, **kwargs):
+        if not self._incremental or not hasattr(self.model, "cluster_centers_"):
+            self._full_fit()
+        return dict(
+            cluster_centers=self.model.cluster_centers_,
+            cache_len=len(self.independent_cache),
+            latest_data=self.known_uid_cache[-1],
+        )
+
+    def clear_caches(self):
+        self.independent_cache.clear()
+        self.observable_cache.clear()
+        self._pending = []
+        self._since_refit = 0
+
+    def close_and_restart(
+        self, *, clear_uid_cache=False, reingest_all=False, reason=""
+    ):
+        if clear_uid_cache:
+            self.clear_caches()
+        elif reingest_all:
+            # the base class fetches and ingests one run at a time, on top of the caches
+            self.stop(reason=f"Close and Restart: {reason}")
+            uids = list(self.known_uid_cache)
+            self.clear_caches()
+            self.known_uid_cache = []
+            self.reingest(uids)
+            return self.start()
+        return super().close_and_restart(
+            clear_uid_cache=clear_uid_cache, reingest_all=reingest_all, reason=reason
+        )
+
+    @property
+    def n_clusters(self):
+        return self.model.n_clusters
+
+    @n_clusters.setter
+    def n_clusters(self, value):
+        self._rebuild_model(int(value), self._incremental)
+
+    @property
+    def incremental(self) -> bool:
+        return self._incremental
+
+    @incremental.setter
+    def incremental(self, flag: bool):
+        self._rebuild_model(self.model.n_clusters, bool(flag))
+
+    def _rebuild_model(self, k_clusters, incremental):
+        """Swap in a new estimator, fit to the data so far, and restart with its params."""
+        self._incremental = incremental
+        self.model = self._build_estimator(k_clusters, incremental)
+        if incremental and len(self.observable_cache) >= k_clusters:
+            self._full_fit()
+        self.close_and_restart()
+
+    @property
+    def direct_to_queue(self) -> bool:
+        return self._direct_to_queue
+
+    @direct_to_queue.setter
+    def direct_to_queue(self, flag: bool):
+        self._direct_to_queue = flag
+
+    def server_registrations(self) -> None:
+        self._register_method("clear_caches")
+        self._register_property("n_clusters")
+        self._register_property("incremental", pv_type="bool")
+        self._register_property("direct_to_queue", pv_type="bool")
+        return super().server_registrations()
+
+    # ==========================Useful behavior for clustering, caching, restarting ========================== #
+
+    def unpack_run(self, *args, **kwargs):
+        """Mock unpack run method for clustering that returns position dependent gaussian mixture data."""
+        x = np.random.rand(self.data_dim)
+        # 5 gaussian peaks, their heights depending on the average position for 1D or 2D
+        return x, mock_spectra(np.mean(x))
+
+    def measurement_plan(self, point):
+        """Mock simply acceptable measurement plan, that as is, is not used."""
+        return "scan", [["random_walk"], "random_walk_k", 0.0, 1.0, 1], {}
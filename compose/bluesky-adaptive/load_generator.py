@@ -0,0 +1,200 @@
+"""
+Synthetic runs at a steady rate, for load-testing the agents, the inserter and Tiled.
+
+Each run is a complete start/descriptor/event_page/stop document stream of a "scan"
+of the mock agent's position-dependent five-Gaussian spectra, as in
+ClusterAgentMock.unpack_run. Spectra are computed for a whole block of runs at
+once, vectorized over the peaks and the positions. The documents go to the
+mad.bluesky.documents topic, keyed by run like the RunEngine's, or with
+--sink local to an in-process stand-in that only encodes them.
+
+    python3 load_generator.py --runs_per_minute 1200 --duration 60
+    python3 load_generator.py --sink local --runs_per_minute 0 --n_runs 10000
+"""
+import argparse
+import time
+
+import numpy as np
+from event_model import compose_run
+
+# (peak_center, peak_width, base_height, x_relevant_center)
+GAUSSIANS = np.array(
+    [
+        (0.2, 0.05, 1.0, 0.0),  # Most intense at x=0
+        (0.4, 0.08, 0.7, 0.25),  # Most intense at x=0.25
+        (0.6, 0.06, 0.8, 0.5),  # Most intense at x=0.5
+        (0.7, 0.04, 0.9, 0.75),  # Most intense at x=0.75
+        (0.9, 0.07, 0.6, 1.0),  # Most intense at x=1
+    ]
+)
+
+
+def mock_spectra(x_pos, n_points=100, x_width=0.2):
+    """
+    Position-dependent five-Gaussian spectra.
+
+    Parameters
+    ----------
+    x_pos : array_like
+        Positions in [0, 1], of any shape.
+    n_points : int, optional
+        Points per spectrum, on a linear scan of [0, 1].
+    x_width : float, optional
+        Width of the position dependence of each peak's height.
+
+    Returns
+    -------
+    np.ndarray
+        Shape ``x_pos.shape + (n_points,)``.
+    """
+    x_pos = np.asarray(x_pos, dtype=float)[..., None, None]
+    x_scan = np.linspace(0, 1, n_points)
+    center, width, height, relevant = (g[:, None] for g in GAUSSIANS.T)
+    scale = np.exp(-((x_pos - relevant) ** 2) / (2 * x_width**2))
+    peaks = height * scale * np.exp(-((x_scan - center) ** 2) / (2 * width**2))
+    return peaks.sum(axis=-2)
+
+
+class LocalSink:
+    "In-process stand-in for the Kafka publisher: encodes each document and counts it."
+
+    def __init__(self, serializer):
+        self._serializer = serializer
+        self.documents = 0
+        self.bytes = 0
+
+    def __call__(self, name, doc):
+        self.documents += 1
+        self.bytes += len(self._serializer((name, doc)))
+
+    def flush(self):
+        pass
+
+
+def run_documents(positions, spectra, *, motor="motor", detector="random_walk"):
+    """
+    The documents of one run: a point per position, in one event page.
+
+    The detector reads the spectrum and its maximum, under ``<detector>_x``
+    like the random walk detector the reactive agent reads.
+    """
+    run = compose_run(
+        metadata=dict(plan_name="load_generator", motors=[motor], detectors=[detector])
+    )
+    yield "start", run.start_doc
+    descriptor = run.compose_descriptor(
+        name="primary",
+        data_keys={
+            motor: dict(dtype="number", shape=[], source="load_generator"),
+            f"{detector}_x": dict(dtype="number", shape=[], source="load_generator"),
+            f"{detector}_spectrum": dict(
+                dtype="array", shape=list(spectra.shape[1:]), source="load_generator"
+            ),
+        },
+    )
+    yield "descriptor", descriptor.descriptor_doc
+    now = time.time()
+    n = len(positions)
+    timestamps = [now] * n
+    yield "event_page", descriptor.compose_event_page(
+        data={
+            motor: positions.tolist(),
+            f"{detector}_x": spectra.max(axis=-1).tolist(),
+            f"{detector}_spectrum": list(spectra),
+        },
+        timestamps={
+            motor: timestamps,
+            f"{detector}_x": timestamps,
+            f"{detector}_spectrum": timestamps,
+        },
+        seq_num=list(range(1, n + 1)),
+        time=timestamps,
+    )
+    yield "stop", run.compose_stop()
+
+
+def generate(
+    publish, *, n_runs, runs_per_minute, points_per_run=1, block=100, n_points=100, seed=None
+):
+    """
+    Publish n_runs runs at runs_per_minute (0 for as fast as possible).
+
+    Positions and spectra are computed ``block`` runs at a time. Returns the
+    number of runs published and the seconds it took.
+    """
+    rng = np.random.default_rng(seed)
+    interval = 60 / runs_per_minute if runs_per_minute else 0.0
+    t0 = time.monotonic()
+    done = 0
+    while done < n_runs:
+        m = min(block, n_runs - done)
+        positions = rng.random((m, points_per_run))
+        spectra = mock_spectra(positions, n_points)
+        for i in range(m):
+            # runs are paced against the start, so slow blocks catch up
+            delay = t0 + done * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            for name, doc in run_documents(positions[i], spectra[i]):
+                publish(name, doc)
+            done += 1
+    return done, time.monotonic() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="synthetic bluesky run generator")
+    parser.add_argument("--sink", choices=["kafka", "local"], default="kafka")
+    parser.add_argument("--bootstrap_servers", type=str, default="kafka:29092")
+    parser.add_argument("--topic", type=str, default="mad.bluesky.documents")
+    parser.add_argument("--runs_per_minute", type=float, default=1200)
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--n_runs", type=int, help="instead of --duration")
+    parser.add_argument("--points_per_run", type=int, default=1)
+    parser.add_argument("--n_points", type=int, default=100, help="per spectrum")
+    parser.add_argument("--block", type=int, default=100)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    from serializers import get_serializer
+
+    serializer = get_serializer().dumps
+    if args.sink == "local":
+        publish = LocalSink(serializer)
+    else:
+        from partitioning import RunKeyedPublisher
+
+        publish = RunKeyedPublisher(
+            topic=args.topic,
+            bootstrap_servers=args.bootstrap_servers,
+            # work with a single broker
+            producer_config={
+                "acks": 1,
+                "enable.idempotence": False,
+                "request.timeout.ms": 5000,
+                "compression.type": "lz4",
+                "linger.ms": 5,
+            },
+            serializer=serializer,
+        )
+    n_runs = args.n_runs
+    if n_runs is None:
+        if not args.runs_per_minute:
+            parser.error("--runs_per_minute 0 needs --n_runs")
+        n_runs = int(args.duration * args.runs_per_minute / 60)
+    done, seconds = generate(
+        publish,
+        n_runs=n_runs,
+        runs_per_minute=args.runs_per_minute,
+        points_per_run=args.points_per_run,
+        block=args.block,
+        n_points=args.n_points,
+        seed=args.seed,
+    )
+    publish.flush()
+    print(f"{done} runs in {seconds:.1f} s, {done / seconds * 60:.0f} runs/minute")
+    if args.sink == "local":
+        print(f"{publish.documents} documents, {publish.bytes / 1e6:.1f} MB encoded")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import numpy as np
+
+
+def perlin(x, y, seed=0):
+    """Perlin noise implementation.
+    https://stackoverflow.com/questions/42147776/producing-2d-perlin-noise-with-numpy
+
+    Reference implementation; reseeds the global NumPy RNG. Agents use PerlinNoise.
+    """
+
+    def lerp(a, b, x):
+        "linear interpolation"
+        return a + x * (b - a)
+
+    def fade(t):
+        "6t^5 - 15t^4 + 10t^3"
+        return 6 * t**5 - 15 * t**4 + 10 * t**3
+
+    def gradient(h, x, y):
+        "grad converts h to the right gradient vector and return the dot product with (x,y)"
+        vectors = np.array([[0, 1], [0, -1], [1, 0], [-1, 0]])
+        g = vectors[h % 4]
+        return g[:, :, 0] * x + g[:, :, 1] * y
+
+    # permutation table
+    np.random.seed(seed)
+    p = np.arange(256, dtype=int)
+    np.random.shuffle(p)
+    p = np.stack([p, p]).flatten()
+    # coordinates of the top-left
+    xi, yi = x.astype(int), y.astype(int)
+    # internal coordinates
+    xf, yf = x - xi, y - yi
+    # fade factors
+    u, v = fade(xf), fade(yf)
+    # noise components
+    n00 = gradient(p[p[xi] + yi], xf, yf)
+    n01 = gradient(p[p[xi] + yi + 1], xf, yf - 1)
+    n11 = gradient(p[p[xi + 1] + yi + 1], xf - 1, yf - 1)
+    n10 = gradient(p[p[xi + 1] + yi], xf - 1, yf)
+    # combine noises
+    x1 = lerp(n00, n10, u)
+    x2 = lerp(n01, n11, u)
+    return lerp(x1, x2, v)
+
+
+class PerlinNoise:
+    """Fractal Perlin noise on a fixed square grid, as summing ``perlin()`` over octaves does.
+
+    Octave ``i`` spans ``2**i`` lattice cells across the grid and is weighted by ``1 / 2**i``. The grid
+    is a tensor product, so the fractional coordinates and fade factors are kept per axis and computed
+    once. Each call draws fresh permutation tables (one per octave) from a private
+    ``np.random.Generator`` into a preallocated buffer, leaving the global NumPy RNG alone, hashes the
+    few lattice corners of all octaves in one pass, and expands the corner gradients to the grid with
+    ``np.repeat`` rather than hashing every point.
+
+    Parameters
+    ----------
+    size : int, optional
+        Points along each side of the grid.
+    octaves : int, optional
+        Number of octaves summed.
+    seed : int or np.random.SeedSequence, optional
+        Seed of the private generator; by default fresh entropy.
+    dtype : np.dtype, optional
+        Floating point type of the computation and of the result, e.g. np.float32.
+    """
+
+    # gradient vectors [[0, 1], [0, -1], [1, 0], [-1, 0]], indexed by hash % 4
+    _GRADIENT_X = np.array([0, 0, 1, -1])
+    _GRADIENT_Y = np.array([1, -1, 0, 0])
+
+    def __init__(self, size=100, octaves=4, *, seed=None, dtype=np.float64):
+        self.size = size
+        self.octaves = octaves
+        self.dtype = np.dtype(dtype)
+        self._rng = np.random.default_rng(seed)
+
+        self._freqs = 2 ** np.arange(octaves)
+        lin = np.stack([np.linspace(0, freq, size, endpoint=False) for freq in self._freqs])
+        cell = lin.astype(int)
+        # grid points in each lattice cell, along either axis
+        self._counts = [np.bincount(row, minlength=freq) for row, freq in zip(cell, self._freqs)]
+        # internal coordinates and fade factors, x along rows and y along columns as with np.meshgrid
+        frac = (lin - cell).astype(self.dtype)
+        fade = frac * frac * frac * (frac * (frac * 6 - 15) + 10)
+        self._x, self._y = frac[:, None, :], frac[:, :, None]
+        self._u, self._v = fade[:, None, :], fade[:, :, None]
+        self._weights = (1 / self._freqs).astype(self.dtype)
+        self._gx = self._GRADIENT_X.astype(self.dtype)
+        self._gy = self._GRADIENT_Y.astype(self.dtype)
+        self._lattice = np.arange(self._freqs[-1] + 1)
+        self._octave = np.arange(octaves)[:, None]
+        # permutation tables, doubled so p[p[x] + y] stays in range
+        self._base = np.broadcast_to(np.arange(256), (octaves, 256))
+        self._p = np.empty((octaves, 512), dtype=int)
+
+    def __call__(self):
+        """A new (size, size) noise field."""
+        p = self._p
+        self._rng.permuted(self._base, axis=1, out=p[:, :256])
+        p[:, 256:] = p[:, :256]
+        lattice, octave = self._lattice, self._octave
+        # gradient of every lattice corner, indexed [octave, y, x]
+        h = p[octave[:, :, None], p[octave, lattice][:, None, :] + lattice[None, :, None]] & 3
+        gx, gy = self._gx[h], self._gy[h]
+        noise = np.zeros((self.size, self.size), dtype=self.dtype)
+        for i, (freq, counts) in enumerate(zip(self._freqs, self._counts)):
+
+            def corner(g, dy, dx):
+                "The gradient component of one corner of each point's cell, over the grid."
+                return np.repeat(np.repeat(g[i, dy : dy + freq, dx : dx + freq], counts, 0), counts, 1)
+
+            x, y = self._x[i], self._y[i]
+            n00 = corner(gx, 0, 0) * x + corner(gy, 0, 0) * y
+            n10 = corner(gx, 0, 1) * (x - 1) + corner(gy, 0, 1) * y
+            n01 = corner(gx, 1, 0) * x + corner(gy, 1, 0) * (y - 1)
+            n11 = corner(gx, 1, 1) * (x - 1) + corner(gy, 1, 1) * (y - 1)
+            x1 = n00 + self._u[i] * (n10 - n00)
+            x2 = n01 + self._u[i] * (n11 - n01)
+            noise += self._weights[i] * (x1 + self._v[i] * (x2 - x1))
+        return noise
@@ -1,66 +1,77 @@
+import functools
+import json
 import logging
 import os
+import time
 import uuid
 from abc import ABC
+from collections import OrderedDict
 from typing import Dict
 
 import numpy as np
+from agent_writer import AsyncAgentCatalog
 from bluesky_adaptive.agents.base import Agent, AgentConsumer
 from bluesky_adaptive.server import register_variable, shutdown_decorator, startup_decorator
+from bluesky_queueserver_api import BPlan
 from bluesky_queueserver_api.http import REManagerAPI
 from databroker.client import BlueskyRun
 from httpx import ConnectError, HTTPStatusError
+from perlin_noise import PerlinNoise
+from serializers import get_serializer
 from tiled.client import from_profile, from_uri
 
 logger = logging.getLogger(__name__)
 
 
-def perlin(x, y, seed=0):
-    """Perlin noise implementation.
-    https://stackoverflow.com/questions/42147776/producing-2d-perlin-noise-with-numpy
-    """
-
-    def lerp(a, b, x):
-        "linear interpolation"
-        return a + x * (b - a)
-
-    def fade(t):
-        "6t^5 - 15t^4 + 10t^3"
-        return 6 * t**5 - 15 * t**4 + 10 * t**3
-
-    def gradient(h, x, y):
-        "grad converts h to the right gradient vector and return the dot product with (x,y)"
-        vectors = np.array([[0, 1], [0, -1], [1, 0], [-1, 0]])
-        g = vectors[h % 4]
-        return g[:, :, 0] * x + g[:, :, 1] * y
-
-    # permutation table
-    np.random.seed(seed)
-    p = np.arange(256, dtype=int)
-    np.random.shuffle(p)
-    p = np.stack([p, p]).flatten()
-    # coordinates of the top-left
-    xi, yi = x.astype(int), y.astype(int)
-    # internal coordinates
-    xf, yf = x - xi, y - yi
-    # fade factors
-    u, v = fade(xf), fade(yf)
-    # noise components
-    n00 = gradient(p[p[xi] + yi], xf, yf)
-    n01 = gradient(p[p[xi] + yi + 1], xf, yf - 1)
-    n11 = gradient(p[p[xi + 1] + yi + 1], xf - 1, yf - 1)
-    n10 = gradient(p[p[xi + 1] + yi], xf - 1, yf)
-    # combine noises
-    x1 = lerp(n00, n10, u)
-    x2 = lerp(n01, n11, u)
-    return lerp(x1, x2, v)
+@functools.lru_cache(maxsize=None)
+def tiled_client(uri="http://proxy:11973/tiled", api_key="ABCDABCD"):
+    """Tiled client shared by every agent in the process, so they reuse one HTTP connection pool."""
+    # Try to connect through the proxy, but if timing is an issue, go direct
+    try:
+        return from_uri(uri, api_key=api_key)
+    except (ConnectError, HTTPStatusError):
+        return from_profile("MAD")
 
 
 class PodBaseAgent(Agent, ABC):
-    def __init__(self, *args, metadata=None, **kwargs):
+    """
+    Parameters
+    ----------
+    batch_submit : bool, optional
+        Add all the plans of a suggestion batch to the queue with one `item_add_batch` request, skipping
+        points already pending in the queue, instead of one `item_add` request per point.
+    suggestion_batch_size : int, optional
+        Minimum number of points requested from `suggest` whenever suggestions are added to the queue,
+        including the single suggestion made on ingest.
+    async_writes : bool, optional
+        Write the agent's documents to Tiled from a background thread, in event pages, instead of one request
+        per document while deciding.
+    write_overflow : {"block", "drop"}, optional
+        With async_writes, whether a full write queue blocks the agent or drops the event.
+    write_dtype : np.dtype, optional
+        With async_writes, write float64 arrays (e.g. the reactive agent's brain) as this type.
+    """
+
+    def __init__(
+        self,
+        *args,
+        metadata=None,
+        batch_submit=True,
+        suggestion_batch_size=1,
+        async_writes=True,
+        write_overflow="block",
+        write_dtype=None,
+        **kwargs,
+    ):
+        self._batch_submit = batch_submit
+        self._suggestion_batch_size = suggestion_batch_size
         metadata = metadata or {}
         _default_kwargs = self.get_beamline_objects()
         _default_kwargs.update(kwargs)
+        if async_writes:
+            _default_kwargs["tiled_agent_node"] = AsyncAgentCatalog(
+                _default_kwargs["tiled_agent_node"], overflow=write_overflow, downcast=write_dtype
+            )
         super().__init__(*args, metadata=metadata, **_default_kwargs)
 
     @staticmethod
@@ -74,12 +85,9 @@ class PodBaseAgent(Agent, ABC):
             consumer_config={"auto.offset.reset": "earliest"},
             bootstrap_servers="kafka:29092",
             group_id=f"echo-{str(uuid.uuid4())[:8]}",
+            deserializer=get_serializer().loads,
         )
-        # Try to connect through the proxy, but if timing is an issue, go direct
-        try:
-            tiled_container = from_uri("http://proxy:11973/tiled", api_key="ABCDABCD")
-        except ConnectError or HTTPStatusError:
-            tiled_container = from_profile("MAD")
+        tiled_container = tiled_client()
         return dict(
             kafka_consumer=kafka_consumer,
             kafka_producer=None,
@@ -88,26 +96,93 @@ class PodBaseAgent(Agent, ABC):
             qserver=qs,
         )
 
+    @staticmethod
+    def _plan_key(name, args):
+        return name, json.dumps(args, default=float)
+
+    def _add_to_queue(self, next_points, uid, *, re_manager=None, position=None, plan_factory=None):
+        if not self._batch_submit:
+            return super()._add_to_queue(
+                next_points, uid, re_manager=re_manager, position=position, plan_factory=plan_factory
+            )
+        re_manager = self.re_manager if re_manager is None else re_manager
+        plan_factory = plan_factory or self.measurement_plan
+        # the queue is only re-downloaded when it changed since the last request
+        queue = re_manager.queue_get()
+        pending = [*queue["items"], *([queue["running_item"]] if queue.get("running_item") else [])]
+        pending_keys = {self._plan_key(item.get("name"), item.get("args", [])) for item in pending}
+        plans = []
+        for point in next_points:
+            plan_name, args, kwargs = plan_factory(point)
+            key = self._plan_key(plan_name, args)
+            if key in pending_keys:
+                logger.info(f"Point {point} is already pending in the queue, not adding it again")
+                continue
+            pending_keys.add(key)
+            kwargs.setdefault("md", {})
+            kwargs["md"].update(self.default_plan_md)
+            kwargs["md"]["agent_suggestion_uid"] = uid
+            plans.append(BPlan(plan_name, *args, **kwargs))
+        if not plans:
+            return
+        r = re_manager.item_add_batch(plans, pos=self.queue_add_position if position is None else position)
+        if not r["success"]:
+            logger.warning(f"Adding {len(plans)} plans to the queue failed: {r['msg']}")
+        logger.debug(f"Sent http-server request for {len(plans)} points.\nReceived reponse: {r}")
+
+    def add_suggestions_to_queue(self, batch_size: int):
+        super().add_suggestions_to_queue(max(batch_size, self._suggestion_batch_size))
+
+    @property
+    def batch_submit(self):
+        return self._batch_submit
+
+    @batch_submit.setter
+    def batch_submit(self, value):
+        self._batch_submit = bool(value)
+
+    @property
+    def suggestion_batch_size(self):
+        return self._suggestion_batch_size
+
+    @suggestion_batch_size.setter
+    def suggestion_batch_size(self, value):
+        self._suggestion_batch_size = int(value)
+
+    @property
+    def document_writer(self):
+        """Queue depth, drops and write latency of the async document writes, empty without them."""
+        if isinstance(self.agent_catalog, AsyncAgentCatalog):
+            return self.agent_catalog.metrics
+        return {}
+
+    def close_document_writer(self, timeout=30):
+        """Write out the queued documents and stop the writer thread, when exiting."""
+        if isinstance(self.agent_catalog, AsyncAgentCatalog):
+            self.agent_catalog.close(timeout)
+
+    def server_registrations(self) -> None:
+        super().server_registrations()
+        self._register_property("batch_submit", pv_type="bool")
+        self._register_property("suggestion_batch_size", pv_type="int")
+        register_variable("document_writer", getter=lambda: self.document_writer)
+
 
 class ReactiveAgent(Agent, ABC):
     """Build the Logic for the Reactive Random Walk Agent, that reacts to an observable and increases or decreases
     some position. This is only logic, but system agnostic."""
 
-    def __init__(self, *, target, step_size=0.1, **kwargs):
+    def __init__(self, *, target, step_size=0.1, step_decay=0.5, noise_dtype=np.float64, **kwargs):
         super().__init__(**kwargs)
         self._target = target
         self._step_size = step_size
+        self._step_decay = step_decay
         self._last_value = None
+        # 4 octaves of 100x100 perlin noise, grids built once
+        self._noise = PerlinNoise(100, 4, dtype=noise_dtype)
 
-    @staticmethod
-    def _make_perlin_noise():
-        perlin_noise = np.zeros((100, 100))
-        for i in range(4):
-            freq = 2**i
-            lin = np.linspace(0, freq, 100, endpoint=False)
-            x, y = np.meshgrid(lin, lin)  # FIX3: I thought I had to invert x and y here but it was a mistake
-            perlin_noise = perlin(x, y, seed=None) / freq + perlin_noise
-        return perlin_noise
+    def _make_perlin_noise(self):
+        return self._noise()
 
     def ingest(self, x, y):
         self._last_value = y
@@ -121,47 +196,30 @@ class ReactiveAgent(Agent, ABC):
         )
 
     def suggest(self, n):
-        """Generates a reactive walk, but logs some perlin noise as a proxy for decision logic"""
+        """Generates a reactive walk of n points, but logs some perlin noise as a proxy for decision logic
+
+        The walk moves toward the target with steps of step_size, each step_decay times the previous one.
+        Before any observation it starts at 0 and fans out to both sides.
+        """
+        steps = np.cumsum(self._step_size * self._step_decay ** np.arange(n))
         if self._last_value is None:
-            return (
-                [
-                    dict(
-                        target=self._target,
-                        step_size=self._step_size,
-                        next_value=0.0,
-                        brain=self._make_perlin_noise(),
-                    )
-                ],
-                [0.0],
-            )
+            # 0, +s1, -s1, +s2, -s2, ...
+            k = np.arange(n)
+            next_values = np.where(k % 2, 1, -1) * np.concatenate([[0.0], steps])[(k + 1) // 2] + 0.0
         elif self._last_value > self._target:
-            next_value = self._last_value - self._step_size
-            logger.info(f"Decreasing value from {self._last_value} to {next_value}")
-            return (
-                [
-                    dict(
-                        target=self._target,
-                        step_size=self._step_size,
-                        next_value=next_value,
-                        brain=self._make_perlin_noise(),
-                    )
-                ],
-                [next_value],
-            )
+            next_values = self._last_value - steps
+            logger.info(f"Decreasing value from {self._last_value} to {next_values.tolist()}")
         else:
-            next_value = self._last_value + self._step_size
-            logger.info(f"Increasing value from {self._last_value} to {next_value}")
-            return (
-                [
-                    dict(
-                        target=self._target,
-                        step_size=self._step_size,
-                        next_value=next_value,
-                        brain=self._make_perlin_noise(),
-                    )
-                ],
-                [next_value],
-            )
+            next_values = self._last_value + steps
+            logger.info(f"Increasing value from {self._last_value} to {next_values.tolist()}")
+        # one decision, so one brain shared by the batch
+        brain = self._make_perlin_noise()
+        next_values = next_values.tolist()
+        docs = [
+            dict(target=self._target, step_size=self._step_size, next_value=next_value, brain=brain)
+            for next_value in next_values
+        ]
+        return docs, next_values
 
     @property
     def target(self):
@@ -179,25 +237,154 @@ class ReactiveAgent(Agent, ABC):
     def step_size(self, value):
         self._step_size = value
 
+    @property
+    def step_decay(self):
+        return self._step_decay
+
+    @step_decay.setter
+    def step_decay(self, value):
+        self._step_decay = value
+
     def server_registrations(self) -> None:
         super().server_registrations()
         self._register_property("target")
         self._register_property("step_size")
+        self._register_property("step_decay")
 
 
 class ReactiveRandomWalker(ReactiveAgent, PodBaseAgent):
-    def __init__(self, *, detector="random_walk", read_key="random_walk_x", motor="motor", **kwargs):
+    """
+    Parameters
+    ----------
+    ingest_from_kafka : bool, optional
+        Take x/y from the primary event documents the Kafka consumer already receives, instead of
+        reading the run back from Tiled once it stops. Runs whose events were missed (e.g. `ingest_uids`)
+        still go through Tiled.
+    """
+
+    def __init__(
+        self,
+        *,
+        detector="random_walk",
+        read_key="random_walk_x",
+        motor="motor",
+        ingest_from_kafka=False,
+        **kwargs,
+    ):
         self._detector = detector
         self._motor = motor
         self._read_key = read_key
+        self._ingest_from_kafka = ingest_from_kafka
+        # primary descriptor uid -> run start uid, for runs in progress
+        self._primary_descriptors = {}
+        # run start uid -> latest {field: value} of the primary stream
+        self._event_values = OrderedDict()
+        # ingest path -> [count, total seconds, max seconds, last seconds]
+        self._ingest_latency = {}
+        # "batched" or "single" submission -> same, for the gaps between runs
+        self._queue_idle = {}
+        self._last_stop_time = None
         super().__init__(**kwargs)
+        self.kafka_consumer.subscribe(self._collect_events)
 
     def unpack_run(self, run: BlueskyRun):
-        data = run.primary.data.read()
+        # Fetch only the two columns, not every (possibly image) field of the stream
+        data = run.primary.data.read(variables=[self._motor, self._read_key])
         x = float(data[self._motor].data)
         y = float(data[self._read_key].data)
         return x, y
 
+    def _collect_events(self, name, doc):
+        """Keep the latest motor/detector values of each run's primary stream, from the Kafka documents.
+        Also time the queue's idle gaps, from each stop document to the next start document."""
+        if name == "start":
+            if self._last_stop_time is not None:
+                mode = "batched" if self._batch_submit else "single"
+                self._accumulate(self._queue_idle, mode, doc["time"] - self._last_stop_time)
+                self._last_stop_time = None
+        elif name == "descriptor":
+            if doc.get("name") == "primary":
+                self._primary_descriptors[doc["uid"]] = doc["run_start"]
+        elif name in ("event", "event_page"):
+            run_uid = self._primary_descriptors.get(doc["descriptor"])
+            if run_uid is None:
+                return
+            values = self._event_values.setdefault(run_uid, {})
+            for key in (self._motor, self._read_key):
+                if key in doc["data"]:
+                    value = doc["data"][key]
+                    values[key] = value[-1] if name == "event_page" else value
+            # bound the memory of runs that are never ingested
+            while len(self._event_values) > 100:
+                self._event_values.popitem(last=False)
+        elif name == "stop":
+            self._last_stop_time = doc["time"]
+            for descriptor_uid, run_uid in list(self._primary_descriptors.items()):
+                if run_uid == doc["run_start"]:
+                    del self._primary_descriptors[descriptor_uid]
+
+    def _ingest_uid(self, uid):
+        t0 = time.perf_counter()
+        values = self._event_values.pop(uid, {})
+        if not (self._ingest_from_kafka and self._motor in values and self._read_key in values):
+            super()._ingest_uid(uid)
+            self._record_latency("tiled", time.perf_counter() - t0)
+            return
+        doc = self.ingest(float(values[self._motor]), float(values[self._read_key]))
+        doc["exp_uid"] = uid
+        self._write_event("ingest", doc)
+        self.known_uid_cache.append(uid)
+        self._record_latency("kafka", time.perf_counter() - t0)
+
+    def _record_latency(self, path, seconds):
+        self._accumulate(self._ingest_latency, path, seconds)
+        logger.info(f"Ingested run from {path} in {seconds * 1e3:.1f} ms")
+
+    @staticmethod
+    def _accumulate(stats, key, seconds):
+        entry = stats.setdefault(key, [0, 0.0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        entry[3] = seconds
+
+    @staticmethod
+    def _summary(stats, unit, scale):
+        return {
+            key: {
+                "count": n,
+                f"mean_{unit}": total / n * scale,
+                f"max_{unit}": worst * scale,
+                f"last_{unit}": last * scale,
+            }
+            for key, (n, total, worst, last) in stats.items()
+        }
+
+    @property
+    def ingest_from_kafka(self):
+        return self._ingest_from_kafka
+
+    @ingest_from_kafka.setter
+    def ingest_from_kafka(self, value):
+        self._ingest_from_kafka = bool(value)
+
+    @property
+    def ingest_latency(self):
+        """Per ingest path ("tiled" or "kafka"): count, mean, max and last latency in ms,
+        from handling the stop document to writing the ingest event."""
+        return self._summary(self._ingest_latency, "ms", 1e3)
+
+    @property
+    def queue_idle(self):
+        """Idle gaps of the queue between runs, in s, by whether suggestions were submitted in batches."""
+        return self._summary(self._queue_idle, "s", 1)
+
+    def server_registrations(self) -> None:
+        super().server_registrations()
+        self._register_property("ingest_from_kafka", pv_type="bool")
+        register_variable("ingest_latency", getter=lambda: self.ingest_latency)
+        register_variable("queue_idle", getter=lambda: self.queue_idle)
+
     def measurement_plan(self, point):
         return "scan", [[self._detector], self._motor, point, point, 1], {}
 
@@ -213,7 +400,12 @@ def startup():
 
 @shutdown_decorator
 def shutdown_agent():
-    return agent.stop()
+    # stop() inserts the stop document, then flushes the agent's kafka_producer,
+    # which is None here and raises; the queued documents are written regardless
+    try:
+        agent.stop()
+    finally:
+        agent.close_document_writer()
 
 
 register_variable("Agent Name", agent, "instance_name")
@@ -0,0 +1,108 @@
+"""Re-ingest many runs into an agent, fetching them from Tiled concurrently."""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def catalog_uids(catalog, page_size: int = 256) -> Iterator[str]:
+    """Run uids of a Tiled catalog, requested a page at a time."""
+    offset = 0
+    while True:
+        page = list(catalog.keys()[offset : offset + page_size])
+        if not page:
+            return
+        yield from page
+        offset += len(page)
+
+
+class ParallelReingest:
+    """Re-ingest runs into an agent, as ``Agent.ingest_uids`` does, without fetching them one at a time.
+
+    Runs are fetched from ``agent.exp_catalog`` and unpacked on a bounded thread pool, a page of uids at a
+    time, then handed to ``agent.ingest_many`` in one call, so an agent can fit its model once instead of per
+    run. An ingest event is written for each run, as with a regular ingest. Runs that fail to fetch or unpack
+    are logged and skipped.
+
+    Parameters
+    ----------
+    agent : bluesky_adaptive.agents.base.Agent
+    max_workers : int, optional
+        Runs fetched and unpacked at once.
+    page_size : int, optional
+        Uids requested from the catalog, and runs in flight, at a time.
+    """
+
+    def __init__(self, agent, *, max_workers: int = 8, page_size: int = 256):
+        self.agent = agent
+        self.max_workers = max_workers
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._progress = dict(state="idle", total=None, fetched=0, failed=0, ingested=0, elapsed_s=0.0)
+        self._t0 = None
+
+    @property
+    def progress(self) -> dict:
+        """State, run counts, elapsed time and runs/s of the current or last reingest."""
+        with self._lock:
+            progress = dict(self._progress)
+        if progress["state"] == "fetching":
+            progress["elapsed_s"] = time.monotonic() - self._t0
+        done = progress["fetched"] + progress["failed"]
+        progress["runs_per_s"] = done / progress["elapsed_s"] if progress["elapsed_s"] else 0.0
+        return progress
+
+    def _update(self, **kwargs):
+        with self._lock:
+            self._progress.update(kwargs)
+
+    def _fetch(self, uid):
+        try:
+            x, y = self.agent.unpack_run(self.agent.exp_catalog[uid])
+        except Exception as e:
+            logger.warning(f"Ignoring run {uid} that could not be reingested: {e!r}")
+            with self._lock:
+                self._progress["failed"] += 1
+            return None
+        with self._lock:
+            self._progress["fetched"] += 1
+        return uid, x, y
+
+    def __call__(self, uids: Optional[Iterable[str]] = None) -> list:
+        """Re-ingest uids, or every run of the catalog, and return the uids ingested."""
+        if uids is None:
+            uids = catalog_uids(self.agent.exp_catalog, self.page_size)
+            total = None
+        else:
+            uids = list(uids)
+            total = len(uids)
+        self._t0 = time.monotonic()
+        self._update(state="fetching", total=total, fetched=0, failed=0, ingested=0, elapsed_s=0.0)
+        logger.info(f"Reingesting {'all' if total is None else total} runs with {self.max_workers} workers")
+        runs = []
+        uids = iter(uids)
+        with ThreadPoolExecutor(self.max_workers, thread_name_prefix="reingest") as executor:
+            while page := list(islice(uids, self.page_size)):
+                runs.extend(run for run in executor.map(self._fetch, page) if run is not None)
+        self._update(state="ingesting", elapsed_s=time.monotonic() - self._t0)
+        if runs:
+            done, xs, ys = zip(*runs)
+            docs = self.agent.ingest_many(list(xs), list(ys))
+            for uid, doc in zip(done, docs):
+                doc["exp_uid"] = uid
+                self.agent._write_event("ingest", doc)
+                self.agent.known_uid_cache.append(uid)
+        else:
+            done = ()
+        self._update(state="done", ingested=len(done), elapsed_s=time.monotonic() - self._t0)
+        progress = self.progress
+        logger.info(
+            f"Reingested {len(done)} runs ({progress['failed']} failed) in {progress['elapsed_s']:.1f} s, "
+            f"{progress['runs_per_s']:.0f} runs/s"
+        )
+        return list(done)